@@ -25,7 +25,9 @@ from flask import (
 )
 from bson.objectid import ObjectId
 
-from data_manager import mongo_db
+from data_manager import mongo_db, carregar_resumos_usuarios
+from data_notificacoes import criar_notificacao
+from data_desafios import sincronizar_profissional_desafios
 
 logger = logging.getLogger("AURA_ADMIN")
 
@@ -34,17 +36,7 @@ def _notificar_pedido(user_id: str, pedido_id: str, mensagem: str):
     """Insere notificação de mercado sem quebrar o fluxo principal."""
     if not user_id:
         return
-    try:
-        mongo_db["notificacoes"].insert_one({
-            "user_id":    user_id,
-            "tipo":       "mercado",
-            "mensagem":   mensagem,
-            "meta":       {"pedido_id": pedido_id, "acao": "abrir_pedido"},
-            "lida":       False,
-            "created_at": datetime.now().isoformat()
-        })
-    except Exception as e:
-        logger.error(f"Erro ao criar notificação do pedido {pedido_id}: {e}")
+    criar_notificacao(user_id, "mercado", mensagem, {"pedido_id": pedido_id, "acao": "abrir_pedido"})
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -67,33 +59,23 @@ def _admin_required(f):
 # ===================================================
 
 def _buscar_nome_usuario(user_id: str) -> str:
-    """Retorna o nome do usuário na coleção 'usuarios' pelo user_id."""
+    """Retorna o nome do usuário (servido do cache da request quando pré-carregado)."""
     if not user_id or mongo_db is None:
         return "Desconhecido"
-    try:
-        doc = mongo_db["usuarios"].find_one(
-            {"_id": ObjectId(user_id)},
-            {"nome": 1, "cpf": 1}
-        )
-        if doc:
-            return doc.get("nome") or "Sem nome"
-        return "Não encontrado"
-    except Exception:
+    if not ObjectId.is_valid(user_id):
         return "—"
+    doc = carregar_resumos_usuarios([user_id], campos_extras=["cpf"]).get(user_id)
+    if doc:
+        return doc.get("nome") or "Sem nome"
+    return "Não encontrado"
 
 
 def _buscar_cpf_usuario(user_id: str) -> str:
     """Retorna o CPF do usuário se disponível."""
-    if not user_id or mongo_db is None:
-        return ""
-    try:
-        doc = mongo_db["usuarios"].find_one(
-            {"_id": ObjectId(user_id)},
-            {"cpf": 1}
-        )
-        return doc.get("cpf", "") if doc else ""
-    except Exception:
+    if not user_id or mongo_db is None or not ObjectId.is_valid(user_id):
         return ""
+    doc = carregar_resumos_usuarios([user_id], campos_extras=["cpf"]).get(user_id)
+    return doc.get("cpf", "") if doc else ""
 
 
 def _formatar_endereco(end: dict) -> dict:
@@ -763,7 +745,9 @@ def pedidos():
             if filtro_fornecedor:
                 query["fornecedor"] = filtro_fornecedor
 
-            cursor = mongo_db["pedidos"].find(query).sort("created_at", -1).limit(200)
+            cursor = list(mongo_db["pedidos"].find(query).sort("created_at", -1).limit(200))
+            # Pré-carrega nome/CPF de todos os clientes numa única query
+            carregar_resumos_usuarios((p.get("user_id", "") for p in cursor), campos_extras=["cpf"])
 
             for p in cursor:
                 p["_id_str"] = str(p["_id"])
@@ -954,18 +938,16 @@ def aprovar_profissional(user_id):
             {"user_id": user_id},
             {"$set": {"status_verificacao": "aprovado", "verificado": True}}
         )
+        sincronizar_profissional_desafios(user_id)
         mongo_db["usuarios"].update_one(
             {"_id": ObjectId(user_id)},
             {"$set": {"tipo_perfil": "profissional"}}
         )
-        mongo_db["notificacoes"].insert_one({
-            "user_id": user_id,
-            "tipo": "sistema",
-            "mensagem": "🎉 Parabéns! Seu cadastro profissional foi aprovado! Agora você pode criar desafios e atender alunos na AURA.",
-            "meta": {"acao": "profissional_aprovado"},
-            "lida": False,
-            "created_at": datetime.now().isoformat()
-        })
+        criar_notificacao(
+            user_id, "sistema",
+            "🎉 Parabéns! Seu cadastro profissional foi aprovado! Agora você pode criar desafios e atender alunos na AURA.",
+            {"acao": "profissional_aprovado"}
+        )
         logger.info(f"✅ Profissional {user_id} aprovado.")
         return redirect("/admin/profissionais?msg=aprovado")
     except Exception as e:
@@ -981,18 +963,16 @@ def rejeitar_profissional(user_id):
             {"user_id": user_id},
             {"$set": {"status_verificacao": "rejeitado", "verificado": False}}
         )
+        sincronizar_profissional_desafios(user_id)
         mongo_db["usuarios"].update_one(
             {"_id": ObjectId(user_id)},
             {"$set": {"tipo_perfil": "atleta"}}
         )
-        mongo_db["notificacoes"].insert_one({
-            "user_id": user_id,
-            "tipo": "sistema",
-            "mensagem": "⚠️ Seu cadastro profissional não foi aprovado desta vez. Verifique suas informações e tente novamente.",
-            "meta": {"acao": "profissional_rejeitado"},
-            "lida": False,
-            "created_at": datetime.now().isoformat()
-        })
+        criar_notificacao(
+            user_id, "sistema",
+            "⚠️ Seu cadastro profissional não foi aprovado desta vez. Verifique suas informações e tente novamente.",
+            {"acao": "profissional_rejeitado"}
+        )
         logger.info(f"❌ Profissional {user_id} rejeitado.")
         return redirect("/admin/profissionais?msg=rejeitado")
     except Exception as e:
@@ -1036,14 +1016,12 @@ def aprovar_verificacao(user_id):
             {"user_id": user_id},
             {"$set": {"status_verificacao": "verificado", "verificado": True}}
         )
-        mongo_db["notificacoes"].insert_one({
-            "user_id": user_id,
-            "tipo": "sistema",
-            "mensagem": "✅ Suas credenciais foram verificadas! Você agora tem o selo de verificado na AURA.",
-            "meta": {"acao": "credenciais_verificadas"},
-            "lida": False,
-            "created_at": datetime.now().isoformat()
-        })
+        sincronizar_profissional_desafios(user_id)
+        criar_notificacao(
+            user_id, "sistema",
+            "✅ Suas credenciais foram verificadas! Você agora tem o selo de verificado na AURA.",
+            {"acao": "credenciais_verificadas"}
+        )
         return redirect("/admin/verificacoes?msg=aprovado")
     except Exception as e:
         return f"Erro: {e}", 500
@@ -1057,14 +1035,12 @@ def rejeitar_verificacao(user_id):
             {"user_id": user_id},
             {"$set": {"status_verificacao": "pendente", "verificacao_paga": False}}
         )
-        mongo_db["notificacoes"].insert_one({
-            "user_id": user_id,
-            "tipo": "sistema",
-            "mensagem": "⚠️ Suas credenciais não foram verificadas. Entre em contato com o suporte.",
-            "meta": {"acao": "credenciais_rejeitadas"},
-            "lida": False,
-            "created_at": datetime.now().isoformat()
-        })
+        sincronizar_profissional_desafios(user_id)
+        criar_notificacao(
+            user_id, "sistema",
+            "⚠️ Suas credenciais não foram verificadas. Entre em contato com o suporte.",
+            {"acao": "credenciais_rejeitadas"}
+        )
         return redirect("/admin/verificacoes?msg=rejeitado")
     except Exception as e:
         return f"Erro: {e}", 500
@@ -0,0 +1,154 @@
+"""
+auth_jwt.py — Autenticação JWT única para todos os blueprints (/api, /api/performance).
+
+- Um só segredo/algoritmo (JWT_SECRET, HS256) para emitir e verificar.
+- Cache LRU por worker de token → claims já verificados: a assinatura HMAC é
+  conferida uma vez e a entrada vale até o menor entre 'exp' e JWT_CACHE_TTL.
+- Revogação (logout) por deny-list compacta em 'jwt_revogados' (jti + expira_em
+  com índice TTL). A deny-list é consultada só quando o token não está em cache;
+  outros workers deixam de aceitar um token revogado em até JWT_CACHE_TTL segundos.
+- O decorator expõe o usuário em flask.g.current_user_id e o passa como 1º argumento.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Dict, Any, Optional
+
+import jwt
+from flask import request, jsonify, g
+
+from data_manager import mongo_db
+
+logger = logging.getLogger("AURA_AUTH")
+
+JWT_SECRET    = os.getenv("JWT_SECRET", "aura-mude-esta-chave-em-producao")
+JWT_ALGORITHM = "HS256"
+JWT_EXP_DAYS  = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES_DAYS", 30))
+
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", 60))   # segundos
+JWT_CACHE_MAX = int(os.getenv("JWT_CACHE_MAX", 10000))  # tokens por worker
+
+COLECAO_REVOGADOS = "jwt_revogados"
+
+_cache_tokens: "OrderedDict[str, tuple]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def gerar_token_jwt(user_id: str) -> str:
+    """Gera um token JWT assinado. Validade lida de JWT_ACCESS_TOKEN_EXPIRES_DAYS no .env."""
+    payload = {
+        "user_id": str(user_id),
+        "jti": secrets.token_hex(8),
+        "iat": datetime.utcnow(),
+        "exp": datetime.utcnow() + timedelta(days=JWT_EXP_DAYS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+def _chave_revogacao(token: str, claims: Dict[str, Any]) -> str:
+    """jti do token; tokens antigos (sem jti) usam um hash curto do próprio token."""
+    return claims.get("jti") or hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def _revogado(chave: str) -> bool:
+    if mongo_db is None:
+        return False
+    try:
+        return mongo_db[COLECAO_REVOGADOS].find_one({"_id": chave}, {"_id": 1}) is not None
+    except Exception as e:
+        # Deny-list indisponível não derruba a autenticação
+        logger.error(f"❌ Erro ao consultar tokens revogados: {e}")
+        return False
+
+
+def verificar_token(token: str) -> Dict[str, Any]:
+    """
+    Claims do token válido (do cache quando possível).
+    Raises jwt.ExpiredSignatureError / jwt.InvalidTokenError.
+    """
+    agora = time.time()
+    with _cache_lock:
+        em_cache = _cache_tokens.get(token)
+        if em_cache:
+            if agora < em_cache[0]:
+                _cache_tokens.move_to_end(token)
+                return em_cache[1]
+            del _cache_tokens[token]
+
+    claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    if _revogado(_chave_revogacao(token, claims)):
+        raise jwt.InvalidTokenError("token revogado")
+
+    valido_ate = min(float(claims.get("exp", agora)), agora + JWT_CACHE_TTL)
+    with _cache_lock:
+        _cache_tokens[token] = (valido_ate, claims)
+        _cache_tokens.move_to_end(token)
+        while len(_cache_tokens) > JWT_CACHE_MAX:
+            _cache_tokens.popitem(last=False)
+    return claims
+
+
+def revogar_token(token: str) -> bool:
+    """Coloca o token na deny-list até o seu 'exp'. False se o token já não é válido."""
+    try:
+        claims = verificar_token(token)
+    except jwt.InvalidTokenError:
+        return False
+
+    with _cache_lock:
+        _cache_tokens.pop(token, None)
+    if mongo_db is None:
+        return False
+    mongo_db[COLECAO_REVOGADOS].update_one(
+        {"_id": _chave_revogacao(token, claims)},
+        {"$set": {
+            "user_id":   claims.get("user_id", ""),
+            "expira_em": datetime.utcfromtimestamp(float(claims.get("exp", time.time()))),
+        }},
+        upsert=True
+    )
+    return True
+
+
+def token_do_request() -> Optional[str]:
+    """Token do header 'Authorization: Bearer <token>' (None se ausente)."""
+    auth_header = request.headers.get("Authorization", "")
+    partes = auth_header.split(" ")
+    return partes[1] if len(partes) > 1 and partes[1] else None
+
+
+# ===================================================
+# 🔐 MIDDLEWARE DE AUTENTICAÇÃO (JWT NATIVO)
+# ===================================================
+
+def token_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if "Authorization" in request.headers and " " not in request.headers["Authorization"]:
+            return jsonify({"erro": "Token mal formatado"}), 401
+
+        token = token_do_request()
+        if not token:
+            return jsonify({"erro": "Token ausente"}), 401
+
+        try:
+            payload = verificar_token(token)
+            current_user_id = payload.get("user_id")
+            if not current_user_id:
+                return jsonify({"erro": "Token inválido: user_id ausente"}), 401
+        except jwt.ExpiredSignatureError:
+            return jsonify({"erro": "Sessão expirada. Faça login novamente."}), 401
+        except jwt.InvalidTokenError:
+            # Token inválido, adulterado ou revogado — rejeita sem fallback
+            return jsonify({"erro": "Token inválido. Faça login novamente."}), 401
+
+        g.current_user_id = current_user_id
+        return f(current_user_id, *args, **kwargs)
+    return decorated
@@ -0,0 +1,361 @@
+import logging
+import time
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import DESCENDING
+from pymongo.collation import Collation
+from pymongo.errors import DuplicateKeyError
+
+# Importações do Data Manager (MongoDB)
+from data_manager import mongo_db
+
+# Configuração de Logs
+logger = logging.getLogger("AURA_DATA_CLAS")
+
+# ==============================================================
+# ⚔️ CAMADA DE DADOS DE MEMBROS DE CLÃ (coleção 'cla_membros')
+# ==============================================================
+# Um documento por (cla_id, user_id). Substitui os arrays embutidos
+# Clas.membros / Clas.solicitacoes_pendentes, que cresciam sem limite.
+# Solicitações de clã fechado ficam na mesma coleção com cargo "pendente".
+# Clas.num_membros é mantido via $inc a cada entrada/saída efetiva.
+
+COLECAO_MEMBROS = "cla_membros"
+
+CARGO_PENDENTE = "pendente"
+CARGOS_MEMBRO = ("owner", "co-leader", "member")
+CARGOS_LIDERANCA = ("owner", "co-leader")
+
+# Nome de clã único ignorando maiúsculas e acentos ("Força" == "forca").
+# O mesmo collation precisa ir nas queries para o índice ser usado.
+COLACAO_NOME_CLA = Collation(locale="pt", strength=1)
+INDICE_NOME_CLA = "nome_unico_ci"
+
+_indice_nome_cache: dict = {"ativo": False, "ts": 0.0}
+_INDICE_NOME_CACHE_TTL = 300  # segundos (só enquanto o índice não existe)
+
+
+def _indice_nome_ativo() -> bool:
+    """Índice único de nome presente? Uma vez criado não some; ausência é rechecada a cada TTL."""
+    agora = time.time()
+    if _indice_nome_cache["ativo"] or (agora - _indice_nome_cache["ts"]) < _INDICE_NOME_CACHE_TTL:
+        return _indice_nome_cache["ativo"]
+    try:
+        _indice_nome_cache["ativo"] = INDICE_NOME_CLA in mongo_db["Clas"].index_information()
+    except Exception as e:
+        logger.error(f"❌ Erro ao verificar índice {INDICE_NOME_CLA}: {e}")
+    _indice_nome_cache["ts"] = agora
+    if not _indice_nome_cache["ativo"]:
+        logger.error(f"❌ Índice {INDICE_NOME_CLA} ausente: unicidade de nome por checagem prévia "
+                     f"(rodar migracoes.py unificar_nomes_clas)")
+    return _indice_nome_cache["ativo"]
+
+
+def nome_cla_em_uso(nome: str, excluir_id: str = "") -> bool:
+    """
+    Fallback enquanto o índice único não existe (nomes duplicados legados).
+    Com o índice, retorna False e a unicidade vem do DuplicateKeyError.
+    """
+    if mongo_db is None or _indice_nome_ativo():
+        return False
+    filtro: Dict[str, Any] = {"nome": nome}
+    if excluir_id and ObjectId.is_valid(excluir_id):
+        filtro["_id"] = {"$ne": ObjectId(excluir_id)}
+    return mongo_db["Clas"].find_one(filtro, {"_id": 1}, collation=COLACAO_NOME_CLA) is not None
+
+
+def _inc_num_membros(cla_id: str, delta: int):
+    mongo_db["Clas"].update_one(
+        {"_id": ObjectId(cla_id)},
+        {"$inc": {"num_membros": delta}, "$set": {"updated_at": datetime.now().isoformat()}}
+    )
+    invalidar_resumo_cla(cla_id)
+
+
+def obter_cargo(cla_id: str, user_id: str) -> Optional[str]:
+    """Cargo do usuário no clã ("owner" | "co-leader" | "member" | "pendente") ou None."""
+    if mongo_db is None or not cla_id or not user_id:
+        return None
+    doc = mongo_db[COLECAO_MEMBROS].find_one(
+        {"cla_id": cla_id, "user_id": user_id}, {"cargo": 1}
+    )
+    return doc.get("cargo") if doc else None
+
+
+def eh_membro(cla_id: str, user_id: str) -> bool:
+    return obter_cargo(cla_id, user_id) in CARGOS_MEMBRO
+
+
+def adicionar_membro(cla_id: str, user_id: str, cargo: str = "member") -> bool:
+    """
+    Torna o usuário membro do clã (promovendo uma solicitação pendente, se houver).
+    Retorna False se ele já era membro. num_membros só muda em entradas efetivas.
+    """
+    agora = datetime.now().isoformat()
+    try:
+        mongo_db[COLECAO_MEMBROS].insert_one({
+            "cla_id":          cla_id,
+            "user_id":         user_id,
+            "cargo":           cargo,
+            "xp_contribuicao": 0,
+            "joined_at":       agora,
+        })
+    except DuplicateKeyError:
+        promovido = mongo_db[COLECAO_MEMBROS].update_one(
+            {"cla_id": cla_id, "user_id": user_id, "cargo": CARGO_PENDENTE},
+            {"$set": {"cargo": cargo, "xp_contribuicao": 0, "joined_at": agora}}
+        )
+        if promovido.modified_count == 0:
+            return False
+    _inc_num_membros(cla_id, 1)
+    return True
+
+
+def remover_membro(cla_id: str, user_id: str) -> bool:
+    """Remove o membro (não afeta solicitações pendentes). True se removeu."""
+    resultado = mongo_db[COLECAO_MEMBROS].delete_one(
+        {"cla_id": cla_id, "user_id": user_id, "cargo": {"$in": list(CARGOS_MEMBRO)}}
+    )
+    if resultado.deleted_count:
+        _inc_num_membros(cla_id, -1)
+        return True
+    return False
+
+
+def definir_cargo(cla_id: str, user_id: str, cargo: str) -> bool:
+    """Altera o cargo de um membro existente. False se ele não for membro."""
+    resultado = mongo_db[COLECAO_MEMBROS].update_one(
+        {"cla_id": cla_id, "user_id": user_id, "cargo": {"$in": list(CARGOS_MEMBRO)}},
+        {"$set": {"cargo": cargo}}
+    )
+    return resultado.matched_count > 0
+
+
+def listar_membros(cla_id: str, limite: int = 0) -> List[Dict[str, Any]]:
+    """Membros do clã por cargo e contribuição (índice cla_id+cargo+xp_contribuicao)."""
+    cursor = mongo_db[COLECAO_MEMBROS].find(
+        {"cla_id": cla_id, "cargo": {"$in": list(CARGOS_MEMBRO)}},
+        {"_id": 0, "user_id": 1, "cargo": 1, "xp_contribuicao": 1, "joined_at": 1}
+    ).sort([("cargo", 1), ("xp_contribuicao", DESCENDING)])
+    if limite:
+        cursor = cursor.limit(limite)
+    return list(cursor)
+
+
+# ──────────────────────────────────────────────────────────────
+# Solicitações de entrada (clã fechado)
+# ──────────────────────────────────────────────────────────────
+
+def registrar_solicitacao(cla_id: str, user_id: str, nome: str, nivel: int) -> bool:
+    """Cria a solicitação pendente. False se já existe solicitação ou vínculo."""
+    try:
+        mongo_db[COLECAO_MEMBROS].insert_one({
+            "cla_id":        cla_id,
+            "user_id":       user_id,
+            "cargo":         CARGO_PENDENTE,
+            "nome":          nome,
+            "nivel":         nivel,
+            "solicitado_em": datetime.now().isoformat(),
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def remover_solicitacao(cla_id: str, user_id: str) -> bool:
+    resultado = mongo_db[COLECAO_MEMBROS].delete_one(
+        {"cla_id": cla_id, "user_id": user_id, "cargo": CARGO_PENDENTE}
+    )
+    return resultado.deleted_count > 0
+
+
+def listar_solicitacoes(cla_id: str) -> List[Dict[str, Any]]:
+    return list(mongo_db[COLECAO_MEMBROS].find(
+        {"cla_id": cla_id, "cargo": CARGO_PENDENTE},
+        {"_id": 0, "user_id": 1, "nome": 1, "nivel": 1, "solicitado_em": 1}
+    ).sort("solicitado_em", 1))
+
+
+# ──────────────────────────────────────────────────────────────
+# XP do clã (mantido incrementalmente a cada aplicar_xp/estornar_xp)
+# ──────────────────────────────────────────────────────────────
+
+def creditar_xp_cla(cla_id: str, user_id: str, delta: int) -> int:
+    """
+    Propaga um ganho (delta > 0) ou estorno (delta < 0) de XP do membro para
+    cla_membros.xp_contribuicao e Clas.total_xp, sem recalcular nada.
+    A contribuição nunca fica negativa; o total do clã recebe exatamente o delta
+    aplicado ao membro. Retorna esse delta (0 se o usuário não é membro).
+    """
+    if mongo_db is None or not cla_id or not user_id or not delta or not ObjectId.is_valid(cla_id):
+        return 0
+    try:
+        antes = mongo_db[COLECAO_MEMBROS].find_one_and_update(
+            {"cla_id": cla_id, "user_id": user_id, "cargo": {"$in": list(CARGOS_MEMBRO)}},
+            [{"$set": {"xp_contribuicao": {
+                "$max": [0, {"$add": [{"$ifNull": ["$xp_contribuicao", 0]}, int(delta)]}]
+            }}}],
+            projection={"xp_contribuicao": 1}
+        )
+        if not antes:
+            return 0
+        aplicado = max(int(delta), -int(antes.get("xp_contribuicao", 0)))
+        if aplicado:
+            mongo_db["Clas"].update_one({"_id": ObjectId(cla_id)}, {"$inc": {"total_xp": aplicado}})
+        return aplicado
+    except Exception as e:
+        logger.error(f"❌ Erro ao creditar XP do clã {cla_id} ({user_id}, {delta}): {e}")
+        return 0
+
+
+# ──────────────────────────────────────────────────────────────
+# 🏆 Ranking de clãs (índice ativo+total_xp, cache de 60s por página)
+# ──────────────────────────────────────────────────────────────
+
+_ranking_clas_cache: dict = {}
+_RANKING_CLAS_CACHE_TTL = 60  # segundos
+RANKING_CLAS_POR_PAGINA_MAX = 50
+
+
+def obter_ranking_clas(pagina: int = 1, por_pagina: int = 20) -> List[Dict[str, Any]]:
+    """Página do ranking clã x clã por total_xp (posições absolutas)."""
+    pagina = max(1, int(pagina))
+    por_pagina = min(max(1, int(por_pagina)), RANKING_CLAS_POR_PAGINA_MAX)
+    chave = (pagina, por_pagina)
+
+    agora = time.time()
+    em_cache = _ranking_clas_cache.get(chave)
+    if em_cache and (agora - em_cache["ts"]) < _RANKING_CLAS_CACHE_TTL:
+        return em_cache["data"]
+
+    if mongo_db is None:
+        return em_cache["data"] if em_cache else []
+
+    try:
+        inicio = (pagina - 1) * por_pagina
+        cursor = mongo_db["Clas"].find(
+            {"ativo": True},
+            {"nome": 1, "emblema": 1, "cor": 1, "nivel": 1, "total_xp": 1, "num_membros": 1}
+        ).sort([("total_xp", DESCENDING), ("_id", 1)]).skip(inicio).limit(por_pagina)
+
+        resultado = []
+        for i, doc in enumerate(cursor):
+            resultado.append({
+                "posicao":     inicio + i + 1,
+                "id":          str(doc["_id"]),
+                "nome":        doc.get("nome", ""),
+                "emblema":     doc.get("emblema", "shield"),
+                "cor":         doc.get("cor", "#FFD700"),
+                "nivel":       doc.get("nivel", 1),
+                "total_xp":    doc.get("total_xp", 0),
+                "num_membros": doc.get("num_membros", 0),
+            })
+
+        _ranking_clas_cache[chave] = {"data": resultado, "ts": agora}
+        return resultado
+    except Exception as e:
+        logger.error(f"❌ Erro no ranking de clãs: {e}")
+        return em_cache["data"] if em_cache else []
+
+
+def obter_posicao_cla(cla_id: str) -> Optional[Dict[str, Any]]:
+    """Posição do clã no ranking: 1 + clãs ativos com mais XP (count coberto pelo índice)."""
+    if mongo_db is None or not cla_id or not ObjectId.is_valid(cla_id):
+        return None
+    try:
+        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id), "ativo": True}, {"nome": 1, "total_xp": 1})
+        if not cla:
+            return None
+        total_xp = cla.get("total_xp", 0)
+        acima = mongo_db["Clas"].count_documents({"ativo": True, "total_xp": {"$gt": total_xp}})
+        return {"id": cla_id, "nome": cla.get("nome", ""), "total_xp": total_xp, "posicao": acima + 1}
+    except Exception as e:
+        logger.error(f"❌ Erro ao calcular posição do clã {cla_id}: {e}")
+        return None
+
+
+# ──────────────────────────────────────────────────────────────
+# 🪪 Resumo do clã (cartão exibido no perfil público dos membros)
+# ──────────────────────────────────────────────────────────────
+# Muitos perfis apontam para o mesmo clã: o resumo fica em cache por worker e é
+# invalidado localmente quando o clã é editado ou muda de número de membros.
+
+_resumo_cla_cache: dict = {}
+_RESUMO_CLA_CACHE_TTL = 60  # segundos
+
+
+def invalidar_resumo_cla(cla_id: str):
+    _resumo_cla_cache.pop(str(cla_id), None)
+
+
+def obter_resumo_cla(cla_id: str) -> Optional[Dict[str, Any]]:
+    """{id, nome, nivel, emblema, cor, tipo, total_membros} ou None se o clã não existe."""
+    if not cla_id or not ObjectId.is_valid(cla_id):
+        return None
+
+    agora = time.time()
+    em_cache = _resumo_cla_cache.get(cla_id)
+    if em_cache and (agora - em_cache["ts"]) < _RESUMO_CLA_CACHE_TTL:
+        return em_cache["data"]
+
+    if mongo_db is None:
+        return em_cache["data"] if em_cache else None
+
+    try:
+        doc = mongo_db["Clas"].find_one(
+            {"_id": ObjectId(cla_id)},
+            {"nome": 1, "nivel": 1, "emblema": 1, "cor": 1, "num_membros": 1, "tipo": 1}
+        )
+        resumo = None
+        if doc:
+            resumo = {
+                "id":            cla_id,
+                "nome":          doc.get("nome", ""),
+                "nivel":         doc.get("nivel", 1),
+                "emblema":       doc.get("emblema", "shield"),
+                "cor":           doc.get("cor", "#FFD700"),
+                "tipo":          doc.get("tipo", "aberto"),
+                "total_membros": doc.get("num_membros", 0),
+            }
+        _resumo_cla_cache[cla_id] = {"data": resumo, "ts": agora}
+        return resumo
+    except Exception as e:
+        logger.error(f"❌ Erro ao carregar resumo do clã {cla_id}: {e}")
+        return em_cache["data"] if em_cache else None
+
+
+# ──────────────────────────────────────────────────────────────
+# 🔎 Busca de clãs por prefixo do nome / tag (índices com collation)
+# ──────────────────────────────────────────────────────────────
+
+def buscar_clas(prefixo: str = "", tag: str = "", limite: int = 20) -> List[Dict[str, Any]]:
+    """
+    Prefixo: range [prefixo, prefixo + U+FFFF) no índice único de nome (U+FFFF é o
+    maior peso no collation do ICU/CLDR, então o range cobre todo o prefixo).
+    Tag: igualdade no índice multikey de tags. Ambos case/acento-insensitive.
+    """
+    if mongo_db is None:
+        return []
+    filtro: Dict[str, Any] = {"ativo": True}
+    if prefixo:
+        filtro["nome"] = {"$gte": prefixo, "$lt": prefixo + "\uffff"}
+    if tag:
+        filtro["tags"] = tag
+
+    cursor = mongo_db["Clas"].find(
+        filtro,
+        {"nome": 1, "descricao": 1, "emblema": 1, "cor": 1, "tags": 1,
+         "nivel": 1, "total_xp": 1, "num_membros": 1, "tipo": 1},
+        collation=COLACAO_NOME_CLA
+    ).limit(min(max(1, int(limite)), 50))
+    if prefixo:
+        cursor = cursor.sort("nome", 1)
+
+    clas = []
+    for d in cursor:
+        d["id"] = str(d.pop("_id"))
+        d.setdefault("num_membros", 0)
+        d.setdefault("tipo", "aberto")
+        clas.append(d)
+    return clas
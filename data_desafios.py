@@ -0,0 +1,423 @@
+import logging
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import DESCENDING, UpdateOne
+
+# Importações do Data Manager (MongoDB)
+from data_manager import mongo_db, carregar_resumos_usuarios
+
+# Configuração de Logs
+logger = logging.getLogger("AURA_DATA_DESAFIOS")
+
+# ==============================================================
+# 🏆 CATÁLOGO DE DESAFIOS (coleção 'desafios')
+# ==============================================================
+# Nome, foto, tipo e verificação do profissional ficam copiados em cada
+# desafio (profissional_*), então filtros como ?tipo_profissional= e
+# ?verificado=true viram parte da query indexada em vez de um filtro em Python
+# depois de buscar 100 documentos. A cópia é refeita por
+# sincronizar_profissional_desafios() sempre que o perfil do profissional muda.
+#
+# Paginação por keyset em (avaliacao_media desc, _id desc): ?apos=<id do último
+# desafio recebido>. Busca textual (?q=) usa o índice de texto em titulo/descricao.
+
+COLECAO_DESAFIOS = "desafios"
+CATALOGO_LIMITE_MAX = 100
+
+
+def resumo_profissional(user_id: str) -> Dict[str, Any]:
+    """Campos profissional_* a partir de 'usuarios' + 'profissionais' (só na escrita)."""
+    resumo = {
+        "profissional_nome":       "Profissional",
+        "profissional_foto":       "",
+        "profissional_tipo":       "",
+        "profissional_verificado": False,
+    }
+    if mongo_db is None or not user_id:
+        return resumo
+
+    if ObjectId.is_valid(user_id):
+        u = mongo_db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"nome": 1, "foto_perfil": 1})
+        if u:
+            resumo["profissional_nome"] = u.get("nome", "Profissional")
+            foto = u.get("foto_perfil", "")
+            # Base64 não é copiado para cada desafio: cai para a URL do perfil profissional
+            resumo["profissional_foto"] = "" if foto.startswith("data:") else foto
+
+    prof = mongo_db["profissionais"].find_one(
+        {"user_id": user_id},
+        {"tipo_profissional": 1, "status_verificacao": 1, "foto_perfil_url": 1}
+    )
+    if prof:
+        resumo["profissional_tipo"] = prof.get("tipo_profissional", "")
+        resumo["profissional_verificado"] = prof.get("status_verificacao") == "verificado"
+        if not resumo["profissional_foto"] and prof.get("foto_perfil_url"):
+            resumo["profissional_foto"] = prof["foto_perfil_url"]
+    return resumo
+
+
+def sincronizar_profissional_desafios(user_id: str) -> int:
+    """
+    Recopia os dados do profissional em todos os desafios dele.
+    Chamado após mudanças de nome/foto/tipo/verificação. Retorna desafios alterados.
+    """
+    if mongo_db is None or not user_id:
+        return 0
+    try:
+        if not mongo_db["profissionais"].find_one({"user_id": user_id}, {"_id": 1}):
+            return 0
+        resumo = resumo_profissional(user_id)
+        resumo["updated_at"] = datetime.now().isoformat()
+        return mongo_db[COLECAO_DESAFIOS].update_many(
+            {"profissional_id": user_id}, {"$set": resumo}
+        ).modified_count
+    except Exception as e:
+        logger.error(f"❌ Erro ao sincronizar desafios do profissional {user_id}: {e}")
+        return 0
+
+
+def _filtro_apos(apos: str) -> Optional[dict]:
+    """Condição keyset para continuar depois do desafio 'apos' na ordem (avaliacao_media, _id) desc."""
+    if not ObjectId.is_valid(apos):
+        return None
+    ultimo = mongo_db[COLECAO_DESAFIOS].find_one({"_id": ObjectId(apos)}, {"avaliacao_media": 1})
+    if not ultimo:
+        return None
+    media = ultimo.get("avaliacao_media", 0.0)
+    return {"$or": [
+        {"avaliacao_media": {"$lt": media}},
+        {"avaliacao_media": media, "_id": {"$lt": ultimo["_id"]}},
+    ]}
+
+
+def listar_catalogo(filtros: Dict[str, Any], busca: str = "", apos: str = "",
+                    limite: int = CATALOGO_LIMITE_MAX) -> List[Dict[str, Any]]:
+    """
+    Página do catálogo de desafios ativos, melhor avaliados primeiro.
+    'filtros' aceita tipo, duracao_dias, profissional_tipo e profissional_verificado.
+    Raises ValueError se 'apos' não for um desafio existente.
+    """
+    limite = min(max(1, int(limite)), CATALOGO_LIMITE_MAX)
+    condicoes = [{"status": "ativo"}]
+    for campo in ("tipo", "duracao_dias", "profissional_tipo", "profissional_verificado"):
+        if filtros.get(campo) not in (None, ""):
+            condicoes.append({campo: filtros[campo]})
+    if busca:
+        condicoes.append({"$text": {"$search": busca}})
+    if apos:
+        keyset = _filtro_apos(apos)
+        if keyset is None:
+            raise ValueError("apos inválido")
+        condicoes.append(keyset)
+
+    cursor = mongo_db[COLECAO_DESAFIOS].find(
+        {"$and": condicoes}
+    ).sort([("avaliacao_media", DESCENDING), ("_id", DESCENDING)]).limit(limite)
+    return list(cursor)
+
+
+# ==============================================================
+# ⭐ AVALIAÇÕES (soma e contagem incrementais)
+# ==============================================================
+# desafios e profissionais guardam soma_avaliacoes + total_avaliacoes; a média
+# é derivada no mesmo update (pipeline), então avaliar custa O(1) writes em vez
+# de re-agregar todo o histórico. reconciliar_avaliacoes() recalcula a partir de
+# inscricoes_desafio (fonte da verdade) e corrige/relata a deriva.
+
+def _pipeline_nova_nota(nota: int) -> List[Dict[str, Any]]:
+    # Documentos anteriores aos contadores só têm média/total: a soma parte de média × total
+    soma_atual = {"$ifNull": ["$soma_avaliacoes", {"$multiply": [
+        {"$ifNull": ["$avaliacao_media", 0]}, {"$ifNull": ["$total_avaliacoes", 0]}
+    ]}]}
+    return [
+        {"$set": {
+            "soma_avaliacoes":  {"$add": [soma_atual, nota]},
+            "total_avaliacoes": {"$add": [{"$ifNull": ["$total_avaliacoes", 0]}, 1]},
+        }},
+        {"$set": {"avaliacao_media": {"$round": [{"$divide": ["$soma_avaliacoes", "$total_avaliacoes"]}, 1]}}},
+    ]
+
+
+def registrar_avaliacao(inscricao: Dict[str, Any], nota: int, comentario: str = "") -> bool:
+    """
+    Grava a nota na inscrição e soma nos agregados do desafio e do profissional.
+    O filtro avaliacao=None torna a gravação idempotente: False se já avaliada.
+    """
+    resultado = mongo_db["inscricoes_desafio"].update_one(
+        {"_id": inscricao["_id"], "avaliacao": None},
+        {"$set": {"avaliacao": nota, "comentario": comentario, "avaliada_em": datetime.now().isoformat()}}
+    )
+    if resultado.modified_count == 0:
+        return False
+
+    pipeline = _pipeline_nova_nota(nota)
+    desafio_id = inscricao.get("desafio_id")
+    if desafio_id and ObjectId.is_valid(desafio_id):
+        mongo_db[COLECAO_DESAFIOS].update_one({"_id": ObjectId(desafio_id)}, pipeline)
+    profissional_id = inscricao.get("profissional_id")
+    if profissional_id:
+        mongo_db["profissionais"].update_one({"user_id": profissional_id}, pipeline)
+    return True
+
+
+def _reconciliar(colecao: str, chave_doc: str, campo_origem: str, corrigir: bool) -> Dict[str, int]:
+    reais = {
+        str(r["_id"]): r for r in mongo_db["inscricoes_desafio"].aggregate([
+            {"$match": {"avaliacao": {"$ne": None}, campo_origem: {"$nin": [None, ""]}}},
+            {"$group": {"_id": f"${campo_origem}", "soma": {"$sum": "$avaliacao"}, "total": {"$sum": 1}}},
+        ], allowDiskUse=True)
+    }
+    gravados = {
+        str(d[chave_doc]): d for d in mongo_db[colecao].find(
+            {"total_avaliacoes": {"$gt": 0}}, {chave_doc: 1, "soma_avaliacoes": 1, "total_avaliacoes": 1}
+        )
+    }
+
+    ops = []
+    for chave in set(reais) | set(gravados):
+        real = reais.get(chave, {"soma": 0, "total": 0})
+        doc = gravados.get(chave, {})
+        if doc.get("soma_avaliacoes") == real["soma"] and doc.get("total_avaliacoes", 0) == real["total"]:
+            continue
+        if chave_doc == "_id":
+            if not ObjectId.is_valid(chave):
+                continue
+            filtro = {"_id": ObjectId(chave)}
+        else:
+            filtro = {chave_doc: chave}
+        media = round(real["soma"] / real["total"], 1) if real["total"] else 0.0
+        ops.append(UpdateOne(filtro, {"$set": {
+            "soma_avaliacoes": real["soma"], "total_avaliacoes": real["total"], "avaliacao_media": media,
+        }}))
+
+    if corrigir and ops:
+        mongo_db[colecao].bulk_write(ops, ordered=False)
+    return {"verificados": len(set(reais) | set(gravados)), "divergentes": len(ops)}
+
+
+def reconciliar_avaliacoes(corrigir: bool = True) -> Dict[str, Dict[str, int]]:
+    """
+    Recalcula soma/total de desafios e profissionais a partir das inscrições.
+    Retorna {"desafios": {...}, "profissionais": {...}} com verificados/divergentes.
+    """
+    relatorio = {}
+    if mongo_db is None:
+        return relatorio
+    for colecao, chave_doc, campo_origem in (
+        (COLECAO_DESAFIOS, "_id", "desafio_id"),
+        ("profissionais", "user_id", "profissional_id"),
+    ):
+        try:
+            relatorio[colecao] = _reconciliar(colecao, chave_doc, campo_origem, corrigir)
+            if relatorio[colecao]["divergentes"]:
+                logger.warning(f"⚠️ [AVALIAÇÕES] Deriva em {colecao}: {relatorio[colecao]}")
+        except Exception as e:
+            logger.error(f"❌ Erro ao reconciliar avaliações de {colecao}: {e}")
+            relatorio[colecao] = {"verificados": 0, "divergentes": 0}
+    return relatorio
+
+
+# ==============================================================
+# 👥 COORTE DO PROFISSIONAL (alunos com grant de saúde ativo)
+# ==============================================================
+# Painel do coach em uma chamada: grants pelo índice (profissional_id, status),
+# frequência/total de treinos de todos os alunos numa única agregação em
+# 'atividades' e resumos dos alunos da página num único find com $in.
+
+COORTE_POR_PAGINA_MAX = 100
+ORDENACOES_COORTE = ("frequencia", "total", "nome", "expiracao")
+
+
+def perfil_saude_aluno(aluno: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    perfil_saude com o fallback dos campos legados (peso_kg/altura_cm na raiz),
+    a mesma migração reversa usada em carregar_memoria().
+    """
+    perfil_saude = dict(aluno.get("perfil_saude") or {})
+    if not perfil_saude.get("peso_kg") and aluno.get("peso_kg") is not None:
+        perfil_saude["peso_kg"] = aluno.get("peso_kg")
+    if not perfil_saude.get("altura_cm") and aluno.get("altura_cm") is not None:
+        perfil_saude["altura_cm"] = aluno.get("altura_cm")
+
+    def _campo_health(campo):
+        """Retorna o subdocumento {valor, fonte, sincronizado_em} ou None."""
+        v = perfil_saude.get(campo)
+        return v if isinstance(v, dict) else None
+
+    return {
+        "peso_kg":            perfil_saude.get("peso_kg"),
+        "altura_cm":          perfil_saude.get("altura_cm"),
+        "percentual_gordura": perfil_saude.get("percentual_gordura"),
+        "atualizado_em":      perfil_saude.get("atualizado_em", ""),
+        "fc_repouso":         _campo_health("fc_repouso"),
+        "passos_diarios":     _campo_health("passos_diarios"),
+        "calorias_ativas":    _campo_health("calorias_ativas"),
+        "sono_horas":         _campo_health("sono_horas"),
+    }
+
+
+def estatisticas_treino(aluno_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """{aluno_id: {"total", "semana"}} de treinos, uma agregação para todos os alunos."""
+    if not aluno_ids:
+        return {}
+    ha_7_dias = (datetime.now() - timedelta(days=7)).isoformat()
+    return {
+        r["_id"]: {"total": r["total"], "semana": r["semana"]}
+        for r in mongo_db["atividades"].aggregate([
+            {"$match": {"user_id": {"$in": list(aluno_ids)}, "tipo": "Treino"}},
+            {"$group": {
+                "_id":    "$user_id",
+                "total":  {"$sum": 1},
+                "semana": {"$sum": {"$cond": [{"$gte": ["$data_atividade", ha_7_dias]}, 1, 0]}},
+            }},
+        ])
+    }
+
+
+def obter_coorte_saude(profissional_id: str, ordenar: str = "frequencia",
+                       pagina: int = 1, por_pagina: int = 50) -> Dict[str, Any]:
+    """
+    Página da coorte: {"alunos": [...], "total_alunos", "pagina", "por_pagina"}.
+    Um aluno com grants em vários desafios aparece uma vez (grant que expira por último).
+    """
+    pagina = max(1, int(pagina))
+    por_pagina = min(max(1, int(por_pagina)), COORTE_POR_PAGINA_MAX)
+    if ordenar not in ORDENACOES_COORTE:
+        ordenar = "frequencia"
+
+    grants: Dict[str, Dict[str, Any]] = {}
+    for g in mongo_db["grants_saude"].find(
+        {"profissional_id": profissional_id, "status": "ativo"},
+        {"aluno_id": 1, "desafio_id": 1, "data_concessao": 1, "data_expiracao": 1}
+    ):
+        atual = grants.get(g.get("aluno_id"))
+        if g.get("aluno_id") and (not atual or g.get("data_expiracao", "") > atual.get("data_expiracao", "")):
+            grants[g["aluno_id"]] = g
+
+    stats = estatisticas_treino(list(grants))
+    campos_saude = ["perfil_saude", "peso_kg", "altura_cm"]
+
+    ids = list(grants)
+    resumos = {}
+    if ordenar == "nome":
+        # Ordenar por nome precisa dos nomes da coorte inteira (ainda um único $in)
+        resumos = carregar_resumos_usuarios(ids, campos_extras=campos_saude)
+        ids.sort(key=lambda a: str(resumos.get(a, {}).get("nome", "")).lower())
+    elif ordenar == "expiracao":
+        ids.sort(key=lambda a: grants[a].get("data_expiracao", ""))
+    else:
+        chave = "semana" if ordenar == "frequencia" else "total"
+        ids.sort(key=lambda a: stats.get(a, {}).get(chave, 0), reverse=True)
+
+    inicio = (pagina - 1) * por_pagina
+    ids_pagina = ids[inicio:inicio + por_pagina]
+    if not resumos:
+        resumos = carregar_resumos_usuarios(ids_pagina, campos_extras=campos_saude)
+
+    alunos = []
+    for aluno_id in ids_pagina:
+        aluno = resumos.get(aluno_id)
+        if not aluno:
+            continue
+        grant = grants[aluno_id]
+        alunos.append({
+            "aluno_id":     aluno_id,
+            "nome":         aluno.get("nome", "Atleta"),
+            "foto":         aluno.get("foto_perfil", ""),
+            "perfil_saude": perfil_saude_aluno(aluno),
+            "frequencia_treino_semanal": stats.get(aluno_id, {}).get("semana", 0),
+            "treinos_completados_total": stats.get(aluno_id, {}).get("total", 0),
+            "grant": {
+                "desafio_id":     grant.get("desafio_id"),
+                "data_concessao": grant.get("data_concessao"),
+                "data_expiracao": grant.get("data_expiracao"),
+            },
+        })
+
+    return {"alunos": alunos, "total_alunos": len(grants), "pagina": pagina, "por_pagina": por_pagina}
+
+
+# ==============================================================
+# 📋 ROSTER DO DESAFIO (inscrições + alunos numa agregação)
+# ==============================================================
+# Uma passada no índice (desafio_id, data_inscricao): $facet devolve a página
+# já com o resumo do aluno ($lookup em 'usuarios' só para as linhas da página)
+# e os números de progresso do desafio inteiro.
+
+ROSTER_POR_PAGINA_MAX = 100
+
+
+def obter_roster(desafio_id: str, pagina: int = 1, por_pagina: int = 50,
+                 status_pagamento: str = "") -> Dict[str, Any]:
+    """{"inscritos": [...], "estatisticas": {...}, "pagina", "por_pagina"}."""
+    pagina = max(1, int(pagina))
+    por_pagina = min(max(1, int(por_pagina)), ROSTER_POR_PAGINA_MAX)
+    filtro = {"desafio_id": desafio_id}
+    if status_pagamento:
+        filtro["status_pagamento"] = status_pagamento
+
+    resultado = list(mongo_db["inscricoes_desafio"].aggregate([
+        {"$match": filtro},
+        {"$facet": {
+            "estatisticas": [
+                {"$group": {
+                    "_id":            None,
+                    "total":          {"$sum": 1},
+                    "pagos":          {"$sum": {"$cond": [{"$eq": ["$status_pagamento", "PAGO"]}, 1, 0]}},
+                    "em_andamento":   {"$sum": {"$cond": [{"$eq": ["$status_desafio", "em_andamento"]}, 1, 0]}},
+                    "concluidos":     {"$sum": {"$cond": [{"$eq": ["$status_desafio", "concluido"]}, 1, 0]}},
+                    "abandonados":    {"$sum": {"$cond": [{"$eq": ["$status_desafio", "abandonado"]}, 1, 0]}},
+                    "progresso_medio": {"$avg": {"$ifNull": ["$progresso.percentual", 0]}},
+                }},
+            ],
+            "inscritos": [
+                {"$sort": {"data_inscricao": -1, "_id": -1}},
+                {"$skip": (pagina - 1) * por_pagina},
+                {"$limit": por_pagina},
+                {"$lookup": {
+                    "from": "usuarios",
+                    "let": {"uid": {"$convert": {"input": "$user_id", "to": "objectId", "onError": None, "onNull": None}}},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$_id", "$$uid"]}}},
+                        {"$project": {"_id": 0, "nome": 1, "foto_perfil": 1, "nivel": 1}},
+                    ],
+                    "as": "aluno",
+                }},
+                {"$project": {
+                    "user_id": 1, "status_pagamento": 1, "status_desafio": 1, "data_inscricao": 1,
+                    "data_inicio": 1, "progresso": 1, "avaliacao": 1, "aluno": {"$first": "$aluno"},
+                }},
+            ],
+        }},
+    ]))
+    facetas = resultado[0] if resultado else {}
+
+    inscritos = []
+    for ins in facetas.get("inscritos", []):
+        aluno = ins.pop("aluno", None) or {}
+        ins["id"] = str(ins.pop("_id"))
+        ins["nome"] = aluno.get("nome", "Atleta")
+        ins["foto"] = aluno.get("foto_perfil", "")
+        ins["nivel"] = aluno.get("nivel", 1)
+        inscritos.append(ins)
+
+    estatisticas = (facetas.get("estatisticas") or [{}])[0]
+    estatisticas.pop("_id", None)
+    estatisticas["progresso_medio"] = round(estatisticas.get("progresso_medio") or 0.0, 1)
+    for campo in ("total", "pagos", "em_andamento", "concluidos", "abandonados"):
+        estatisticas.setdefault(campo, 0)
+
+    return {"inscritos": inscritos, "estatisticas": estatisticas, "pagina": pagina, "por_pagina": por_pagina}
+
+
+def contar_inscritos_pagos(desafio_ids: List[str]) -> Dict[str, int]:
+    """{desafio_id: inscrições pagas} de vários desafios numa agregação (índice desafio_id+status_pagamento)."""
+    if not desafio_ids:
+        return {}
+    return {
+        r["_id"]: r["n"] for r in mongo_db["inscricoes_desafio"].aggregate([
+            {"$match": {"desafio_id": {"$in": list(desafio_ids)}, "status_pagamento": "PAGO"}},
+            {"$group": {"_id": "$desafio_id", "n": {"$sum": 1}}},
+        ])
+    }
@@ -1,6 +1,9 @@
 import logging
-from datetime import datetime
-from typing import Dict, Any
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from bson.objectid import ObjectId
+from pymongo import DESCENDING
 
 # Importações da Nova Arquitetura
 # Certifique-se que data_manager.py exporta 'mongo_db'
@@ -135,6 +138,206 @@ def atualizar_cache_ranking(lista_ranking: list) -> bool:
         logger.error(f"❌ Erro ao atualizar cache ranking: {e}")
         return False
 
+# ==============================================================
+# 🏆 RANKING MATERIALIZADO (snapshot compartilhado entre workers)
+# ==============================================================
+# O líder do scheduler reconstrói periodicamente a coleção 'ranking_global':
+# um documento por (quadro, versao, posicao). Cada rebuild grava uma versão
+# nova e só depois troca o ponteiro em configs_global, então leitores nunca
+# veem um quadro pela metade. A versão anterior é mantida até o próximo
+# rebuild para não quebrar quem está paginando.
+
+COLECAO_RANKING = "ranking_global"
+QUADROS_RANKING = ("geral", "semanal", "mensal")
+RANKING_MAX_POSICOES = 1000
+RANKING_POR_PAGINA_MAX = 100
+
+_versoes_cache: dict = {"data": None, "ts": 0.0}
+_VERSOES_CACHE_TTL = 60  # segundos
+
+
+def _inicio_periodo(quadro: str) -> str:
+    hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if quadro == "semanal":
+        return (hoje - timedelta(days=hoje.weekday())).isoformat()
+    return hoje.replace(day=1).isoformat()
+
+
+def _foto_leve(foto: str) -> str:
+    # Base64 pode ter centenas de KB — não vai para o snapshot
+    return "" if (foto or "").startswith("data:") else (foto or "")
+
+
+def _linhas_quadro_geral() -> List[Dict[str, Any]]:
+    cursor = mongo_db["usuarios"].find(
+        {"plano": {"$ne": "banned"}},
+        {"nome": 1, "foto_perfil": 1, "xp_total": 1, "nivel": 1}
+    ).sort([("nivel", DESCENDING), ("xp_total", DESCENDING)]).limit(RANKING_MAX_POSICOES).max_time_ms(20000)
+    return [{
+        "user_id":  str(doc["_id"]),
+        "nome":     doc.get("nome", "Anônimo"),
+        "foto":     _foto_leve(doc.get("foto_perfil", "")),
+        "xp_total": doc.get("xp_total", 0),
+        "nivel":    doc.get("nivel", 1),
+    } for doc in cursor]
+
+
+def _linhas_quadro_periodo(quadro: str) -> List[Dict[str, Any]]:
+    """XP líquido do período a partir do ledger_xp: Strava (créditos - estornos), missões e atividades do app."""
+    agregados = list(mongo_db["ledger_xp"].aggregate([
+        {"$match": {"estado": "aplicado", "aplicado_em": {"$gte": _inicio_periodo(quadro)}}},
+        {"$group": {"_id": "$user_id", "xp_periodo": {"$sum": "$xp"}}},
+        {"$match": {"_id": {"$ne": None}, "xp_periodo": {"$gt": 0}}},
+        {"$sort": {"xp_periodo": -1, "_id": 1}},
+        {"$limit": RANKING_MAX_POSICOES},
+    ], maxTimeMS=20000))
+
+    oids = [ObjectId(a["_id"]) for a in agregados if ObjectId.is_valid(a["_id"])]
+    perfis = {
+        str(u["_id"]): u for u in mongo_db["usuarios"].find(
+            {"_id": {"$in": oids}, "plano": {"$ne": "banned"}},
+            {"nome": 1, "foto_perfil": 1, "nivel": 1}
+        )
+    }
+    linhas = []
+    for a in agregados:
+        perfil = perfis.get(a["_id"])
+        if not perfil:
+            continue
+        linhas.append({
+            "user_id":    a["_id"],
+            "nome":       perfil.get("nome", "Anônimo"),
+            "foto":       _foto_leve(perfil.get("foto_perfil", "")),
+            "nivel":      perfil.get("nivel", 1),
+            "xp_periodo": a["xp_periodo"],
+        })
+    return linhas
+
+
+def materializar_ranking_global() -> Dict[str, int]:
+    """
+    Reconstrói os quadros geral/semanal/mensal em 'ranking_global' (chamado
+    pelo scheduler com lock distribuído) e atualiza o top 100 via atualizar_cache_ranking.
+    Retorna {quadro: total de posições gravadas}.
+    """
+    if mongo_db is None:
+        return {}
+
+    col = mongo_db[COLECAO_RANKING]
+    versao = datetime.now().strftime("%Y%m%d%H%M%S")
+    atuais = (carregar_memoria_global().get("ranking_global_cache") or {}).get("versoes", {})
+    totais = {}
+
+    for quadro in QUADROS_RANKING:
+        try:
+            linhas = _linhas_quadro_geral() if quadro == "geral" else _linhas_quadro_periodo(quadro)
+            for i, linha in enumerate(linhas):
+                linha.update({"quadro": quadro, "versao": versao, "posicao": i + 1})
+            col.delete_many({"quadro": quadro, "versao": versao})  # rebuild repetido no mesmo segundo
+            if linhas:
+                col.insert_many(linhas, ordered=False)
+
+            mongo_db[COLECAO_CONFIGS].update_one(
+                {"_id": ID_GLOBAL},
+                {"$set": {f"ranking_global_cache.versoes.{quadro}": versao}}
+            )
+            # Mantém só a versão nova e a imediatamente anterior
+            preservar = [versao] + ([atuais[quadro]] if atuais.get(quadro) else [])
+            col.delete_many({"quadro": quadro, "versao": {"$nin": preservar}})
+
+            if quadro == "geral":
+                top_100 = [{k: v for k, v in l.items() if k not in ("_id", "quadro", "versao")}
+                           for l in linhas[:100]]
+                atualizar_cache_ranking(top_100)
+            totais[quadro] = len(linhas)
+        except Exception as e:
+            logger.error(f"❌ Erro ao materializar ranking '{quadro}': {e}")
+
+    _versoes_cache["data"] = None
+    return totais
+
+
+def _versoes_ranking() -> Dict[str, str]:
+    agora = time.time()
+    if _versoes_cache["data"] is not None and (agora - _versoes_cache["ts"]) < _VERSOES_CACHE_TTL:
+        return _versoes_cache["data"]
+    try:
+        doc = mongo_db[COLECAO_CONFIGS].find_one(
+            {"_id": ID_GLOBAL}, {"ranking_global_cache.versoes": 1, "ranking_global_cache.ultima_atualizacao": 1}
+        ) or {}
+        cache = doc.get("ranking_global_cache", {})
+        versoes = dict(cache.get("versoes", {}))
+        versoes["_atualizado_em"] = cache.get("ultima_atualizacao", "")
+        _versoes_cache.update({"data": versoes, "ts": agora})
+        return versoes
+    except Exception as e:
+        logger.error(f"❌ Erro ao ler versões do ranking: {e}")
+        return _versoes_cache["data"] or {}
+
+
+def obter_pagina_ranking(quadro: str = "geral", apos: int = 0, limite: int = 50) -> Dict[str, Any]:
+    """
+    Página do snapshot por cursor de posição: devolve as posições > apos.
+    'proximo' é o cursor da página seguinte (None no fim).
+    """
+    vazio = {"ranking": [], "proximo": None, "atualizado_em": ""}
+    if mongo_db is None or quadro not in QUADROS_RANKING:
+        return vazio
+
+    versoes = _versoes_ranking()
+    versao = versoes.get(quadro)
+    if not versao:
+        return vazio
+
+    limite = min(max(1, int(limite)), RANKING_POR_PAGINA_MAX)
+    try:
+        linhas = list(mongo_db[COLECAO_RANKING].find(
+            {"quadro": quadro, "versao": versao, "posicao": {"$gt": max(0, int(apos))}},
+            {"_id": 0, "quadro": 0, "versao": 0}
+        ).sort("posicao", 1).limit(limite))
+        return {
+            "ranking": linhas,
+            "proximo": linhas[-1]["posicao"] if len(linhas) == limite else None,
+            "atualizado_em": versoes.get("_atualizado_em", ""),
+        }
+    except Exception as e:
+        logger.error(f"❌ Erro ao paginar ranking '{quadro}': {e}")
+        return vazio
+
+
+def obter_posicao_ranking(user_id: str, quadro: str = "geral") -> Optional[Dict[str, Any]]:
+    """
+    Posição de qualquer usuário. No quadro geral é ao vivo: 1 + usuários à frente
+    em (nivel, xp_total), contados pelo índice. Nos quadros de período vem do snapshot
+    (None se o usuário não pontuou no período).
+    """
+    if mongo_db is None or not user_id or not ObjectId.is_valid(user_id):
+        return None
+    try:
+        if quadro == "geral":
+            doc = mongo_db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"nivel": 1, "xp_total": 1})
+            if not doc:
+                return None
+            nivel, xp = doc.get("nivel", 1), doc.get("xp_total", 0)
+            a_frente = mongo_db["usuarios"].count_documents({
+                "$or": [{"nivel": {"$gt": nivel}}, {"nivel": nivel, "xp_total": {"$gt": xp}}],
+                "plano": {"$ne": "banned"},
+            }, maxTimeMS=5000)
+            return {"posicao": a_frente + 1, "nivel": nivel, "xp_total": xp}
+
+        versao = _versoes_ranking().get(quadro)
+        if not versao:
+            return None
+        linha = mongo_db[COLECAO_RANKING].find_one(
+            {"quadro": quadro, "versao": versao, "user_id": user_id},
+            {"_id": 0, "posicao": 1, "xp_periodo": 1, "nivel": 1}
+        )
+        return linha
+    except Exception as e:
+        logger.error(f"❌ Erro ao calcular posição de {user_id} no ranking '{quadro}': {e}")
+        return None
+
+
 def atualizar_versao_ia_global(versao: str):
     """
     Força a atualização da versão do motor de IA em todo o sistema.
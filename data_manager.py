@@ -1,10 +1,14 @@
 import os
 import time
+import hashlib
 import logging
 from datetime import datetime
 from pymongo import MongoClient, DESCENDING
+from pymongo.collation import Collation
+from pymongo.errors import DuplicateKeyError
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
+from flask import g, has_request_context
 
 # Importação do Schema para garantir consistência
 from schema import obter_schema_padrao_usuario
@@ -90,6 +94,49 @@ def buscar_usuario_por_email(email: str):
         logger.error(f"Erro ao buscar email {email}: {e}")
         return None
 
+# ==============================================================
+# 🪪 AURA CODE (identificador público de 8 caracteres)
+# ==============================================================
+
+AURA_CODE_TENTATIVAS = 10
+
+
+def gerar_aura_code(user_id: str, tentativa: int = 0) -> str:
+    """
+    8 primeiros hex do SHA-256 do ObjectId. A tentativa 0 reproduz os códigos
+    já emitidos; tentativas seguintes só entram quando o truncamento colide.
+    """
+    semente = str(user_id) if not tentativa else f"{user_id}:{tentativa}"
+    return hashlib.sha256(semente.encode()).hexdigest()[:8].upper()
+
+
+def _colisao_aura_code(erro: DuplicateKeyError) -> bool:
+    return "aura_code" in ((erro.details or {}).get("keyPattern") or {})
+
+
+def atribuir_aura_code(user_id: str) -> str:
+    """Grava o Aura Code de um usuário que ainda não tem (índice único resolve colisões)."""
+    if mongo_db is None or not ObjectId.is_valid(str(user_id)):
+        return None
+    oid = ObjectId(str(user_id))
+    for tentativa in range(AURA_CODE_TENTATIVAS):
+        code = gerar_aura_code(user_id, tentativa)
+        try:
+            resultado = mongo_db["usuarios"].update_one(
+                {"_id": oid, "aura_code": {"$exists": False}}, {"$set": {"aura_code": code}}
+            )
+            if resultado.matched_count:
+                return code
+            doc = mongo_db["usuarios"].find_one({"_id": oid}, {"aura_code": 1})
+            return doc.get("aura_code") if doc else None
+        except DuplicateKeyError as e:
+            if not _colisao_aura_code(e):
+                raise
+            logger.warning(f"⚠️ Colisão de Aura Code {code} para {user_id} (tentativa {tentativa}).")
+    logger.error(f"❌ Não foi possível atribuir Aura Code a {user_id}.")
+    return None
+
+
 def criar_novo_usuario(email: str, nome: str, auth_provider="email"):
     """
     Cria um novo usuário já com os campos exigidos pela App Store.
@@ -108,15 +155,31 @@ def criar_novo_usuario(email: str, nome: str, auth_provider="email"):
     novo_user["created_at"] = datetime.now().isoformat()
     novo_user["updated_at"] = datetime.now().isoformat()
     
+    # [AURA PERF] Aura Code atribuído já no cadastro (o _id é gerado aqui para derivar o código)
+    novo_user["_id"] = ObjectId()
+
     try:
-        resultado = mongo_db["usuarios"].insert_one(novo_user)
-        novo_user["_id"] = str(resultado.inserted_id)
+        for tentativa in range(AURA_CODE_TENTATIVAS):
+            novo_user["aura_code"] = gerar_aura_code(novo_user["_id"], tentativa)
+            try:
+                mongo_db["usuarios"].insert_one(novo_user)
+                break
+            except DuplicateKeyError as e:
+                if not _colisao_aura_code(e) or tentativa == AURA_CODE_TENTATIVAS - 1:
+                    raise
+        novo_user["_id"] = str(novo_user["_id"])
         logger.info(f"🆕 Novo usuário {nome} ({auth_provider}) criado no Atlas.")
         return novo_user
     except Exception as e:
         logger.error(f"Erro ao criar usuário: {e}")
         return None
 
+# Contadores desnormalizados mantidos só por $inc/recontagem (data_social,
+# data_notificacoes). O documento inteiro salvo por salvar_memoria traz o valor
+# lido antes: gravá-lo de volta apagaria incrementos concorrentes.
+CAMPOS_CONTADORES_USUARIO = ("estatisticas_publicas", "notificacoes_nao_lidas")
+
+
 def atualizar_usuario(user_id: str, dados_atualizacao: dict):
     if mongo_db is None: return False
     try:
@@ -128,6 +191,9 @@ def atualizar_usuario(user_id: str, dados_atualizacao: dict):
         # Removemos o _id se ele vier nos dados para não dar erro de imutabilidade
         if "_id" in dados_atualizacao:
             del dados_atualizacao["_id"]
+
+        for campo in [c for c in dados_atualizacao if c.split(".")[0] in CAMPOS_CONTADORES_USUARIO]:
+            del dados_atualizacao[campo]
             
         dados_atualizacao["updated_at"] = datetime.now().isoformat()
         
@@ -188,6 +254,64 @@ def salvar_conexao_strava(dados_atleta: dict, tokens: dict):
         logger.error(f"❌ Erro integração Strava: {e}")
         return False
 
+# ==============================================================
+# 👥 CARREGADOR EM LOTE DE USUÁRIOS (anti N+1)
+# ==============================================================
+
+# Projeção padrão dos cards de usuário (membros, amigos, rankings, inscritos)
+PROJECAO_RESUMO_USUARIO = {"nome": 1, "nivel": 1, "foto_perfil": 1, "xp_total": 1}
+
+
+def carregar_resumos_usuarios(user_ids, campos_extras=None) -> dict:
+    """
+    Resolve vários usuários com UM find({"_id": {"$in": [...]}}) em vez de um
+    find_one por linha. Resultados ficam em cache durante a request (flask.g),
+    então rotas/helpers que pedem os mesmos ids não voltam ao banco.
+
+    Retorna {user_id (str): doc}. Ids inválidos ou inexistentes ficam de fora.
+    """
+    if mongo_db is None:
+        return {}
+
+    campos = set(PROJECAO_RESUMO_USUARIO) | set(campos_extras or [])
+    ids = {str(u).strip() for u in user_ids if u and ObjectId.is_valid(str(u).strip())}
+
+    cache = None
+    if has_request_context():
+        cache = g.setdefault("_cache_resumos_usuarios", {})
+
+    resultado = {}
+    faltando = []
+    for uid in ids:
+        item = cache.get(uid) if cache is not None else None
+        if item is not None and campos <= item[0]:
+            if item[1] is not None:
+                resultado[uid] = item[1]
+        else:
+            faltando.append(uid)
+
+    if faltando:
+        try:
+            encontrados = {
+                str(doc["_id"]): doc
+                for doc in mongo_db["usuarios"].find(
+                    {"_id": {"$in": [ObjectId(uid) for uid in faltando]}},
+                    {c: 1 for c in campos}
+                )
+            }
+        except Exception as e:
+            logger.error(f"Erro ao carregar usuários em lote: {e}")
+            return resultado
+
+        for uid in faltando:
+            doc = encontrados.get(uid)
+            if cache is not None:
+                cache[uid] = (frozenset(campos), doc)
+            if doc is not None:
+                resultado[uid] = doc
+
+    return resultado
+
 # ==============================================================
 # 🏆 RANKING GLOBAL (com cache de 60s para reduzir carga no Render)
 # ==============================================================
@@ -201,9 +325,22 @@ def obter_ranking_global(limite=50):
     # Serve do cache se ainda estiver fresco
     agora = time.time()
     if _ranking_cache["data"] is not None and (agora - _ranking_cache["ts"]) < _RANKING_CACHE_TTL:
-        return _ranking_cache["data"]
+        return _ranking_cache["data"][:limite]
 
-    if mongo_db is None: return _ranking_cache["data"] or []
+    if mongo_db is None: return (_ranking_cache["data"] or [])[:limite]
+
+    # [AURA PERF] Top 100 materializado pelo scheduler (data_global.materializar_ranking_global):
+    # uma leitura de 1 documento compartilhada pelos 4 workers, em vez de 4 sorts em 'usuarios'.
+    try:
+        doc = mongo_db["configs_global"].find_one(
+            {"_id": "global_state"}, {"ranking_global_cache.top_100": 1}
+        ) or {}
+        top_100 = (doc.get("ranking_global_cache") or {}).get("top_100")
+        if top_100 and limite <= len(top_100):
+            _ranking_cache = {"data": top_100, "ts": agora}
+            return top_100[:limite]
+    except Exception as e:
+        logger.warning(f"⚠️ Snapshot do ranking indisponível, calculando ao vivo: {e}")
 
     try:
         # O índice composto (nivel DESC, xp_total DESC) criado na seção de índices permite que
@@ -324,6 +461,17 @@ if mongo_db is not None:
         if "base44_id_1" not in indices_atuais:
             colecao_usuarios.create_index("base44_id", sparse=True)
             
+        # Atletas com evento Strava recente (renovação proativa de token)
+        if "integracoes.strava.ultimo_evento_em_1" not in indices_atuais:
+            colecao_usuarios.create_index("integracoes.strava.ultimo_evento_em", sparse=True)
+
+        # Busca por Aura Code: único (sparse enquanto a migração não cobrir todos)
+        if "aura_code_1" not in indices_atuais:
+            try:
+                colecao_usuarios.create_index("aura_code", unique=True, sparse=True)
+            except Exception as e:
+                logger.warning(f"⚠️ Índice único aura_code não criado (rodar migracoes.py atribuir_aura_codes): {e}")
+
         if "xp_total_-1" not in indices_atuais:
             colecao_usuarios.create_index([("xp_total", -1)])
 
@@ -355,6 +503,122 @@ if mongo_db is not None:
                 unique=True, name="grant_unico_por_desafio"
             )
 
+        # ── [AURA PERF] Inscrições em desafios: um índice por formato de query ──
+        # Roster/inscritos e avaliações recentes do desafio (ordenados por data de inscrição)
+        mongo_db["inscricoes_desafio"].create_index([("desafio_id", 1), ("data_inscricao", DESCENDING)])
+        # Inscritos pagos por desafio (meus_desafios)
+        mongo_db["inscricoes_desafio"].create_index([("desafio_id", 1), ("status_pagamento", 1)])
+        # Inscrição do aluno no desafio (detalhe, chat, acesso do profissional)
+        mongo_db["inscricoes_desafio"].create_index([("desafio_id", 1), ("user_id", 1)])
+        # Desafio em andamento do usuário (gerar_missoes_diarias) e "minhas inscrições"
+        mongo_db["inscricoes_desafio"].create_index([("user_id", 1), ("status_pagamento", 1), ("status_desafio", 1)])
+        mongo_db["inscricoes_desafio"].create_index([("user_id", 1), ("data_inscricao", DESCENDING)])
+
+        # Deny-list de JWT (logout): cada entrada some quando o token expiraria
+        mongo_db["jwt_revogados"].create_index("expira_em", expireAfterSeconds=0)
+
+        # Caixa de entrada dos webhooks de pagamento: fila de reprocessamento
+        # e expiração dos eventos já processados (idempotência pelo _id)
+        mongo_db["eventos_pagamento"].create_index([("status", 1), ("lease_ate", 1)])
+        mongo_db["eventos_pagamento"].create_index("expira_em", expireAfterSeconds=0)
+
+        # Cache dos QR Codes PIX por pagamento: some quando o QR expira no Asaas
+        mongo_db["pix_qrcodes"].create_index("expira_em", expireAfterSeconds=0)
+
+        # Frequência/total de treinos por aluno (saúde do aluno e coorte do profissional)
+        mongo_db["atividades"].create_index([("user_id", 1), ("tipo", 1), ("data_atividade", 1)])
+
+        # ── [AURA PERF] Token bucket compartilhado da API do Strava ──
+        # Cada janela (15 min / dia) expira sozinha após o dobro do seu tamanho.
+        mongo_db["strava_rate_limit"].create_index("expire_at", expireAfterSeconds=0)
+        # Leases de refresh de token por atleta (single-flight entre workers)
+        mongo_db["strava_token_leases"].create_index("expire_at", expireAfterSeconds=0)
+        # Leases por atividade: create/update/delete da mesma atividade um de cada vez
+        mongo_db["strava_atividade_leases"].create_index("expire_at", expireAfterSeconds=0)
+
+        # ── [AURA PERF] Atividades Strava: dedupe por id da atividade (webhook + backfill) ──
+        # Em try próprio: duplicatas legadas não podem impedir os demais índices.
+        try:
+            if "id_1" not in mongo_db["atividades_strava"].index_information():
+                mongo_db["atividades_strava"].create_index("id", unique=True, sparse=True)
+        except Exception as e:
+            logger.error(f"❌ Índice único atividades_strava.id NÃO criado — rodar migracoes.py deduplicar_atividades_strava: {e}")
+        # Leitura do sensores.py: últimas atividades do atleta
+        mongo_db["atividades_strava"].create_index([("user_id", 1), ("start_date_local", DESCENDING)])
+        # Payload bruto arquivado: índice por atleta para limpezas/exportação
+        mongo_db["atividades_strava_raw"].create_index("user_id")
+        # ── [AURA PERF] Membros de clã (coleção própria, substitui Clas.membros) ──
+        mongo_db["cla_membros"].create_index(
+            [("cla_id", 1), ("user_id", 1)], unique=True, name="membro_unico_por_cla"
+        )
+        mongo_db["cla_membros"].create_index([("cla_id", 1), ("cargo", 1), ("xp_contribuicao", DESCENDING)])
+        mongo_db["cla_membros"].create_index("user_id")
+        # Nome de clã único (case/acento-insensitive) + busca por prefixo/tag com o mesmo collation
+        colacao_pt = Collation(locale="pt", strength=1)
+        try:
+            mongo_db["Clas"].create_index("nome", unique=True, collation=colacao_pt, name="nome_unico_ci")
+        except Exception as e:
+            # Sem o índice, criar/editar clã cai na checagem prévia (data_clas.nome_cla_em_uso)
+            logger.error(f"❌ Índice único Clas.nome NÃO criado — rodar migracoes.py unificar_nomes_clas: {e}")
+        mongo_db["Clas"].create_index([("tags", 1), ("ativo", 1)], collation=colacao_pt, name="tags_ci")
+        # Ranking clã x clã e listar_clas: sort por total_xp entre clãs ativos
+        mongo_db["Clas"].create_index([("ativo", 1), ("total_xp", DESCENDING)])
+        # ── [AURA PERF] Amizades: aresta canônica por par + lista de amigos por membro ──
+        try:
+            mongo_db["amizades"].create_index("par_id", unique=True, sparse=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Índice único amizades.par_id não criado (rodar migracoes.py canonizar_amizades): {e}")
+        mongo_db["amizades"].create_index([("membros", 1), ("status", 1)])
+        mongo_db["amizades"].create_index([("receptor_id", 1), ("status", 1)])
+        # ── [AURA PERF] Chats: leitura por keyset em _id dentro do canal ──
+        mongo_db["chat_cla"].create_index([("cla_id", 1), ("_id", 1)])
+        mongo_db["chat_desafios"].create_index([("desafio_id", 1), ("canal", 1), ("dupla_id", 1), ("_id", 1)])
+        # Retenção de 30 dias via TTL (mensagens gravam 'expira_em' = envio + CHAT_RETENCAO_DIAS)
+        mongo_db["chat_cla"].create_index("expira_em", expireAfterSeconds=0)
+        mongo_db["chat_desafios"].create_index("expira_em", expireAfterSeconds=0)
+        # ── [AURA PERF] Notificações: caixa de entrada por keyset + limpeza de lidas via TTL ──
+        mongo_db["notificacoes"].create_index([("user_id", 1), ("created_at", DESCENDING)])
+        mongo_db["notificacoes"].create_index([("user_id", 1), ("lida", 1)])
+        # Em try próprio: TTL alterado não pode derrubar os índices seguintes.
+        # Mudança de NOTIFICACOES_LIDAS_DIAS vai por collMod (create_index daria IndexOptionsConflict).
+        try:
+            ttl_lidas = int(os.getenv("NOTIFICACOES_LIDAS_DIAS", 90)) * 86400
+            indice_lidas = mongo_db["notificacoes"].index_information().get("lida_em_1")
+            if indice_lidas is None:
+                mongo_db["notificacoes"].create_index("lida_em", expireAfterSeconds=ttl_lidas)
+            elif indice_lidas.get("expireAfterSeconds") != ttl_lidas:
+                mongo_db.command("collMod", "notificacoes",
+                                 index={"keyPattern": {"lida_em": 1}, "expireAfterSeconds": ttl_lidas})
+                logger.info(f"🔔 TTL de notificações lidas ajustado para {ttl_lidas // 86400} dias.")
+        except Exception as e:
+            logger.error(f"❌ Índice TTL notificacoes.lida_em não aplicado: {e}")
+        # Ranking materializado: páginas por cursor de posição e "minha posição" nos quadros de período
+        mongo_db["ranking_global"].create_index([("quadro", 1), ("versao", 1), ("posicao", 1)])
+        mongo_db["ranking_global"].create_index([("quadro", 1), ("versao", 1), ("user_id", 1)])
+        # Quadros semanal/mensal: soma do ledger por período
+        mongo_db["ledger_xp"].create_index([("estado", 1), ("aplicado_em", 1)])
+
+        # ── [AURA PERF] Catálogo de desafios: filtros + keyset (avaliacao_media, _id) no índice ──
+        for prefixo in ([], ["tipo"], ["profissional_tipo"], ["profissional_verificado"]):
+            mongo_db["desafios"].create_index(
+                [("status", 1)] + [(c, 1) for c in prefixo] +
+                [("avaliacao_media", DESCENDING), ("_id", DESCENDING)]
+            )
+        mongo_db["desafios"].create_index(
+            [("titulo", "text"), ("descricao", "text")],
+            weights={"titulo": 3, "descricao": 1}, default_language="portuguese", name="busca_texto"
+        )
+        # Meus desafios + sincronização dos dados do profissional
+        mongo_db["desafios"].create_index([("profissional_id", 1), ("criado_em", DESCENDING)])
+
+        # Ledger de XP: soma do creditado por atividade (update/delete do Strava)
+        mongo_db["ledger_xp"].create_index([("atividade_id", 1), ("estado", 1)])
+        # Backfills pendentes/pausados para o scheduler retomar
+        mongo_db["strava_backfill"].create_index([("status", 1), ("executando_ate", 1)])
+        # Fila do webhook Strava: reprocessamento e expiração dos já processados
+        mongo_db["eventos_strava"].create_index([("status", 1), ("lease_ate", 1)])
+        mongo_db["eventos_strava"].create_index("expira_em", expireAfterSeconds=0)
+
         logger.info("⚡ Índices robustos validados no MongoDB Atlas.")
     except Exception as e:
         logger.warning(f"⚠️ Aviso ao gerenciar índices: {e}")
\ No newline at end of file
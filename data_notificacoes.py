@@ -0,0 +1,143 @@
+import os
+import logging
+from typing import Dict, Any, List
+from datetime import datetime
+from bson.objectid import ObjectId
+
+# Importações do Data Manager (MongoDB)
+from data_manager import mongo_db
+
+# Configuração de Logs
+logger = logging.getLogger("AURA_NOTIFICACOES")
+
+# ==============================================================
+# 🔔 CAMADA DE DADOS DE NOTIFICAÇÕES (coleção 'notificacoes')
+# ==============================================================
+# usuarios.notificacoes_nao_lidas é um contador desnormalizado: +1 a cada
+# notificação criada, recontado quando o usuário lê (e na 1ª página da caixa
+# de entrada, se divergir). O badge do app é a leitura de um único campo, sem
+# contar documentos. Notificações lidas ganham 'lida_em'
+# (Date) e expiram via índice TTL depois de NOTIFICACOES_LIDAS_DIAS.
+
+COLECAO_NOTIFICACOES = "notificacoes"
+CAMPO_CONTADOR = "notificacoes_nao_lidas"
+NOTIFICACOES_LIDAS_DIAS = int(os.getenv("NOTIFICACOES_LIDAS_DIAS", 90))
+LOTE_LEITURA = 500
+
+
+def criar_notificacao(user_id: str, tipo: str, mensagem: str, meta: dict = None) -> bool:
+    """
+    Insere a notificação e incrementa o contador de não lidas.
+    Silencia erros para não quebrar o fluxo principal.
+    """
+    if mongo_db is None or not user_id:
+        return False
+    try:
+        mongo_db[COLECAO_NOTIFICACOES].insert_one({
+            "user_id":    user_id,
+            "tipo":       tipo,        # "amizade_pedido" | "amizade_aceita" | "sistema" | "mercado"
+            "mensagem":   mensagem,
+            "meta":       meta or {},
+            "lida":       False,
+            "created_at": datetime.now().isoformat()
+        })
+        if ObjectId.is_valid(user_id):
+            existente = mongo_db["usuarios"].update_one(
+                {"_id": ObjectId(user_id), CAMPO_CONTADOR: {"$exists": True}}, {"$inc": {CAMPO_CONTADOR: 1}}
+            )
+            # Usuário antigo sem contador: semeia pela contagem (que já inclui esta
+            # notificação); se outro request semeou antes, vale o $inc normal
+            if existente.matched_count == 0 and not _semear_contador(user_id)[1]:
+                mongo_db["usuarios"].update_one({"_id": ObjectId(user_id)}, {"$inc": {CAMPO_CONTADOR: 1}})
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao criar notificação para {user_id}: {e}")
+        return False
+
+
+def contar_nao_lidas(user_id: str) -> int:
+    """Badge: leitura de um campo. Usuários antigos sem contador são contados uma vez e gravados."""
+    if mongo_db is None or not ObjectId.is_valid(user_id):
+        return 0
+    doc = mongo_db["usuarios"].find_one({"_id": ObjectId(user_id)}, {CAMPO_CONTADOR: 1}) or {}
+    if CAMPO_CONTADOR in doc:
+        return max(0, int(doc[CAMPO_CONTADOR]))
+
+    return _semear_contador(user_id)[0]
+
+
+def _semear_contador(user_id: str) -> tuple:
+    """Conta as não lidas e grava se o contador ainda não existe. Retorna (total, gravado)."""
+    total = mongo_db[COLECAO_NOTIFICACOES].count_documents({"user_id": user_id, "lida": False})
+    gravado = mongo_db["usuarios"].update_one(
+        {"_id": ObjectId(user_id), CAMPO_CONTADOR: {"$exists": False}},
+        {"$set": {CAMPO_CONTADOR: total}}
+    ).modified_count == 1
+    return total, gravado
+
+
+def recontar_nao_lidas(user_id: str) -> int:
+    """
+    Recalcula o contador a partir das notificações e grava só se divergir.
+    Corrige qualquer deriva (ex.: $set do usuário inteiro com valor antigo).
+    """
+    if mongo_db is None or not ObjectId.is_valid(user_id):
+        return 0
+    total = mongo_db[COLECAO_NOTIFICACOES].count_documents({"user_id": user_id, "lida": False})
+    mongo_db["usuarios"].update_one(
+        {"_id": ObjectId(user_id), CAMPO_CONTADOR: {"$ne": total}},
+        {"$set": {CAMPO_CONTADOR: total}}
+    )
+    return total
+
+
+def listar_notificacoes(user_id: str, limite: int = 30, antes: str = "") -> Dict[str, Any]:
+    """
+    Página da caixa de entrada, mais recentes primeiro (índice user_id+created_at).
+    'antes' é o created_at do último item recebido; 'proximo' é o cursor seguinte.
+    """
+    limite = min(max(1, int(limite)), 100)
+    filtro = {"user_id": user_id}
+    if antes:
+        filtro["created_at"] = {"$lt": antes}
+
+    notifs: List[Dict[str, Any]] = []
+    for n in mongo_db[COLECAO_NOTIFICACOES].find(filtro).sort("created_at", -1).limit(limite):
+        notifs.append({
+            "id":         str(n["_id"]),
+            "tipo":       n.get("tipo", "sistema"),
+            "mensagem":   n.get("mensagem", ""),
+            "meta":       n.get("meta", {}),
+            "lida":       n.get("lida", False),
+            "created_at": n.get("created_at", ""),
+        })
+    return {
+        "notificacoes": notifs,
+        "proximo": notifs[-1]["created_at"] if len(notifs) == limite else None,
+    }
+
+
+def marcar_todas_lidas(user_id: str) -> int:
+    """
+    Marca as não lidas como lidas em lotes de LOTE_LEITURA (nada de update_many
+    sem limite) e reconta o contador: subtrair o marcado deixaria badge fantasma
+    se o valor gravado estivesse defasado.
+    """
+    agora = datetime.utcnow()
+    total = 0
+    while True:
+        ids = [d["_id"] for d in mongo_db[COLECAO_NOTIFICACOES].find(
+            {"user_id": user_id, "lida": False}, {"_id": 1}
+        ).limit(LOTE_LEITURA)]
+        if not ids:
+            break
+        total += mongo_db[COLECAO_NOTIFICACOES].update_many(
+            {"_id": {"$in": ids}, "lida": False},
+            {"$set": {"lida": True, "lida_em": agora}}
+        ).modified_count
+        if len(ids) < LOTE_LEITURA:
+            break
+
+    # Notificação criada durante a marcação continua contada
+    recontar_nao_lidas(user_id)
+    return total
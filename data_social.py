@@ -0,0 +1,389 @@
+import logging
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# Importações do Data Manager (MongoDB)
+from data_manager import mongo_db, carregar_resumos_usuarios
+from data_clas import obter_resumo_cla
+
+# Configuração de Logs
+logger = logging.getLogger("AURA_DATA_SOCIAL")
+
+# ==============================================================
+# 🤝 CAMADA DE DADOS DE AMIZADES (coleção 'amizades')
+# ==============================================================
+# Cada par de usuários tem UMA aresta, identificada por par_id (ids ordenados),
+# com índice único. 'membros' guarda os dois ids (índice multikey) para a lista
+# de amigos sair de uma única leitura indexada, sem $or sobre as duas direções.
+# solicitante_id / receptor_id continuam no documento: indicam quem pediu.
+
+COLECAO_AMIZADES = "amizades"
+
+# Listas de adjacência (amigos aceitos) em memória, por worker.
+# Invalidadas localmente ao aceitar/remover; o TTL limita a defasagem nos outros workers.
+_ADJACENCIA_TTL = 120  # segundos
+_ADJACENCIA_MAX = 5000  # usuários em cache por worker
+_adjacencia_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_adjacencia_lock = threading.Lock()
+
+
+def par_id(user_a: str, user_b: str) -> str:
+    """Chave canônica da aresta: independe de quem pediu."""
+    return ":".join(sorted((str(user_a), str(user_b))))
+
+
+def _invalidar_adjacencia(*user_ids):
+    with _adjacencia_lock:
+        for uid in user_ids:
+            _adjacencia_cache.pop(uid, None)
+
+
+def obter_amizade(user_a: str, user_b: str) -> Optional[Dict[str, Any]]:
+    """Aresta entre os dois usuários (qualquer status) ou None. Point lookup em par_id."""
+    if mongo_db is None or not user_a or not user_b:
+        return None
+    return mongo_db[COLECAO_AMIZADES].find_one({"par_id": par_id(user_a, user_b)})
+
+
+def status_amizade(current_user_id: str, outro_id: str) -> str:
+    """'nenhum' | 'aceita' | 'recusada' | 'pendente_enviado' | 'pendente_recebido'."""
+    amizade = obter_amizade(current_user_id, outro_id)
+    if not amizade:
+        return "nenhum"
+    status = amizade.get("status", "nenhum")
+    if status == "pendente":
+        return "pendente_enviado" if amizade.get("solicitante_id") == current_user_id else "pendente_recebido"
+    return status
+
+
+def criar_pedido(solicitante_id: str, receptor_id: str) -> bool:
+    """Cria o pedido pendente. False se já existe qualquer relação entre os dois."""
+    try:
+        mongo_db[COLECAO_AMIZADES].insert_one({
+            "par_id":         par_id(solicitante_id, receptor_id),
+            "membros":        [solicitante_id, receptor_id],
+            "solicitante_id": solicitante_id,
+            "receptor_id":    receptor_id,
+            "status":         "pendente",
+            "created_at":     datetime.now().isoformat()
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def responder_pedido(solicitante_id: str, receptor_id: str, aceitar: bool) -> Optional[str]:
+    """Aceita/recusa o pedido recebido. Retorna o novo status ou None se não havia pedido."""
+    novo_status = "aceita" if aceitar else "recusada"
+    resultado = mongo_db[COLECAO_AMIZADES].update_one(
+        {"par_id": par_id(solicitante_id, receptor_id), "solicitante_id": solicitante_id, "status": "pendente"},
+        {"$set": {"status": novo_status, "updated_at": datetime.now().isoformat()}}
+    )
+    if resultado.matched_count == 0:
+        return None
+    if aceitar:
+        _invalidar_adjacencia(solicitante_id, receptor_id)
+    return novo_status
+
+
+def desfazer_amizade(user_a: str, user_b: str) -> bool:
+    """Remove a amizade aceita (unfriend). False se não existia."""
+    resultado = mongo_db[COLECAO_AMIZADES].delete_one(
+        {"par_id": par_id(user_a, user_b), "status": "aceita"}
+    )
+    _invalidar_adjacencia(user_a, user_b)
+    return resultado.deleted_count > 0
+
+
+def listar_amigos_ids(user_id: str) -> List[Dict[str, str]]:
+    """
+    Amigos aceitos do usuário: [{"user_id", "desde"}], de uma única leitura
+    no índice (membros, status), servida do cache de adjacência quando fresca.
+    """
+    if mongo_db is None or not user_id:
+        return []
+
+    agora = time.time()
+    with _adjacencia_lock:
+        em_cache = _adjacencia_cache.get(user_id)
+        if em_cache and (agora - em_cache[0]) < _ADJACENCIA_TTL:
+            _adjacencia_cache.move_to_end(user_id)
+            return list(em_cache[1])
+
+    try:
+        cursor = mongo_db[COLECAO_AMIZADES].find(
+            {"membros": user_id, "status": "aceita"},
+            {"_id": 0, "membros": 1, "created_at": 1, "updated_at": 1}
+        )
+        amigos = []
+        for rel in cursor:
+            outro = next((m for m in rel.get("membros", []) if m != user_id), None)
+            if outro:
+                amigos.append({"user_id": outro, "desde": rel.get("updated_at", rel.get("created_at", ""))})
+    except Exception as e:
+        logger.error(f"❌ Erro ao carregar amigos de {user_id}: {e}")
+        return list(em_cache[1]) if em_cache else []
+
+    with _adjacencia_lock:
+        _adjacencia_cache[user_id] = (agora, amigos)
+        _adjacencia_cache.move_to_end(user_id)
+        while len(_adjacencia_cache) > _ADJACENCIA_MAX:
+            _adjacencia_cache.popitem(last=False)
+    return list(amigos)
+
+
+# ==============================================================
+# 📰 FEED DE AMIGOS (fan-out na escrita, timelines limitadas)
+# ==============================================================
+# Cada usuário tem um documento em 'timeline_amigos' (_id = user_id) com os
+# últimos TIMELINE_MAX eventos dele e dos amigos, mais recente primeiro.
+# O evento é empurrado para todas as timelines no momento em que acontece
+# ($push + $position 0 + $slice), em lotes de bulk_write. A leitura do feed
+# é um único documento, independente de quantos amigos o usuário tem.
+
+COLECAO_TIMELINE = "timeline_amigos"
+TIMELINE_MAX = 200
+FANOUT_LOTE = 500
+TIPOS_EVENTO = ("atividade", "missao", "nivel")
+
+
+def publicar_evento_social(autor_id: str, tipo: str, titulo: str, xp: int = 0, **extras) -> int:
+    """
+    Empurra o evento para a timeline do autor e de cada amigo aceito.
+    Retorna quantas timelines foram atualizadas. Falhas não interrompem o fluxo do autor.
+    """
+    if mongo_db is None or not autor_id or tipo not in TIPOS_EVENTO:
+        return 0
+
+    evento = {
+        "id":        str(ObjectId()),
+        "autor_id":  autor_id,
+        "tipo":      tipo,
+        "titulo":    titulo,
+        "xp":        int(xp or 0),
+        "criado_em": datetime.now().isoformat(),
+    }
+    evento.update(extras)
+
+    destinatarios = [autor_id] + [a["user_id"] for a in listar_amigos_ids(autor_id)]
+    atualizadas = 0
+    try:
+        for i in range(0, len(destinatarios), FANOUT_LOTE):
+            ops = [
+                UpdateOne(
+                    {"_id": uid},
+                    {"$push": {"itens": {"$each": [evento], "$position": 0, "$slice": TIMELINE_MAX}}},
+                    upsert=True
+                )
+                for uid in destinatarios[i:i + FANOUT_LOTE]
+            ]
+            mongo_db[COLECAO_TIMELINE].bulk_write(ops, ordered=False)
+            atualizadas += len(ops)
+    except Exception as e:
+        logger.error(f"❌ Erro no fan-out do evento '{tipo}' de {autor_id}: {e}")
+    return atualizadas
+
+
+def _com_autor(itens: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    autores = carregar_resumos_usuarios(i.get("autor_id") for i in itens)
+    for item in itens:
+        doc = autores.get(item.get("autor_id"), {})
+        foto = doc.get("foto_perfil", "")
+        item["autor"] = {
+            "nome":  doc.get("nome", "Atleta"),
+            "foto":  "" if foto.startswith("data:") else foto,
+            "nivel": doc.get("nivel", 1),
+        }
+    return itens
+
+
+def obter_feed(user_id: str, limite: int = 20, antes: str = "") -> Dict[str, Any]:
+    """
+    Página do feed (mais recente primeiro). 'antes' é o criado_em do último item
+    recebido; 'proximo' é o cursor da página seguinte (None no fim).
+    """
+    if mongo_db is None or not user_id:
+        return {"itens": [], "proximo": None}
+
+    limite = min(max(1, int(limite)), 50)
+    try:
+        if antes:
+            docs = list(mongo_db[COLECAO_TIMELINE].aggregate([
+                {"$match": {"_id": user_id}},
+                {"$project": {"itens": {"$slice": [
+                    {"$filter": {"input": "$itens", "cond": {"$lt": ["$$this.criado_em", antes]}}},
+                    limite
+                ]}}},
+            ]))
+            itens = docs[0].get("itens", []) if docs else []
+        else:
+            doc = mongo_db[COLECAO_TIMELINE].find_one({"_id": user_id}, {"itens": {"$slice": limite}})
+            itens = (doc or {}).get("itens", [])
+    except Exception as e:
+        logger.error(f"❌ Erro ao carregar feed de {user_id}: {e}")
+        return {"itens": [], "proximo": None}
+
+    return {
+        "itens":   _com_autor(itens),
+        "proximo": itens[-1]["criado_em"] if len(itens) == limite else None,
+    }
+
+
+def obter_ranking_amigos(user_id: str, dias: int = 7, limite: int = 50) -> List[Dict[str, Any]]:
+    """
+    Ranking entre amigos pelo XP dos últimos N dias, somado a partir da própria
+    timeline (já contém os eventos do usuário e dos amigos) + resumos em cache.
+    """
+    if mongo_db is None or not user_id:
+        return []
+    desde = (datetime.now() - timedelta(days=dias)).isoformat()
+    try:
+        agregados = list(mongo_db[COLECAO_TIMELINE].aggregate([
+            {"$match": {"_id": user_id}},
+            {"$unwind": "$itens"},
+            {"$match": {"itens.criado_em": {"$gte": desde}, "itens.tipo": {"$in": ["atividade", "missao"]}}},
+            {"$group": {"_id": "$itens.autor_id", "xp_periodo": {"$sum": "$itens.xp"}}},
+            {"$sort": {"xp_periodo": -1}},
+            {"$limit": limite},
+        ]))
+    except Exception as e:
+        logger.error(f"❌ Erro no ranking de amigos de {user_id}: {e}")
+        return []
+
+    resumos = carregar_resumos_usuarios(a["_id"] for a in agregados)
+    ranking = []
+    for a in agregados:
+        doc = resumos.get(a["_id"])
+        if not doc:
+            continue
+        foto = doc.get("foto_perfil", "")
+        ranking.append({
+            "posicao":    len(ranking) + 1,
+            "user_id":    a["_id"],
+            "nome":       doc.get("nome", "Atleta"),
+            "foto":       "" if foto.startswith("data:") else foto,
+            "nivel":      doc.get("nivel", 1),
+            "xp_total":   doc.get("xp_total", 0),
+            "xp_periodo": a["xp_periodo"],
+            "voce":       a["_id"] == user_id,
+        })
+    return ranking
+
+
+# ==============================================================
+# 🪪 PERFIL PÚBLICO (contadores mantidos na escrita + cache curto)
+# ==============================================================
+# usuarios.estatisticas_publicas guarda os números exibidos no modal de perfil
+# ({"atividades": N, "missoes": N}), incrementados quando a atividade/missão é
+# registrada (só por $inc: atualizar_usuario descarta o campo, então o $set do
+# documento inteiro em salvar_memoria não apaga incrementos). Abrir um perfil é uma leitura por _id com projeção enxuta, servida
+# do cache por PERFIL_CACHE_TTL; o resumo do clã vem do cache de data_clas.
+
+CAMPO_ESTATISTICAS = "estatisticas_publicas"
+ESTATISTICAS_PUBLICAS = ("atividades", "missoes")
+
+_PERFIL_CACHE_TTL = 30  # segundos
+_PERFIL_CACHE_MAX = 5000
+_perfil_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_perfil_lock = threading.Lock()
+
+_PROJECAO_PERFIL = {
+    "nome": 1, "foto_perfil": 1, "xp_total": 1, "nivel": 1, "objetivo": 1,
+    "cla_atual_id": 1, "ofensiva_atual": 1, "esportes_favoritos": 1,
+    CAMPO_ESTATISTICAS: 1,
+}
+
+
+def invalidar_perfil_publico(*user_ids):
+    with _perfil_lock:
+        for uid in user_ids:
+            _perfil_cache.pop(str(uid), None)
+
+
+def incrementar_estatistica(user_id: str, campo: str, n: int = 1):
+    """
+    $inc em estatisticas_publicas.<campo>. Silencia erros para não quebrar o fluxo principal.
+    Usuário antigo sem o contador de atividades: semeia pela contagem real antes
+    (um $inc num campo ausente o criaria em n e esconderia o histórico).
+    """
+    if mongo_db is None or campo not in ESTATISTICAS_PUBLICAS or not ObjectId.is_valid(user_id):
+        return
+    caminho = f"{CAMPO_ESTATISTICAS}.{campo}"
+    try:
+        existente = mongo_db["usuarios"].update_one(
+            {"_id": ObjectId(user_id), caminho: {"$exists": True}}, {"$inc": {caminho: n}}
+        )
+        if existente.matched_count == 0:
+            # A contagem já inclui o registro recém-inserido; se outro request semeou
+            # antes, o $inc normal vale. Missões não têm histórico: contam a partir daqui.
+            semeado = campo == "atividades" and _semear_atividades(user_id)[1]
+            if not semeado:
+                mongo_db["usuarios"].update_one({"_id": ObjectId(user_id)}, {"$inc": {caminho: n}})
+        invalidar_perfil_publico(user_id)
+    except Exception as e:
+        logger.error(f"❌ Erro ao incrementar {campo} de {user_id}: {e}")
+
+
+def _semear_atividades(user_id: str) -> tuple:
+    """
+    Usuários antigos sem contador: conta uma vez e grava (não sobrescreve um $inc concorrente).
+    Retorna (total, gravado).
+    """
+    total = mongo_db["atividades"].count_documents({"user_id": user_id})
+    gravado = mongo_db["usuarios"].update_one(
+        {"_id": ObjectId(user_id), f"{CAMPO_ESTATISTICAS}.atividades": {"$exists": False}},
+        {"$set": {f"{CAMPO_ESTATISTICAS}.atividades": total}}
+    ).modified_count == 1
+    return total, gravado
+
+
+def obter_perfil_publico(user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Projeção compacta do perfil de terceiros (sem status de amizade, que depende
+    de quem está vendo). None se o usuário não existe.
+    """
+    if mongo_db is None or not ObjectId.is_valid(user_id):
+        return None
+
+    agora = time.time()
+    with _perfil_lock:
+        em_cache = _perfil_cache.get(user_id)
+        if em_cache and (agora - em_cache[0]) < _PERFIL_CACHE_TTL:
+            _perfil_cache.move_to_end(user_id)
+            return dict(em_cache[1])
+
+    doc = mongo_db["usuarios"].find_one({"_id": ObjectId(user_id)}, _PROJECAO_PERFIL)
+    if not doc:
+        return None
+
+    stats = doc.get(CAMPO_ESTATISTICAS) or {}
+    atividades = stats["atividades"] if "atividades" in stats else _semear_atividades(user_id)[0]
+    cla = obter_resumo_cla(doc.get("cla_atual_id", ""))
+
+    perfil = {
+        "user_id":            user_id,
+        "nome":               doc.get("nome", "Anônimo"),
+        "foto":               doc.get("foto_perfil", ""),
+        "nivel":              doc.get("nivel", 1),
+        "xp_total":           doc.get("xp_total", 0),
+        "objetivo":           doc.get("objetivo", ""),
+        "cla_nome":           cla["nome"] if cla else "",
+        "cla":                cla,
+        "ofensiva_atual":     doc.get("ofensiva_atual", 0),
+        "esportes":           doc.get("esportes_favoritos", []),
+        "missoes_total":      atividades,
+        "missoes_concluidas": stats.get("missoes", 0),
+    }
+
+    with _perfil_lock:
+        _perfil_cache[user_id] = (agora, perfil)
+        _perfil_cache.move_to_end(user_id)
+        while len(_perfil_cache) > _PERFIL_CACHE_MAX:
+            _perfil_cache.popitem(last=False)
+    return dict(perfil)
@@ -1,8 +1,14 @@
 import os
+import time
 import requests
 import re
 import logging
 from datetime import datetime, timedelta
+from typing import Optional, Dict, Any
+
+from bson.objectid import ObjectId
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # [AURA FIX] Importação explícita do mongo_db para garantir sincronização com o Render
 from data_manager import mongo_db
@@ -11,8 +17,14 @@ from data_manager import mongo_db
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("AURA_FINANCEIRO")
 
-# URL de Produção do Asaas
-ASAAS_URL = "https://www.asaas.com/api/v3"
+# URL de Produção do Asaas (única para todo o backend)
+ASAAS_URL = os.getenv("ASAAS_API_URL", "https://www.asaas.com/api/v3")
+
+# (conexão, leitura) em segundos: uma chamada travada não prende a thread do gunicorn
+ASAAS_TIMEOUT = (3.05, 15)
+
+COLECAO_PIX_QRCODES = "pix_qrcodes"
+PIX_QRCODE_VALIDADE_PADRAO = timedelta(days=1)  # se o Asaas não informar expirationDate
 
 def get_headers():
     token = os.getenv("ASAAS_ACCESS_TOKEN")
@@ -24,6 +36,38 @@ def get_headers():
         "access_token": token or ""
     }
 
+# ======================================================
+# 🌐 CLIENTE HTTP (POOL + TIMEOUT + RETRY)
+# ======================================================
+
+def _criar_sessao() -> requests.Session:
+    """
+    Sessão compartilhada (keep-alive) por worker.
+    Retry só em erro de conexão para qualquer método; 429/5xx só em GET,
+    para um POST /payments nunca gerar cobrança duplicada.
+    """
+    retry = Retry(
+        total=2,
+        connect=2,
+        read=1,
+        status=2,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=retry)
+    sessao = requests.Session()
+    sessao.mount("https://", adapter)
+    return sessao
+
+_sessao = _criar_sessao()
+
+def asaas_request(metodo: str, caminho: str, **kwargs) -> requests.Response:
+    """Chamada à API do Asaas pelo pool compartilhado (caminho relativo, ex.: '/payments')."""
+    kwargs.setdefault("timeout", ASAAS_TIMEOUT)
+    return _sessao.request(metodo, f"{ASAAS_URL}{caminho}", headers=get_headers(), **kwargs)
+
 # ======================================================
 # 🛠️ UTILITÁRIOS (SANITIZAÇÃO)
 # ======================================================
@@ -37,13 +81,45 @@ def _limpar_apenas_numeros(texto: str) -> str:
 # 👤 GESTÃO DE CLIENTES (ASAAS)
 # ======================================================
 
-def criar_ou_buscar_cliente(usuario_dados: dict) -> str:
+def _customer_salvo(user_id: str) -> Optional[str]:
+    if mongo_db is None or not ObjectId.is_valid(user_id):
+        return None
+    try:
+        doc = mongo_db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"asaas_customer_id": 1})
+        return (doc or {}).get("asaas_customer_id")
+    except Exception as e:
+        logger.error(f"Erro ao ler asaas_customer_id de {user_id}: {e}")
+        return None
+
+def _salvar_customer(user_id: str, customer_id: str):
+    if mongo_db is None or not ObjectId.is_valid(user_id):
+        return
+    try:
+        mongo_db["usuarios"].update_one(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"asaas_customer_id": customer_id}}
+        )
+    except Exception as e:
+        logger.error(f"Erro ao salvar asaas_customer_id de {user_id}: {e}")
+
+def criar_ou_buscar_cliente(usuario_dados: dict, user_id: str = "") -> str:
     """
-    Verifica se o cliente já existe no Asaas pelo CPF ou Email.
-    Se não, cria um novo. Retorna o customer_id (cus_xxx).
+    Retorna o customer_id (cus_xxx) do usuário no Asaas.
+    Com user_id, o id salvo em usuarios.asaas_customer_id evita qualquer chamada;
+    sem ele, busca por CPF, depois por Email, e por fim cria o cliente
+    (o resultado é salvo para as próximas cobranças).
     """
-    headers = get_headers()
-    
+    if user_id:
+        salvo = _customer_salvo(user_id)
+        if salvo:
+            return salvo
+
+    customer_id = _resolver_cliente(usuario_dados)
+    if customer_id and user_id:
+        _salvar_customer(user_id, customer_id)
+    return customer_id
+
+def _resolver_cliente(usuario_dados: dict) -> Optional[str]:
     # [AURA FIX] Sanitização rigorosa para evitar que o Asaas recuse o payload
     cpf_limpo = _limpar_apenas_numeros(usuario_dados.get('cpf', ''))
     email = usuario_dados.get('email', '').strip().lower()
@@ -51,7 +127,7 @@ def criar_ou_buscar_cliente(usuario_dados: dict) -> str:
     # 1. Tenta buscar por CPF (Mais seguro para evitar duplicidade)
     if cpf_limpo:
         try:
-            busca = requests.get(f"{ASAAS_URL}/customers?cpfCnpj={cpf_limpo}", headers=headers)
+            busca = asaas_request("GET", "/customers", params={"cpfCnpj": cpf_limpo})
             if busca.status_code == 200:
                 dados = busca.json().get('data', [])
                 if dados:
@@ -63,7 +139,7 @@ def criar_ou_buscar_cliente(usuario_dados: dict) -> str:
     # 2. Se falhar ou não tiver CPF, tenta buscar por Email
     if email:
         try:
-            busca = requests.get(f"{ASAAS_URL}/customers?email={email}", headers=headers)
+            busca = asaas_request("GET", "/customers", params={"email": email})
             if busca.status_code == 200:
                 dados = busca.json().get('data', [])
                 if dados:
@@ -83,7 +159,7 @@ def criar_ou_buscar_cliente(usuario_dados: dict) -> str:
     
     try:
         logger.info(f"📤 Payload Asaas cliente: {payload}")
-        criacao = requests.post(f"{ASAAS_URL}/customers", json=payload, headers=headers)
+        criacao = asaas_request("POST", "/customers", json=payload)
         
         if criacao.status_code == 200:
             novo_id = criacao.json()['id']
@@ -96,6 +172,60 @@ def criar_ou_buscar_cliente(usuario_dados: dict) -> str:
         logger.error(f"❌ Erro de conexão Asaas ao criar cliente: {e}")
         return None
 
+# ======================================================
+# 🔳 PIX QR CODE (CACHE POR PAGAMENTO)
+# ======================================================
+
+def _validade_qrcode(qr: Dict[str, Any]) -> datetime:
+    """Instante (UTC, para o índice TTL) em que o QR deixa de valer."""
+    try:
+        # expirationDate vem em horário de Brasília (UTC-3)
+        return datetime.strptime(qr["expirationDate"], "%Y-%m-%d %H:%M:%S") + timedelta(hours=3)
+    except (KeyError, TypeError, ValueError):
+        return datetime.utcnow() + PIX_QRCODE_VALIDADE_PADRAO
+
+def obter_qrcode_pix(payment_id: str, tentativas: int = 1) -> Optional[Dict[str, Any]]:
+    """
+    QR Code PIX de um pagamento ({payload, encodedImage, expirationDate}).
+    O QR de um pagamento não muda: fica em 'pix_qrcodes' até expirar.
+    None se o Asaas ainda não gerou (ou não gera mais) o QR.
+    """
+    if mongo_db is not None:
+        try:
+            salvo = mongo_db[COLECAO_PIX_QRCODES].find_one(
+                {"_id": payment_id, "expira_em": {"$gt": datetime.utcnow()}}, {"qr": 1}
+            )
+            if salvo:
+                return salvo["qr"]
+        except Exception as e:
+            logger.error(f"Erro ao ler QR Code em cache ({payment_id}): {e}")
+
+    qr = None
+    # Asaas pode demorar alguns milissegundos para gerar o QR Code logo após a cobrança
+    for tentativa in range(tentativas):
+        try:
+            resp = asaas_request("GET", f"/payments/{payment_id}/pixQrCode")
+            if resp.status_code == 200:
+                qr = resp.json()
+                logger.info(f"✅ PIX QR Code obtido na tentativa {tentativa + 1}")
+                break
+            logger.warning(f"⏳ QR Code tentativa {tentativa + 1} falhou ({resp.status_code}).")
+        except requests.RequestException as e:
+            logger.warning(f"⏳ QR Code tentativa {tentativa + 1} sem resposta: {e}")
+        if tentativa < tentativas - 1:
+            time.sleep(1.5)
+
+    if qr and mongo_db is not None:
+        try:
+            mongo_db[COLECAO_PIX_QRCODES].update_one(
+                {"_id": payment_id},
+                {"$set": {"qr": qr, "expira_em": _validade_qrcode(qr), "salvo_em": datetime.now().isoformat()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Erro ao salvar QR Code em cache ({payment_id}): {e}")
+    return qr
+
 # ======================================================
 # 💳 GERAÇÃO DE COBRANÇA & PERSISTÊNCIA
 # ======================================================
@@ -105,8 +235,6 @@ def criar_cobranca(dados_pagamento: dict) -> dict:
     Gera a cobrança (PIX ou Cartão) e SALVA NO MONGODB.
     [AURA LOGISTICS] Agora separa valor de frete e armazena transportadora.
     """
-    headers = get_headers()
-    
     # [AURA FIX] Limpeza profunda do user_id
     user_id = str(dados_pagamento.get('user_id', '')).strip().replace('"', '').replace("'", "")
     if not user_id:
@@ -114,7 +242,7 @@ def criar_cobranca(dados_pagamento: dict) -> dict:
 
     # 1. Identificar ou Criar Cliente no Asaas
     usuario_info = dados_pagamento.get('usuario', {})
-    customer_id = criar_ou_buscar_cliente(usuario_info)
+    customer_id = criar_ou_buscar_cliente(usuario_info, user_id)
     
     if not customer_id:
         return {"erro": "Falha ao registrar dados no gateway. Verifique CPF/Email."}
@@ -145,7 +273,7 @@ def criar_cobranca(dados_pagamento: dict) -> dict:
 
     # 3. Enviar solicitação para o Asaas
     try:
-        response = requests.post(f"{ASAAS_URL}/payments", json=payload, headers=headers)
+        response = asaas_request("POST", "/payments", json=payload)
         
         if response.status_code != 200:
             try:
@@ -190,23 +318,8 @@ def criar_cobranca(dados_pagamento: dict) -> dict:
 
         # 5. Formatação de Retorno
         if billing_type == "PIX":
-            # Asaas pode demorar alguns milissegundos para gerar o QR Code.
-            # Tentamos imediatamente e, se falhar, aguardamos 1.5s e tentamos de novo.
-            import time
-            qr_data = {}
-            for tentativa in range(3):
-                qr_response = requests.get(
-                    f"{ASAAS_URL}/payments/{payment_id}/pixQrCode",
-                    headers=headers,
-                    timeout=10
-                )
-                if qr_response.status_code == 200:
-                    qr_data = qr_response.json()
-                    logger.info(f"✅ PIX QR Code gerado na tentativa {tentativa + 1}")
-                    break
-                logger.warning(f"⏳ QR Code tentativa {tentativa + 1} falhou ({qr_response.status_code}). Aguardando...")
-                if tentativa < 2:
-                    time.sleep(1.5)
+            # Tentamos até 3 vezes (1.5s entre elas); o QR fica em cache para retomadas
+            qr_data = obter_qrcode_pix(payment_id, tentativas=3) or {}
             
             # Retorna SEMPRE como PIX, com ou sem QR Code
             return {
@@ -0,0 +1,216 @@
+import os
+import logging
+import time
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+# Importações do Data Manager (MongoDB)
+from data_manager import mongo_db
+
+# Configuração de Logs
+logger = logging.getLogger("AURA_CHAT")
+
+# ==============================================================
+# 💬 LEITURA INCREMENTAL DE CHAT (keyset + long-poll)
+# ==============================================================
+# Chats de clã ('chat_cla') e de desafio ('chat_desafios') são paginados por
+# _id (ObjectId cresce com o tempo): ?after=<id> traz só o que chegou depois,
+# ?before=<id> carrega o histórico. O long-poll segura a request até chegar
+# mensagem nova no canal ou estourar o timeout, em vez do app re-baixar as
+# últimas 100/300 mensagens a cada refresh.
+#
+# Pub/sub em processo: cada canal tem um contador de versão protegido por um
+# Condition. As rotas de envio publicam localmente; um change stream por worker
+# (quando o cluster suporta) publica as mensagens gravadas pelos outros workers.
+# Sem change stream, o long-poll re-checa o banco a cada CHAT_RECHECK_SEGUNDOS.
+#
+# Orçamento de threads (Procfile: --workers 4 --threads 8 = 32 requests simultâneas):
+# no máximo CHAT_LONGPOLL_MAX_POR_WORKER (4) das 8 threads de cada worker ficam
+# presas em long-poll; as outras 4 atendem as demais rotas. Se mudar --threads,
+# mantenha este limite em no máximo metade.
+# - Pool do pymongo: o long-poll espera no Condition sem conexão em uso (só a
+#   pega durante o find), então o pico por worker é 8 threads de request + ouvinte
+#   do change stream + executores de webhook (2 Strava, 2 pagamentos) + scheduler,
+#   bem abaixo do maxPoolSize padrão (100).
+# - Memória: cada thread extra é uma pilha virtual (~8 MB reservados, poucos KB
+#   residentes); as 6 threads adicionais por worker não mudam o RSS de forma visível.
+
+CHAT_LONGPOLL_TIMEOUT = 20       # segundos segurando a request (abaixo do --timeout 60 do gunicorn)
+CHAT_RECHECK_SEGUNDOS = 5        # fallback sem change stream
+CHAT_LONGPOLL_MAX_POR_WORKER = int(os.getenv("CHAT_LONGPOLL_MAX_POR_WORKER", 4))
+# Change stream indisponível: nova tentativa com backoff (30s, 60s, ...) até este teto
+CHAT_CHANGE_STREAM_RETRY_MAX_S = int(os.getenv("CHAT_CHANGE_STREAM_RETRY_MAX_S", 300))
+
+_versoes: Dict[str, int] = {}
+_condicao = threading.Condition()
+_vagas_longpoll = threading.BoundedSemaphore(CHAT_LONGPOLL_MAX_POR_WORKER)
+
+_ouvinte_iniciado = False
+_ouvinte_lock = threading.Lock()
+_change_stream_ativo = False
+
+
+# ──────────────────────────────────────────────────────────────
+# Chaves de canal
+# ──────────────────────────────────────────────────────────────
+
+def canal_cla(cla_id: str) -> str:
+    return f"cla:{cla_id}"
+
+
+def canal_desafio(desafio_id: str) -> str:
+    return f"desafio:{desafio_id}"
+
+
+def canal_privado(desafio_id: str, dupla_id: str) -> str:
+    return f"privado:{desafio_id}:{dupla_id}"
+
+
+def _canal_do_documento(colecao: str, doc: dict) -> Optional[str]:
+    if colecao == "chat_cla":
+        return canal_cla(doc.get("cla_id", ""))
+    if doc.get("canal") == "privado":
+        return canal_privado(doc.get("desafio_id", ""), doc.get("dupla_id", ""))
+    return canal_desafio(doc.get("desafio_id", ""))
+
+
+# ──────────────────────────────────────────────────────────────
+# Pub/sub em processo
+# ──────────────────────────────────────────────────────────────
+
+def publicar(canal: str):
+    """Acorda os long-polls deste worker que esperam pelo canal."""
+    with _condicao:
+        _versoes[canal] = _versoes.get(canal, 0) + 1
+        _condicao.notify_all()
+
+
+def _ouvir_change_stream():
+    global _change_stream_ativo
+    pipeline = [{"$match": {
+        "operationType": "insert",
+        "ns.coll": {"$in": ["chat_cla", "chat_desafios"]},
+    }}]
+    espera = 30
+    avisado = False
+    while True:
+        try:
+            with mongo_db.watch(pipeline, full_document="default") as stream:
+                _change_stream_ativo = True
+                espera, avisado = 30, False
+                logger.info("📡 [CHAT] Change stream ativo: long-poll sem re-check no banco.")
+                for evento in stream:
+                    canal = _canal_do_documento(evento["ns"]["coll"], evento.get("fullDocument") or {})
+                    if canal:
+                        publicar(canal)
+        except Exception as e:
+            # Standalone/sem permissão: fica no modo re-check e tenta de novo mais tarde.
+            # Avisa uma vez por queda; as novas tentativas só aparecem em debug.
+            _change_stream_ativo = False
+            if not avisado:
+                logger.warning(f"⚠️ [CHAT] Change stream indisponível ({e}). Usando re-check periódico.")
+                avisado = True
+            else:
+                logger.debug(f"[CHAT] Change stream ainda indisponível ({e}); nova tentativa em {espera}s.")
+            time.sleep(espera)
+            espera = min(espera * 2, CHAT_CHANGE_STREAM_RETRY_MAX_S)
+
+
+def _garantir_ouvinte():
+    global _ouvinte_iniciado
+    if _ouvinte_iniciado or mongo_db is None:
+        return
+    with _ouvinte_lock:
+        if not _ouvinte_iniciado:
+            threading.Thread(target=_ouvir_change_stream, daemon=True, name="chat-change-stream").start()
+            _ouvinte_iniciado = True
+
+
+# ──────────────────────────────────────────────────────────────
+# Leitura por keyset
+# ──────────────────────────────────────────────────────────────
+
+def _cursor_keyset(valor: str, campo_data: str) -> Optional[dict]:
+    """after/before aceitam o id da mensagem ou um timestamp ISO (campo de data)."""
+    if not valor:
+        return None
+    if ObjectId.is_valid(valor):
+        return {"_id": ObjectId(valor)}
+    try:
+        datetime.fromisoformat(valor)
+        return {campo_data: valor}
+    except ValueError:
+        return None
+
+
+def buscar_mensagens(colecao: str, filtro: dict, campo_data: str, limite: int,
+                     after: str = "", before: str = "", projecao: dict = None) -> List[Dict[str, Any]]:
+    """
+    Mensagens do canal em ordem cronológica, com 'id' no lugar de '_id'.
+    - after:  só as mais novas que o cursor (polling incremental)
+    - before: página de histórico anterior ao cursor
+    - nenhum: as últimas 'limite' mensagens
+    Raises ValueError se o cursor for inválido.
+    """
+    filtro = dict(filtro)
+    ordem = DESCENDING
+
+    if after:
+        cursor = _cursor_keyset(after, campo_data)
+        if cursor is None:
+            raise ValueError("after inválido")
+        campo, valor = next(iter(cursor.items()))
+        filtro = {"$and": [filtro, {campo: {"$gt": valor}}]}
+        ordem = ASCENDING
+    elif before:
+        cursor = _cursor_keyset(before, campo_data)
+        if cursor is None:
+            raise ValueError("before inválido")
+        campo, valor = next(iter(cursor.items()))
+        filtro = {"$and": [filtro, {campo: {"$lt": valor}}]}
+
+    docs = list(mongo_db[colecao].find(filtro, projecao).sort("_id", ordem).limit(limite))
+    if ordem == DESCENDING:
+        docs.reverse()
+    for d in docs:
+        d["id"] = str(d.pop("_id"))
+    return docs
+
+
+def aguardar_mensagens(colecao: str, filtro: dict, campo_data: str, canal: str, after: str,
+                       limite: int, projecao: dict = None, timeout: int = CHAT_LONGPOLL_TIMEOUT) -> List[Dict[str, Any]]:
+    """
+    Long-poll: devolve assim que houver mensagem depois de 'after' no canal,
+    ou [] ao fim do timeout. Se o worker já tem long-polls demais, responde na hora.
+    """
+    msgs = buscar_mensagens(colecao, filtro, campo_data, limite, after=after, projecao=projecao)
+    if msgs or not after:
+        return msgs
+
+    if not _vagas_longpoll.acquire(blocking=False):
+        return []
+    try:
+        _garantir_ouvinte()
+        fim = time.monotonic() + max(1, min(int(timeout), CHAT_LONGPOLL_TIMEOUT))
+        with _condicao:
+            versao_vista = _versoes.get(canal, 0)
+
+        while True:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                return []
+            espera = restante if _change_stream_ativo else min(restante, CHAT_RECHECK_SEGUNDOS)
+            with _condicao:
+                mudou = _condicao.wait_for(lambda: _versoes.get(canal, 0) != versao_vista, timeout=espera)
+                versao_vista = _versoes.get(canal, 0)
+            if not mudou and _change_stream_ativo:
+                continue
+
+            msgs = buscar_mensagens(colecao, filtro, campo_data, limite, after=after, projecao=projecao)
+            if msgs:
+                return msgs
+    finally:
+        _vagas_longpoll.release()
@@ -1,11 +1,16 @@
 import logging
 import random
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 # Importações da Nova Arquitetura
 from data_user import carregar_memoria, salvar_memoria
 from data_manager import mongo_db
+from data_clas import creditar_xp_cla
+from data_social import publicar_evento_social
 
 # Configuração de Logs
 logger = logging.getLogger("AURA_GAMIFICACAO")
@@ -187,13 +192,35 @@ def gerar_missoes_diarias(user_id: str) -> List[Dict[str, Any]]:
 
     return missoes_ativas
 
-def aplicar_xp(user_id: str, quantidade: int) -> Dict[str, Any]:
+def _registrar_credito_ledger(user_id: str, quantidade: int, origem: str, chave: Optional[str]):
+    """Uma entrada 'aplicado' no ledger_xp por crédito (base dos quadros semanal/mensal)."""
+    if mongo_db is None or quantidade <= 0:
+        return
+    try:
+        mongo_db["ledger_xp"].insert_one({
+            "_id": chave or str(ObjectId()),
+            "origem": origem,
+            "user_id": user_id,
+            "estado": "aplicado",
+            "xp": int(quantidade),
+            "aplicado_em": datetime.now().isoformat(),
+        })
+    except DuplicateKeyError:
+        pass
+    except Exception as e:
+        logger.error(f"⚠️ [GAMIFICAÇÃO] Falha ao registrar crédito no ledger ({user_id}): {e}")
+
+
+def aplicar_xp(user_id: str, quantidade: int, origem: str = "app",
+               chave_ledger: Optional[str] = None) -> Dict[str, Any]:
     """
     Adiciona XP e gerencia a progressão econômica Aura.
     LÓGICA UNIFICADA 3.1: 
     - Moedas = XP Ganhos (1:1)
     - Cristais = XP Ganhos / 10 (Divisão inteira //)
     - Bônus de Level Up com verificação de Schema.
+    O crédito entra no ledger_xp (origem/chave_ledger); origem "strava" não,
+    pois logic_strava já registra o próprio evento no ledger.
     """
     if not user_id: return {"erro": "ID ausente"}
 
@@ -246,7 +273,20 @@ def aplicar_xp(user_id: str, quantidade: int) -> Dict[str, Any]:
         memoria["gamificacao"]["estatisticas"]["total_atividades"] += 1
         memoria["gamificacao"]["estatisticas"]["missoes_completadas"] += 1
 
-    salvar_memoria(user_id, memoria)
+    if not salvar_memoria(user_id, memoria):
+        # Nada foi gravado (o ledger do Strava usa isso para liberar o evento);
+        # novo_xp/novo_nivel mantidos para as rotas de missão
+        return {"erro": "Falha ao salvar",
+                "novo_xp": int(memoria.get("xp_total", 0)), "novo_nivel": int(memoria.get("nivel", 1))}
+
+    if origem != "strava":
+        _registrar_credito_ledger(user_id, ganho_moedas, origem, chave_ledger)
+
+    # [AURA PERF] Fan-out incremental para o clã: contribuição do membro + total do clã
+    if memoria.get("cla_atual_id"):
+        creditar_xp_cla(memoria["cla_atual_id"], user_id, ganho_moedas)
+    if subiu_nivel:
+        publicar_evento_social(user_id, "nivel", f"Subiu para o Nível {nivel_atual}", nivel=nivel_atual)
     
     return {
         "novo_xp":      xp_atual,
@@ -262,6 +302,39 @@ def aplicar_xp(user_id: str, quantidade: int) -> Dict[str, Any]:
     }
 
 
+def estornar_xp(user_id: str, quantidade: int) -> Dict[str, Any]:
+    """
+    Reverte XP concedido (atividade apagada/corrigida no Strava).
+    Espelho de aplicar_xp: remove XP, moedas (1:1) e cristais (//10), com piso 0.
+    Não rebaixa nível nem retira bônus de level up já pagos.
+    """
+    if not user_id: return {"erro": "ID ausente"}
+
+    memoria = carregar_memoria(user_id)
+    if not memoria: return {"erro": "Perfil não carregado"}
+
+    perda = max(0, int(quantidade))
+    xp_atual = max(0, int(memoria.get("xp_total", 0)) - perda)
+    moedas_atuais = max(0, int(memoria.get("moedas", 0)) - perda)
+    cristais_atuais = max(0, int(memoria.get("saldo_cristais", 0)) - perda // 10)
+
+    memoria["xp_total"] = xp_atual
+    memoria["moedas"] = moedas_atuais
+    memoria["saldo_cristais"] = cristais_atuais
+    if not salvar_memoria(user_id, memoria):
+        return {"erro": "Falha ao salvar"}
+    if memoria.get("cla_atual_id"):
+        creditar_xp_cla(memoria["cla_atual_id"], user_id, -perda)
+
+    logger.info(f"↩️ [ESTORNO] {user_id}: -{perda} XP")
+    return {
+        "novo_xp":          xp_atual,
+        "novo_nivel":       int(memoria.get("nivel", 1)),
+        "moedas_perdidas":  perda,
+        "cristais_perdidos": perda // 10,
+    }
+
+
 def normalizar_ofensiva(user_id: str) -> Dict[str, Any]:
     """
     Aplica a regra de quebra da ofensiva:
@@ -0,0 +1,164 @@
+"""
+logic_identidade.py — Verificação dos ID tokens de Google e Apple (login social).
+
+As chaves públicas (JWKS) dos dois provedores ficam em cache por worker pelo
+tempo do Cache-Control (max-age) da resposta. Um 'kid' desconhecido força um
+refresh (no máximo um a cada JWKS_REFRESH_MIN_SEGUNDOS, para um token forjado
+não virar um fetch por request). Com a chave em mãos, o token é validado
+localmente: assinatura RS256, iss, exp e — se configurado — aud.
+
+Google: o endpoint tokeninfo só é usado quando a chave não está disponível
+(JWKS fora do ar ou kid ainda desconhecido após o refresh).
+
+Variáveis de ambiente:
+  GOOGLE_CLIENT_IDS — client IDs aceitos no 'aud' (separados por vírgula)
+  APPLE_CLIENT_IDS  — bundle/service IDs aceitos no 'aud' (separados por vírgula)
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+import requests
+from jose import jwt as jose_jwt
+
+logger = logging.getLogger("AURA_IDENTIDADE")
+
+GOOGLE_CLIENT_IDS = {c.strip() for c in os.getenv("GOOGLE_CLIENT_IDS", "").split(",") if c.strip()}
+APPLE_CLIENT_IDS  = {c.strip() for c in os.getenv("APPLE_CLIENT_IDS", "").split(",") if c.strip()}
+
+JWKS_MAX_AGE_PADRAO = 3600      # segundos, se o provedor não mandar Cache-Control
+JWKS_REFRESH_MIN_SEGUNDOS = 60  # intervalo mínimo entre refreshes forçados por kid desconhecido
+
+PROVEDORES = {
+    "google": {
+        "jwks_url": "https://www.googleapis.com/oauth2/v3/certs",
+        "emissores": ("accounts.google.com", "https://accounts.google.com"),
+        "audiencias": GOOGLE_CLIENT_IDS,
+    },
+    "apple": {
+        "jwks_url": "https://appleid.apple.com/auth/keys",
+        "emissores": ("https://appleid.apple.com",),
+        "audiencias": APPLE_CLIENT_IDS,
+    },
+}
+
+# {provedor: {"chaves": {kid: jwk}, "expira": ts, "buscado_em": ts}}
+_jwks_cache: Dict[str, Dict[str, Any]] = {}
+_jwks_lock = threading.Lock()
+
+if not GOOGLE_CLIENT_IDS:
+    logger.warning("⚠️ GOOGLE_CLIENT_IDS ausente: 'aud' dos tokens Google não será validado.")
+
+
+class ProvedorIndisponivel(Exception):
+    """Chaves do provedor inacessíveis e sem fallback (Apple)."""
+
+
+def _max_age(resp) -> int:
+    match = re.search(r"max-age=(\d+)", resp.headers.get("Cache-Control", ""))
+    return int(match.group(1)) if match else JWKS_MAX_AGE_PADRAO
+
+
+def _buscar_jwks(provedor: str) -> Optional[Dict[str, Any]]:
+    """Baixa o JWKS e atualiza o cache. None em falha (o cache anterior é mantido)."""
+    agora = time.time()
+    try:
+        resp = requests.get(PROVEDORES[provedor]["jwks_url"], timeout=5)
+        resp.raise_for_status()
+        chaves = {k["kid"]: k for k in resp.json().get("keys", []) if k.get("kid")}
+    except Exception as e:
+        logger.error(f"❌ Falha ao buscar JWKS de {provedor}: {e}")
+        entrada = _jwks_cache.get(provedor)
+        if entrada:
+            entrada["buscado_em"] = agora
+        return None
+
+    entrada = {"chaves": chaves, "expira": agora + _max_age(resp), "buscado_em": agora}
+    _jwks_cache[provedor] = entrada
+    logger.info(f"🔑 JWKS {provedor} atualizado: {len(chaves)} chaves.")
+    return entrada
+
+
+def _chave_publica(provedor: str, kid: str) -> Optional[Dict[str, Any]]:
+    """JWK do kid: cache → refresh se expirado → refresh forçado se kid desconhecido."""
+    with _jwks_lock:
+        entrada = _jwks_cache.get(provedor)
+        agora = time.time()
+        if not entrada or agora >= entrada["expira"]:
+            entrada = _buscar_jwks(provedor) or entrada
+        if entrada and kid in entrada["chaves"]:
+            return entrada["chaves"][kid]
+        # Rotação de chaves: kid novo antes do cache expirar
+        if not entrada or agora - entrada["buscado_em"] >= JWKS_REFRESH_MIN_SEGUNDOS:
+            entrada = _buscar_jwks(provedor) or entrada
+        return entrada["chaves"].get(kid) if entrada else None
+
+
+def _validar_local(provedor: str, token: str, chave: Dict[str, Any]) -> Dict[str, Any]:
+    """Assinatura, exp e iss pelo jose; aud contra a lista configurada. Raises ValueError."""
+    config = PROVEDORES[provedor]
+    # at_hash só pode ser conferido com o access_token, que o app não envia
+    # (fluxos Expo/web do Google incluem o claim no ID token)
+    try:
+        claims = jose_jwt.decode(
+            token, chave, algorithms=["RS256"],
+            options={"verify_aud": False, "verify_at_hash": False},
+        )
+    except Exception as e:
+        raise ValueError(f"token {provedor} inválido: {e}")
+
+    if claims.get("iss") not in config["emissores"]:
+        raise ValueError(f"iss inesperado: {claims.get('iss')}")
+    if config["audiencias"]:
+        aud = claims.get("aud")
+        auds = set(aud) if isinstance(aud, list) else {aud}
+        if not auds & config["audiencias"]:
+            raise ValueError(f"aud não reconhecido: {aud}")
+    return claims
+
+
+def _google_tokeninfo(token: str) -> Dict[str, Any]:
+    """Fallback de rede (sem chave local). Raises ValueError."""
+    resp = requests.get("https://oauth2.googleapis.com/tokeninfo", params={"id_token": token}, timeout=10)
+    if resp.status_code != 200:
+        raise ValueError(f"Google tokeninfo rejeitou: {resp.text[:200]}")
+    claims = resp.json()
+    if GOOGLE_CLIENT_IDS and claims.get("aud") not in GOOGLE_CLIENT_IDS:
+        raise ValueError(f"aud não reconhecido: {claims.get('aud')}")
+    return claims
+
+
+def verificar_token_google(token: str) -> Dict[str, Any]:
+    """Claims do ID token Google (email, name, ...). Raises ValueError se inválido."""
+    try:
+        kid = jose_jwt.get_unverified_header(token).get("kid")
+    except Exception:
+        raise ValueError("token Google mal formado")
+
+    chave = _chave_publica("google", kid) if kid else None
+    if chave is None:
+        logger.warning("⚠️ Chave Google indisponível em cache; usando tokeninfo.")
+        return _google_tokeninfo(token)
+    return _validar_local("google", token, chave)
+
+
+def verificar_token_apple(token: str) -> Dict[str, Any]:
+    """
+    Claims do ID token Apple. Raises ValueError se inválido,
+    ProvedorIndisponivel se as chaves da Apple não puderem ser obtidas.
+    """
+    try:
+        kid = jose_jwt.get_unverified_header(token).get("kid")
+    except Exception:
+        raise ValueError("token Apple mal formado")
+
+    chave = _chave_publica("apple", kid) if kid else None
+    if chave is None:
+        if not _jwks_cache.get("apple"):
+            raise ProvedorIndisponivel("Falha ao buscar chaves Apple")
+        raise ValueError("Chave pública Apple não encontrada")
+    return _validar_local("apple", token, chave)
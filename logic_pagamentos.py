@@ -0,0 +1,419 @@
+"""
+logic_pagamentos.py — Caixa de entrada idempotente dos webhooks de pagamento (Asaas e RevenueCat).
+
+Fluxo:
+  1. A rota do webhook valida o segredo, grava o evento em 'eventos_pagamento'
+     com _id = "<provedor>:<id do evento>" (índice único natural) e responde 200.
+     Um reenvio do provedor bate na chave duplicada e é só confirmado de novo.
+  2. O evento é processado em segundo plano (pool do worker) e, como rede de
+     segurança, pelo job 'processar_eventos_pagamento' do scheduler, que pega
+     pendentes, falhas e leases vencidos.
+  3. Os efeitos de um evento (pedido, inscrição, vagas, profissional, grant) e a
+     marcação "processado" são gravados numa única transação. Cada efeito da
+     inscrição tem marca própria (efeitos_aplicados) e um lease na inscrição, então
+     o par PAYMENT_RECEIVED + PAYMENT_CONFIRMED do mesmo pagamento não conta a vaga
+     duas vezes — e, sem transação, um reprocessamento completa o que faltou.
+  4. Notificações e e-mails saem depois do commit, só quando o evento mudou algo.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Callable
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from data_manager import mongo_db
+
+logger = logging.getLogger("AURA_PAGAMENTOS")
+
+COLECAO_EVENTOS = "eventos_pagamento"
+EVENTOS_MAX_TENTATIVAS = 8
+EVENTOS_LEASE_SEGUNDOS = 120
+EVENTOS_RETENCAO_DIAS = int(os.getenv("EVENTOS_PAGAMENTO_RETENCAO_DIAS", 90))
+
+EVENTOS_ASAAS_PAGO = ("PAYMENT_RECEIVED", "PAYMENT_CONFIRMED")
+EFEITOS_INSCRICAO = ("vaga", "aluno", "grant")
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="eventos-pagamento")
+_transacoes_suportadas: Optional[bool] = None
+_transacoes_lock = threading.Lock()
+
+
+# ──────────────────────────────────────────────────────────────
+# Entrada
+# ──────────────────────────────────────────────────────────────
+
+def _id_evento(provedor: str, dados: Dict[str, Any]) -> str:
+    if provedor == "asaas":
+        # Payloads novos trazem 'id' (evt_...); os antigos são únicos por (evento, pagamento)
+        ref = dados.get("id") or f"{dados.get('event')}:{(dados.get('payment') or {}).get('id')}"
+    else:
+        ref = (dados.get("event") or {}).get("id")
+    if not ref:
+        ref = hashlib.sha256(json.dumps(dados, sort_keys=True, default=str).encode()).hexdigest()[:32]
+    return f"{provedor}:{ref}"
+
+
+def registrar_evento(provedor: str, dados: Dict[str, Any]) -> bool:
+    """
+    Grava o evento na caixa de entrada e agenda o processamento.
+    Retorna False se o evento já tinha sido recebido (reenvio do provedor).
+    """
+    chave = _id_evento(provedor, dados)
+    agora = datetime.now()
+    try:
+        mongo_db[COLECAO_EVENTOS].insert_one({
+            "_id":         chave,
+            "provedor":    provedor,
+            "payload":     dados,
+            "status":      "pendente",
+            "tentativas":  0,
+            "recebido_em": agora.isoformat(),
+            "lease_ate":   datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        logger.info(f"🔁 [PAGAMENTOS] Evento {chave} repetido: ignorado.")
+        return False
+
+    _executor.submit(processar_evento, chave)
+    return True
+
+
+# ──────────────────────────────────────────────────────────────
+# Processamento
+# ──────────────────────────────────────────────────────────────
+
+def _reservar(chave: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Pega um evento processável (pendente/erro, ou lease vencido) com lease exclusivo."""
+    agora = datetime.utcnow()
+    filtro = {
+        "status": {"$in": ["pendente", "erro", "processando"]},
+        "tentativas": {"$lt": EVENTOS_MAX_TENTATIVAS},
+        "lease_ate": {"$lte": agora},
+    }
+    if chave:
+        filtro["_id"] = chave
+    return mongo_db[COLECAO_EVENTOS].find_one_and_update(
+        filtro,
+        {"$set": {"status": "processando", "lease_ate": agora + timedelta(seconds=EVENTOS_LEASE_SEGUNDOS)},
+         "$inc": {"tentativas": 1}},
+        sort=[("recebido_em", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _executar_transacao(funcao: Callable):
+    """
+    Roda funcao(session) numa transação; sem replica set, roda sem sessão.
+    Nesse modo não há rollback: os efeitos da inscrição se protegem pelas marcas
+    de 'efeitos_aplicados' (aplica → marca), e uma falha entre um $inc e sua
+    marca ainda pode contar aquele efeito duas vezes no reprocessamento.
+    """
+    global _transacoes_suportadas
+    if _transacoes_suportadas is not False:
+        try:
+            with mongo_db.client.start_session() as session:
+                resultado = session.with_transaction(lambda s: funcao(s))
+            _transacoes_suportadas = True
+            return resultado
+        except OperationFailure as e:
+            # 20 = IllegalOperation (standalone sem suporte a transações)
+            if e.code != 20:
+                raise
+            with _transacoes_lock:
+                _transacoes_suportadas = False
+            logger.warning("⚠️ [PAGAMENTOS] MongoDB sem transações: aplicando efeitos sem sessão.")
+    return funcao(None)
+
+
+def processar_evento(chave: Optional[str] = None) -> bool:
+    """Processa um evento (ou o próximo da fila). True se algum evento foi processado."""
+    if mongo_db is None:
+        return False
+    evento = _reservar(chave)
+    if not evento:
+        return False
+
+    aplicar = _aplicar_asaas if evento["provedor"] == "asaas" else _aplicar_revenuecat
+    pos_commit: List[Callable] = []
+
+    def _transacao(session):
+        pos_commit.clear()
+        aplicar(evento["payload"], session, pos_commit)
+        mongo_db[COLECAO_EVENTOS].update_one(
+            {"_id": evento["_id"]},
+            {"$set": {
+                "status":        "processado",
+                "processado_em": datetime.now().isoformat(),
+                "expira_em":     datetime.utcnow() + timedelta(days=EVENTOS_RETENCAO_DIAS),
+            }, "$unset": {"erro": ""}},
+            session=session,
+        )
+
+    try:
+        _executar_transacao(_transacao)
+    except Exception as e:
+        # Backoff: lease cresce com as tentativas; o scheduler retoma depois
+        espera = EVENTOS_LEASE_SEGUNDOS * evento.get("tentativas", 1)
+        mongo_db[COLECAO_EVENTOS].update_one(
+            {"_id": evento["_id"]},
+            {"$set": {"status": "erro", "erro": str(e)[:500],
+                      "lease_ate": datetime.utcnow() + timedelta(seconds=espera)}}
+        )
+        logger.error(f"❌ [PAGAMENTOS] Falha ao processar {evento['_id']} (tentativa {evento.get('tentativas')}): {e}")
+        return True
+
+    for efeito in pos_commit:
+        try:
+            efeito()
+        except Exception as e:
+            logger.error(f"⚠️ [PAGAMENTOS] Efeito pós-commit falhou para {evento['_id']}: {e}")
+    logger.info(f"✅ [PAGAMENTOS] Evento {evento['_id']} processado.")
+    return True
+
+
+def processar_pendentes(limite: int = 200) -> int:
+    """Drena a fila (job do scheduler). Retorna quantos eventos foram tentados."""
+    total = 0
+    while total < limite and processar_evento():
+        total += 1
+    return total
+
+
+# ──────────────────────────────────────────────────────────────
+# Efeitos: Asaas
+# ──────────────────────────────────────────────────────────────
+
+def _aplicar_asaas(dados: Dict[str, Any], session, pos_commit: List[Callable]):
+    if dados.get("event") not in EVENTOS_ASAAS_PAGO:
+        return
+    payment_id = (dados.get("payment") or {}).get("id")
+    if not payment_id:
+        return
+
+    agora = datetime.now().isoformat()
+    pedido = mongo_db["pedidos"].find_one({"asaas_id": payment_id}, session=session)
+    if not pedido:
+        logger.warning(f"⚠️ Webhook Asaas: pedido {payment_id} não encontrado no Atlas.")
+        return
+
+    tipo_pedido = pedido.get("tipo", "marketplace")
+    update_fields = {"status": "PAGO", "pago_em": agora, "updated_at": agora}
+
+    if tipo_pedido == "desafio":
+        _ativar_inscricao(pedido, session)
+    elif tipo_pedido == "verificacao_profissional":
+        if pedido.get("user_id"):
+            mongo_db["profissionais"].update_one(
+                {"user_id": pedido["user_id"]},
+                {"$set": {"verificacao_paga": True, "updated_at": agora}},
+                session=session,
+            )
+            logger.info(f"✅ [PERF] Verificação paga para profissional {pedido['user_id']}.")
+    elif tipo_pedido == "marketplace":
+        update_fields["notificado_admin"] = False
+
+    # Só a primeira confirmação muda o pedido (e dispara notificação/e-mail)
+    mudou = mongo_db["pedidos"].update_one(
+        {"_id": pedido["_id"], "status": {"$ne": "PAGO"}},
+        {"$set": update_fields},
+        session=session,
+    ).modified_count
+    logger.info(f"✅ Pedido {payment_id} ({tipo_pedido}) atualizado para PAGO no Atlas.")
+
+    if mudou and tipo_pedido == "marketplace" and pedido.get("user_id"):
+        pos_commit.append(lambda: _notificar_compra(pedido))
+
+
+def _ativar_inscricao(pedido: Dict[str, Any], session):
+    """
+    Inscrição PENDING → PAGO; vaga, total de alunos e grant uma vez cada.
+    Cada efeito grava sua marca em 'efeitos_aplicados' logo depois de aplicado:
+    sem transação, uma falha no meio deixa a inscrição PAGO com efeitos faltando,
+    e o reprocessamento aplica só os que faltaram.
+    """
+    inscricao_id = pedido.get("inscricao_id")
+    desafio_id = pedido.get("desafio_id")
+    if not inscricao_id or not ObjectId.is_valid(inscricao_id):
+        return
+
+    agora = datetime.now().isoformat()
+    col = mongo_db["inscricoes_desafio"]
+    oid = ObjectId(inscricao_id)
+    col.update_one(
+        {"_id": oid, "status_pagamento": {"$ne": "PAGO"}},
+        {"$set": {"status_pagamento": "PAGO", "pago_em": agora, "efeitos_aplicados": {}}},
+        session=session,
+    )
+    inscricao = col.find_one({"_id": oid}, session=session)
+    # Sem 'efeitos_aplicados': paga antes das marcas, efeitos já aplicados no fluxo antigo
+    feitos = (inscricao or {}).get("efeitos_aplicados")
+    if feitos is None or all(feitos.get(e) for e in EFEITOS_INSCRICAO):
+        logger.info(f"🔁 [PERF] Inscrição {inscricao_id} já estava paga: efeitos não reaplicados.")
+        return
+    if not desafio_id or not ObjectId.is_valid(desafio_id):
+        return
+
+    # Lease: RECEIVED e CONFIRMED do mesmo pagamento não aplicam os efeitos em paralelo
+    agora_utc = datetime.utcnow()
+    reservada = col.update_one(
+        {"_id": oid, "$or": [{"efeitos_lease_ate": {"$exists": False}},
+                             {"efeitos_lease_ate": {"$lte": agora_utc}}]},
+        {"$set": {"efeitos_lease_ate": agora_utc + timedelta(seconds=EVENTOS_LEASE_SEGUNDOS)}},
+        session=session,
+    ).modified_count
+    if not reservada:
+        raise RuntimeError(f"inscrição {inscricao_id} com efeitos em aplicação por outro evento")
+
+    try:
+        _aplicar_efeitos_inscricao(inscricao, desafio_id, feitos, agora, session)
+    finally:
+        col.update_one({"_id": oid}, {"$unset": {"efeitos_lease_ate": ""}}, session=session)
+
+
+def _marcar_efeito(inscricao_id: ObjectId, efeito: str, session):
+    mongo_db["inscricoes_desafio"].update_one(
+        {"_id": inscricao_id}, {"$set": {f"efeitos_aplicados.{efeito}": True}}, session=session
+    )
+
+
+def _aplicar_efeitos_inscricao(inscricao: Dict[str, Any], desafio_id: str, feitos: Dict[str, bool],
+                               agora: str, session):
+    d = mongo_db["desafios"].find_one(
+        {"_id": ObjectId(desafio_id)}, {"profissional_id": 1, "duracao_dias": 1}, session=session
+    )
+    if not d:
+        return
+
+    if not feitos.get("vaga"):
+        mongo_db["desafios"].update_one(
+            {"_id": d["_id"]}, {"$inc": {"vagas_ocupadas": 1, "total_inscritos": 1}}, session=session
+        )
+        _marcar_efeito(inscricao["_id"], "vaga", session)
+
+    if not feitos.get("aluno"):
+        mongo_db["profissionais"].update_one(
+            {"user_id": d.get("profissional_id")}, {"$inc": {"total_alunos": 1}}, session=session
+        )
+        _marcar_efeito(inscricao["_id"], "aluno", session)
+
+    # Grant de acesso a dados de saúde: só nasce com o pagamento confirmado
+    duracao_dias = int(d.get("duracao_dias", 30))
+    data_inicio_str = inscricao.get("data_inicio") or datetime.now().strftime("%Y-%m-%d")
+    try:
+        data_inicio_dt = datetime.fromisoformat(data_inicio_str)
+    except ValueError:
+        data_inicio_dt = datetime.now()
+    data_expiracao = (data_inicio_dt + timedelta(days=duracao_dias)).isoformat()
+
+    if not feitos.get("grant"):
+        mongo_db["grants_saude"].update_one(
+            {
+                "profissional_id": inscricao.get("profissional_id", ""),
+                "aluno_id":         inscricao.get("user_id", ""),
+                "desafio_id":       desafio_id,
+            },
+            {
+                "$set": {
+                    "inscricao_id":   str(inscricao["_id"]),
+                    "data_concessao": agora,
+                    "data_expiracao": data_expiracao,
+                    "status":         "ativo",
+                    "consentimento":  inscricao.get("consentimento", {}),
+                    "atualizado_em":  agora,
+                },
+                "$setOnInsert": {"criado_em": agora},
+            },
+            upsert=True,
+            session=session,
+        )
+        _marcar_efeito(inscricao["_id"], "grant", session)
+    logger.info(f"✅ [PERF] Inscrição {inscricao['_id']} ativada; grant de saúde até {data_expiracao}.")
+
+
+def _notificar_compra(pedido: Dict[str, Any]):
+    from data_notificacoes import criar_notificacao
+    from data_user import carregar_memoria
+    from rotas_api import _enviar_email, _html_confirmacao_compra
+
+    uid = pedido.get("user_id", "")
+    criar_notificacao(uid, "mercado", "✅ Pagamento confirmado! Seu pedido já está sendo preparado.",
+                      {"pedido_id": str(pedido["_id"]), "acao": "abrir_pedido"})
+    usuario_doc = carregar_memoria(uid)
+    if usuario_doc:
+        _enviar_email(
+            usuario_doc.get("email", ""),
+            "✅ Pedido confirmado — AURA Performance",
+            _html_confirmacao_compra(
+                usuario_doc.get("nome", "Atleta"),
+                float(pedido.get("valor_total", 0)),
+                pedido.get("itens", []),
+            )
+        )
+
+
+# ──────────────────────────────────────────────────────────────
+# Efeitos: RevenueCat (escritas $set, idempotentes por natureza)
+# ──────────────────────────────────────────────────────────────
+
+def _aplicar_revenuecat(dados: Dict[str, Any], session, pos_commit: List[Callable]):
+    evento = dados.get("event") or {}
+    tipo = evento.get("type")
+    app_user_id = evento.get("app_user_id")
+    if not app_user_id:
+        return
+
+    product_id = (evento.get("product_id") or "").lower()
+    agora_iso = datetime.now().isoformat()
+    ativacao = tipo in ("INITIAL_PURCHASE", "RENEWAL", "SUBSCRIBER_ALIAS")
+    encerramento = tipo in ("CANCELLATION", "EXPIRATION")
+
+    # ── Assinatura de PROFISSIONAL (aura_profissional_mensal) ──
+    if "profissional" in product_id:
+        if ativacao:
+            expira = (datetime.now() + timedelta(days=32)).isoformat()
+            mongo_db["profissionais"].update_one(
+                {"user_id": app_user_id},
+                {"$set": {"plano_ativo": True, "trial_ativo": False, "plano_expira": expira, "updated_at": agora_iso}},
+                session=session,
+            )
+            logger.info(f"💰 [PERF] Assinatura profissional ATIVADA para {app_user_id} até {expira}")
+        elif encerramento:
+            mongo_db["profissionais"].update_one(
+                {"user_id": app_user_id},
+                {"$set": {"plano_ativo": False, "updated_at": agora_iso}},
+                session=session,
+            )
+            logger.info(f"🚫 [PERF] Assinatura profissional CANCELADA/EXPIRADA para {app_user_id}")
+        return
+
+    # ── Assinatura de USUÁRIO COMUM (plus / pro) ──
+    if not ObjectId.is_valid(app_user_id):
+        return
+    novo_plano = "pro" if "pro" in product_id else "plus"
+    if ativacao:
+        mongo_db["usuarios"].update_one(
+            {"_id": ObjectId(app_user_id)},
+            {"$set": {
+                "plano": novo_plano,
+                "status_assinatura": "ativo",
+                "data_vencimento": (datetime.now() + timedelta(days=32)).isoformat(),
+                "updated_at": agora_iso,
+            }},
+            session=session,
+        )
+        logger.info(f"💰 Assinatura {novo_plano} ATIVADA para o usuário {app_user_id}")
+    elif encerramento:
+        mongo_db["usuarios"].update_one(
+            {"_id": ObjectId(app_user_id)},
+            {"$set": {"plano": "free", "status_assinatura": "expirado", "updated_at": agora_iso}},
+            session=session,
+        )
+        logger.info(f"🚫 Assinatura FINALIZADA para o usuário {app_user_id}")
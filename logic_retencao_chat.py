@@ -0,0 +1,122 @@
+"""
+Retenção dos chats (clã, grupo de desafio e privado profissional↔aluno).
+
+Regras por canal: no máximo N mensagens mais recentes E nada com mais de
+CHAT_RETENCAO_DIAS. Mensagens novas recebem 'expira_em' (Date) e o índice TTL
+cuida dos 30 dias sozinho; o job só trata o excedente por canal e os
+documentos legados sem 'expira_em'.
+
+Relatório sem apagar nada:
+    source venv/bin/activate && python3 logic_retencao_chat.py --dry-run
+"""
+
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+
+from data_manager import mongo_db
+
+logger = logging.getLogger("AURA_RETENCAO_CHAT")
+
+# Limites por canal (configuráveis por ambiente)
+CHAT_LIMITE_GRUPO   = int(os.getenv("CHAT_LIMITE_GRUPO", 300))
+CHAT_LIMITE_PRIVADO = int(os.getenv("CHAT_LIMITE_PRIVADO", 100))
+CHAT_LIMITE_CLA     = int(os.getenv("CHAT_LIMITE_CLA", 300))
+CHAT_RETENCAO_DIAS  = int(os.getenv("CHAT_RETENCAO_DIAS", 30))
+
+LOTE_DELETE = 1000
+
+
+def expiracao_mensagem_chat() -> datetime:
+    """Valor de 'expira_em' para mensagens novas (lido pelo índice TTL)."""
+    return datetime.utcnow() + timedelta(days=CHAT_RETENCAO_DIAS)
+
+
+# ──────────────────────────────────────────────────────────────
+# Excedente por canal: uma agregação com $setWindowFields/$rank
+# ──────────────────────────────────────────────────────────────
+
+def _pipeline_excedente(colecao: str) -> List[Dict[str, Any]]:
+    if colecao == "chat_cla":
+        particao = "$cla_id"
+        limite = CHAT_LIMITE_CLA
+    else:
+        # Legados sem 'canal' (tipo_mensagem="broadcast") contam como grupo
+        particao = {
+            "desafio_id": "$desafio_id",
+            "canal": {"$ifNull": ["$canal", "grupo"]},
+            "dupla_id": "$dupla_id",
+        }
+        limite = {"$cond": [{"$eq": ["$canal", "privado"]}, CHAT_LIMITE_PRIVADO, CHAT_LIMITE_GRUPO]}
+
+    return [
+        {"$project": {"_id": 1, "cla_id": 1, "desafio_id": 1, "canal": 1, "dupla_id": 1}},
+        {"$setWindowFields": {
+            "partitionBy": particao,
+            "sortBy": {"_id": -1},  # _id cresce com o tempo: rank 1 = mais recente
+            "output": {"posicao": {"$rank": {}}},
+        }},
+        {"$match": {"$expr": {"$gt": ["$posicao", limite]}}},
+        {"$project": {"_id": 1, "canal_chave": particao}},
+    ]
+
+
+def _apagar_em_lotes(colecao: str, ids: list) -> int:
+    total = 0
+    for i in range(0, len(ids), LOTE_DELETE):
+        total += mongo_db[colecao].delete_many({"_id": {"$in": ids[i:i + LOTE_DELETE]}}).deleted_count
+    return total
+
+
+def _legados_expirados(colecao: str) -> dict:
+    """Documentos antigos sem 'expira_em' (o TTL não os enxerga): critério pela data ISO."""
+    campo_data = "created_at" if colecao == "chat_cla" else "enviada_em"
+    limite = (datetime.now() - timedelta(days=CHAT_RETENCAO_DIAS)).isoformat()
+    return {"expira_em": {"$exists": False}, campo_data: {"$lt": limite}}
+
+
+def executar_retencao_chat(dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Aplica a retenção em chat_desafios e chat_cla.
+    Retorna por coleção: {"expiradas", "excedentes", "canais_afetados"}.
+    Em dry_run, só conta o que seria apagado.
+    """
+    relatorio = {}
+    if mongo_db is None:
+        return relatorio
+
+    for colecao in ("chat_desafios", "chat_cla"):
+        try:
+            filtro_legado = _legados_expirados(colecao)
+            if dry_run:
+                expiradas = mongo_db[colecao].count_documents(filtro_legado)
+            else:
+                expiradas = mongo_db[colecao].delete_many(filtro_legado).deleted_count
+
+            excedentes = list(mongo_db[colecao].aggregate(_pipeline_excedente(colecao), allowDiskUse=True))
+            canais = {str(d["canal_chave"]) for d in excedentes}
+            ids = [d["_id"] for d in excedentes]
+            apagadas = len(ids) if dry_run else _apagar_em_lotes(colecao, ids)
+
+            relatorio[colecao] = {
+                "expiradas": expiradas,
+                "excedentes": apagadas,
+                "canais_afetados": len(canais),
+            }
+            logger.info(f"💬 [RETENÇÃO{' DRY-RUN' if dry_run else ''}] {colecao}: {relatorio[colecao]}")
+        except Exception as e:
+            logger.error(f"❌ Erro na retenção de {colecao}: {e}")
+            relatorio[colecao] = {"expiradas": 0, "excedentes": 0, "canais_afetados": 0}
+
+    return relatorio
+
+
+if __name__ == "__main__":
+    if mongo_db is None:
+        print("❌ MongoDB inacessível. Verifique MONGODB_URI no .env")
+        sys.exit(1)
+    simular = "--dry-run" in sys.argv
+    for nome, dados in executar_retencao_chat(dry_run=simular).items():
+        print(f"{'🔎' if simular else '🧹'} {nome}: {dados}")
@@ -1,13 +1,30 @@
 import time
-import requests
+import calendar
 import logging
 import os
-from datetime import datetime
+import json
+import zlib
+import threading
+import concurrent.futures
+from datetime import datetime, timedelta
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 
 # Importações da Nova Arquitetura
 # [AURA FIX] data_manager centraliza a conexão com o MongoDB Atlas do Render
 from data_manager import mongo_db
-from logic_gamificacao import aplicar_xp
+from logic_gamificacao import aplicar_xp, estornar_xp
+from schema import obter_schema_atividade_strava
+from logic_strava_api import strava_get, strava_oauth_token, PRIORIDADE_BACKFILL
+
+# zstd é opcional: sem o pacote, o arquivo bruto usa zlib (maior, mas funcional)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Configuração de Logs
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +40,26 @@ XP_POR_METRO_ELEVACAO = 2
 XP_BONUS_FLASH = 30
 VELOCIDADE_FLASH_MS = 2.78  # ~10km/h
 
+# =========================================================
+# 🔑 RENOVAÇÃO DE TOKEN (SINGLE-FLIGHT ENTRE WORKERS)
+# =========================================================
+TOKEN_ANTECEDENCIA_S = 300        # renova se faltar menos que isso para expirar
+TOKEN_ANTECEDENCIA_PROATIVA_S = 1800
+LEASE_REFRESH_TTL_S = 30          # tempo máximo que um worker segura o refresh
+ESPERA_REFRESH_MAX_S = 10         # quanto um waiter espera pelo token novo
+DIAS_ATLETA_ATIVO = 14
+
+_locks_atleta: dict = {}
+_locks_atleta_guard = threading.Lock()
+
+# =========================================================
+# 📚 BACKFILL HISTÓRICO
+# =========================================================
+BACKFILL_POR_PAGINA = 100
+BACKFILL_PAUSA_ENTRE_PAGINAS_S = 2   # respiro para não competir com webhooks
+BACKFILL_LEASE_MIN = 10              # execução "travada" por até 10 min sem progresso
+BACKFILL_PAGINAS_POR_EXECUCAO = 50
+
 # =========================================================
 # 🧠 CÉREBRO DA INTEGRAÇÃO STRAVA (SAAS / HYBRID)
 # =========================================================
@@ -32,51 +69,90 @@ def processar_evento_webhook(dados_evento: dict) -> bool:
     Orquestrador de treinos. Valida, calcula XP e atualiza o Jogador.
     Sincroniza os dados entre Strava API -> MongoDB Atlas -> Frontend (Base44).
     Agora envia contexto para a geração de treinos de 10 exercícios.
+
+    [AURA ROBUST] Idempotente: cada evento reserva uma chave única no 'ledger_xp'
+    antes de qualquer trabalho. create credita, update ajusta pela diferença,
+    delete estorna — um replay completo do webhook não altera saldos.
     """
     logger.info(f"🔄 Processando evento Strava ID: {dados_evento.get('object_id')}")
 
     # 1. FILTRO DE SEGURANÇA
-    if dados_evento.get('object_type') != 'activity' or dados_evento.get('aspect_type') != 'create':
+    aspecto = dados_evento.get('aspect_type')
+    if dados_evento.get('object_type') != 'activity' or aspecto not in ('create', 'update', 'delete'):
         return False
 
     strava_id_atleta = str(dados_evento.get('owner_id'))
-    atividade_id = str(dados_evento.get('object_id'))
+    atividade_id = int(dados_evento.get('object_id'))
 
     # [AURA FIX] Comparação explícita com None exigida pelo PyMongo
     if mongo_db is None:
         logger.error("❌ Erro: Banco de dados offline.")
         return False
 
-    # 2. PROTEÇÃO CONTRA DUPLICIDADE (Idempotência)
-    if mongo_db["atividades_strava"].find_one({"id": int(atividade_id)}):
-        logger.warning(f"⚠️ Atividade {atividade_id} já processada.")
+    if aspecto == 'delete':
+        return _estornar_atividade(atividade_id)
+
+    # 2. PROTEÇÃO CONTRA DUPLICIDADE (insert-or-ignore no ledger)
+    if aspecto == 'create':
+        chave = f"strava:{atividade_id}:credito"
+    else:
+        chave = f"strava:{atividade_id}:ajuste:{dados_evento.get('event_time')}"
+
+    if not _reservar_evento_ledger(chave, atividade_id, aspecto):
+        logger.warning(f"⚠️ Evento {chave} já processado.")
         return True
 
+    try:
+        processado = _processar_atividade(dados_evento, strava_id_atleta, atividade_id, aspecto, chave)
+    except Exception as e:
+        logger.error(f"❌ Erro ao finalizar persistência: {e}")
+        processado = False
+
+    if not processado:
+        # Libera a chave para o Strava (ou o replay) tentar de novo
+        _liberar_evento_ledger(chave)
+    return processado
+
+
+def _processar_atividade(dados_evento: dict, strava_id_atleta: str, atividade_id: int,
+                         aspecto: str, chave: str) -> bool:
     # 3. IDENTIFICAR JOGADOR (Sincronização Coleção 'usuarios')
     usuario = mongo_db["usuarios"].find_one({"integracoes.strava.atleta_id": strava_id_atleta})
-    
+
     if not usuario:
         logger.warning(f"⚠️ Atleta Strava {strava_id_atleta} não vinculado.")
         return False
 
     user_id = str(usuario["_id"])
 
+    # Marca o atleta como ativo para a renovação proativa de token
+    try:
+        mongo_db["usuarios"].update_one(
+            {"_id": usuario["_id"]},
+            {"$set": {"integracoes.strava.ultimo_evento_em": datetime.now().isoformat()}}
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Falha ao marcar atividade do atleta {strava_id_atleta}: {e}")
+
     # 4. RENOVAÇÃO DE TOKEN (Segurança OAuth2)
     access_token = obter_token_valido(usuario)
-    if not access_token: 
+    if not access_token:
         logger.error(f"❌ Falha ao obter token válido para {user_id}")
         return False
 
     # 5. BUSCA DETALHES NA API DO STRAVA
+    # [AURA PERF] Cliente compartilhado: keep-alive, cota global entre workers e backoff em 429
     try:
-        url = f"https://www.strava.com/api/v3/activities/{atividade_id}"
-        headers = {'Authorization': f"Bearer {access_token}"}
-        response = requests.get(url, headers=headers, timeout=10)
-        
+        response = strava_get(f"/activities/{atividade_id}", access_token)
+
+        if response is None:
+            logger.error(f"❌ Strava indisponível ou cota esgotada para atividade {atividade_id}")
+            return False
+
         if response.status_code != 200:
             logger.error(f"❌ Erro Strava API ({response.status_code})")
             return False
-            
+
         dados_treino = response.json()
     except Exception as e:
         logger.error(f"❌ Falha na conexão Strava: {e}")
@@ -85,68 +161,462 @@ def processar_evento_webhook(dados_evento: dict) -> bool:
     # 6. CÁLCULO DE RECOMPENSAS (XP e Contexto Híbrido)
     xp_ganho, lista_bonus = calcular_xp_avancado(dados_treino)
 
+    # create/update/delete da mesma atividade usam chaves diferentes no ledger:
+    # o lease serializa o cálculo do delta para ninguém somar sobre um total velho
+    dono_lease = _adquirir_lease_atividade(atividade_id)
+    if not dono_lease:
+        logger.warning(f"⚠️ Atividade {atividade_id} em processamento por outro evento; nova tentativa depois.")
+        return False
+    try:
+        return _creditar_atividade(dados_treino, user_id, atividade_id, aspecto, chave, xp_ganho, lista_bonus)
+    finally:
+        _liberar_lease_atividade(atividade_id, dono_lease)
+
+
+def _creditar_atividade(dados_treino: dict, user_id: str, atividade_id: int, aspecto: str,
+                        chave: str, xp_ganho: int, lista_bonus: list) -> bool:
+    # Delta contra o que já foi creditado: cobre update, replay e update-antes-do-create
+    _, ja_creditado = _xp_creditado_atividade(atividade_id)
+    existente = mongo_db["atividades_strava"].find_one(
+        {"id": atividade_id}, {"aura_analysis.xp_creditado": 1, "aura_analysis.xp_ganho": 1}
+    )
+    # Edição de atividade histórica (backfill) não gera XP
+    creditar = not (aspecto == 'update' and existente and ja_creditado == 0
+                    and not existente.get("aura_analysis", {}).get("xp_creditado", True))
+    delta = (xp_ganho - ja_creditado) if creditar else 0
+
     # 7. PERSISTÊNCIA E ATUALIZAÇÃO DO JOGADOR
+    # O ledger vira "aplicado" ANTES do saldo: se cair entre as duas escritas, o
+    # crédito se perde (corrigível) em vez de ser pago de novo no replay.
+    if not _marcar_ledger_aplicado(chave, delta, user_id):
+        logger.warning(f"⚠️ Evento {chave} já aplicado por outro processo.")
+        return True
+
+    # [AURA FIX] Aplicar Economia Unificada: Moedas (1:1) e Cristais (10:1)
+    resultado_economia = {}
+    if delta > 0:
+        resultado_economia = aplicar_xp(user_id, delta, origem="strava")
+    elif delta < 0:
+        resultado_economia = estornar_xp(user_id, -delta)
+    if "erro" in resultado_economia:
+        # Saldo comprovadamente não gravado: devolve o evento para nova tentativa
+        _reverter_ledger_aplicado(chave)
+        return False
+
+    # [AURA PERF] Documento compacto (só os campos consumidos) + payload bruto arquivado
+    atividade = obter_schema_atividade_strava(dados_treino, user_id)
+    atividade["aura_analysis"] = {
+        "xp_ganho": xp_ganho if creditar else (existente or {}).get("aura_analysis", {}).get("xp_ganho", xp_ganho),
+        "tipo_esporte": dados_treino.get("type"),
+        "distancia_km": round(dados_treino.get("distance", 0) / 1000, 2),
+        "moedas_ganhas": resultado_economia.get("moedas_ganhas", 0),
+        "cristais_ganhos": resultado_economia.get("cristais_ganhos", 0),
+        "bonus_detectados": lista_bonus,
+        "xp_creditado": creditar,
+        "processed_at": datetime.now().isoformat()
+    }
+    if not creditar:
+        atividade["aura_analysis"]["origem"] = "backfill"
+
+    # Inserção na coleção de atividades para o sensores.py consultar
+    # (upsert: pode substituir o registro do backfill ou a versão anterior ao update)
+    mongo_db["atividades_strava"].replace_one({"id": atividade_id}, atividade, upsert=True)
+    arquivar_payload_bruto(dados_treino, user_id)
+
+    # Log de Sucesso Robusto
+    logger.info(f"✅ Treino {dados_treino.get('type')} Processado ({aspecto}): {user_id} | {delta:+d} XP/Moedas")
+
+    return True
+
+
+# =========================================================
+# 📒 LEDGER DE XP (IDEMPOTÊNCIA DOS EVENTOS STRAVA)
+# =========================================================
+LEDGER_PENDENTE_EXPIRA_MIN = 10   # reserva órfã (worker morreu) pode ser retomada
+LEASE_ATIVIDADE_TTL_S = 60         # só cobre leituras/escritas no MongoDB, sem chamadas ao Strava
+
+
+def _adquirir_lease_atividade(atividade_id: int):
+    """Lease por atividade em 'strava_atividade_leases' (mesmo padrão do refresh de token). Retorna o dono ou None."""
+    agora = datetime.utcnow()
+    dono = f"{os.getpid()}:{threading.get_ident()}"
     try:
-        # [AURA FIX] Aplicar Economia Unificada: Moedas (1:1) e Cristais (10:1)
-        resultado_economia = aplicar_xp(user_id, xp_ganho)
-        
-        # [AURA ROBUST] Salvar no Histórico com metadados para a IA ler posteriormente
-        dados_treino["user_id"] = user_id
-        dados_treino["aura_analysis"] = {
-            "xp_ganho": xp_ganho,
-            "tipo_esporte": dados_treino.get("type"),
-            "distancia_km": round(dados_treino.get("distance", 0) / 1000, 2),
-            "moedas_ganhas": resultado_economia.get("moedas_ganhas", 0),
-            "cristais_ganhos": resultado_economia.get("cristais_ganhos", 0),
-            "bonus_detectados": lista_bonus,
-            "processed_at": datetime.now().isoformat()
-        }
-        
-        # Inserção na coleção de atividades para o data_sensores.py consultar
-        mongo_db["atividades_strava"].insert_one(dados_treino)
-        
-        # Log de Sucesso Robusto
-        logger.info(f"✅ Treino {dados_treino.get('type')} Processado: {user_id} | +{xp_ganho} XP/Moedas")
-        
+        mongo_db["strava_atividade_leases"].delete_one({"_id": atividade_id, "expire_at": {"$lt": agora}})
+        mongo_db["strava_atividade_leases"].insert_one({
+            "_id": atividade_id,
+            "expire_at": agora + timedelta(seconds=LEASE_ATIVIDADE_TTL_S),
+            "dono": dono
+        })
+        return dono
+    except DuplicateKeyError:
+        return None
+
+
+def _liberar_lease_atividade(atividade_id: int, dono: str):
+    try:
+        mongo_db["strava_atividade_leases"].delete_one({"_id": atividade_id, "dono": dono})
+    except Exception:
+        pass
+
+
+def _reservar_evento_ledger(chave: str, atividade_id: int, tipo: str) -> bool:
+    """insert-or-ignore: True se esta chamada é dona do evento."""
+    agora = datetime.now()
+    try:
+        mongo_db["ledger_xp"].insert_one({
+            "_id": chave,
+            "origem": "strava",
+            "atividade_id": atividade_id,
+            "tipo": tipo,
+            "estado": "pendente",
+            "xp": 0,
+            "criado_em": agora.isoformat()
+        })
         return True
+    except DuplicateKeyError:
+        expirado = (agora - timedelta(minutes=LEDGER_PENDENTE_EXPIRA_MIN)).isoformat()
+        retomado = mongo_db["ledger_xp"].update_one(
+            {"_id": chave, "estado": "pendente", "criado_em": {"$lt": expirado}},
+            {"$set": {"criado_em": agora.isoformat()}}
+        )
+        return retomado.modified_count == 1
 
+
+def _marcar_ledger_aplicado(chave: str, xp: int, user_id) -> bool:
+    """pendente → aplicado. False se outra execução já aplicou este evento."""
+    marcado = mongo_db["ledger_xp"].update_one(
+        {"_id": chave, "estado": "pendente"},
+        {"$set": {"estado": "aplicado", "xp": xp, "user_id": user_id,
+                  "aplicado_em": datetime.now().isoformat()}}
+    )
+    return marcado.modified_count == 1
+
+
+def _reverter_ledger_aplicado(chave: str):
+    """Desfaz a marcação quando o saldo não foi gravado (a chave volta a ficar livre)."""
+    try:
+        mongo_db["ledger_xp"].delete_one({"_id": chave, "estado": "aplicado"})
     except Exception as e:
-        logger.error(f"❌ Erro ao finalizar persistência: {e}")
+        logger.error(f"❌ Falha ao reverter ledger {chave}: {e}")
+
+
+def _liberar_evento_ledger(chave: str):
+    try:
+        mongo_db["ledger_xp"].delete_one({"_id": chave, "estado": "pendente"})
+    except Exception:
+        pass
+
+
+def _xp_creditado_atividade(atividade_id: int) -> tuple:
+    """Soma do XP efetivamente aplicado para a atividade -> (user_id, total)."""
+    resultado = list(mongo_db["ledger_xp"].aggregate([
+        {"$match": {"atividade_id": atividade_id, "estado": "aplicado"}},
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$xp"}}}
+    ]))
+    if not resultado:
+        return _registrar_credito_legado(atividade_id)
+    return resultado[0]["_id"], int(resultado[0]["total"])
+
+
+def _documento_credito_legado(atividade: dict) -> dict:
+    """Entrada 'aplicado' para atividade creditada antes do ledger (None se não há o que registrar)."""
+    analise = atividade.get("aura_analysis") or {}
+    # Sem 'xp_creditado' = processada pelo webhook antigo, que sempre creditava
+    if "xp_creditado" in analise or not analise.get("xp_ganho"):
+        return None
+    return {
+        "_id": f"strava:{atividade['id']}:legado",
+        "origem": "strava",
+        "atividade_id": atividade["id"],
+        "tipo": "legado",
+        "estado": "aplicado",
+        "xp": int(analise["xp_ganho"]),
+        "user_id": atividade.get("user_id"),
+        "aplicado_em": analise.get("processed_at") or datetime.now().isoformat(),
+    }
+
+
+def _registrar_credito_legado(atividade_id: int) -> tuple:
+    """
+    Atividade sem linhas no ledger: se veio do webhook antigo, o XP já foi pago.
+    Grava o crédito legado (mesma chave da migração) para update/replay/delete
+    calcularem o delta contra ele -> (user_id, total).
+    """
+    atividade = mongo_db["atividades_strava"].find_one(
+        {"id": atividade_id}, {"id": 1, "user_id": 1, "aura_analysis": 1}
+    )
+    credito = _documento_credito_legado(atividade) if atividade else None
+    if not credito:
+        return None, 0
+    try:
+        mongo_db["ledger_xp"].insert_one(credito)
+    except DuplicateKeyError:
+        pass
+    return credito["user_id"], credito["xp"]
+
+
+def _estornar_atividade(atividade_id: int) -> bool:
+    """Evento delete: estorna o XP líquido creditado e remove a atividade."""
+    chave = f"strava:{atividade_id}:estorno"
+    if not _reservar_evento_ledger(chave, atividade_id, "delete"):
+        logger.warning(f"⚠️ Evento {chave} já processado.")
+        return True
+
+    dono_lease = _adquirir_lease_atividade(atividade_id)
+    if not dono_lease:
+        logger.warning(f"⚠️ Atividade {atividade_id} em processamento por outro evento; nova tentativa depois.")
+        _liberar_evento_ledger(chave)
+        return False
+
+    try:
+        user_id, creditado = _xp_creditado_atividade(atividade_id)
+        # Mesma ordem do crédito: ledger primeiro, saldo depois
+        if not _marcar_ledger_aplicado(chave, -creditado, user_id):
+            logger.warning(f"⚠️ Evento {chave} já aplicado por outro processo.")
+            return True
+        if user_id and creditado > 0:
+            if "erro" in estornar_xp(user_id, creditado):
+                _reverter_ledger_aplicado(chave)
+                return False
+
+        mongo_db["atividades_strava"].delete_one({"id": atividade_id})
+        mongo_db["atividades_strava_raw"].delete_one({"_id": atividade_id})
+
+        logger.info(f"🗑️ Atividade {atividade_id} removida | -{creditado} XP")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Erro ao estornar atividade {atividade_id}: {e}")
+        _liberar_evento_ledger(chave)
         return False
+    finally:
+        _liberar_lease_atividade(atividade_id, dono_lease)
+
+
+# =========================================================
+# 📥 FILA DE EVENTOS DO WEBHOOK (ACK IMEDIATO)
+# =========================================================
+# O Strava espera resposta em ~2s; a cota compartilhada e os retries do
+# cliente podem levar dezenas de segundos. A rota só grava o evento em
+# 'eventos_strava' e responde; o processamento roda no pool abaixo e o
+# scheduler retoma falhas e eventos órfãos (worker reiniciado).
+COLECAO_EVENTOS_STRAVA = "eventos_strava"
+EVENTOS_STRAVA_MAX_TENTATIVAS = 6
+EVENTOS_STRAVA_LEASE_S = 300      # maior que o pior caso de um processamento
+EVENTOS_STRAVA_RETENCAO_DIAS = 7
+
+_executor_webhook = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="strava-webhook")
+
+
+def enfileirar_evento_webhook(dados_evento: dict) -> bool:
+    """Grava o evento e agenda o processamento. False se ignorado ou repetido."""
+    if mongo_db is None:
+        raise RuntimeError("Banco de dados offline")
+    if (dados_evento.get('object_type') != 'activity'
+            or dados_evento.get('aspect_type') not in ('create', 'update', 'delete')):
+        return False
+
+    chave = f"{dados_evento.get('object_id')}:{dados_evento.get('aspect_type')}:{dados_evento.get('event_time')}"
+    try:
+        mongo_db[COLECAO_EVENTOS_STRAVA].insert_one({
+            "_id": chave,
+            "payload": dados_evento,
+            "status": "pendente",
+            "tentativas": 0,
+            "recebido_em": datetime.now().isoformat(),
+            "lease_ate": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        return False
+
+    _executor_webhook.submit(processar_evento_fila, chave)
+    return True
+
+
+def processar_evento_fila(chave: str = None) -> bool:
+    """Processa um evento da fila (ou o próximo disponível). True se algum foi tentado."""
+    if mongo_db is None:
+        return False
+    agora = datetime.utcnow()
+    filtro = {
+        "status": {"$in": ["pendente", "erro", "processando"]},
+        "tentativas": {"$lt": EVENTOS_STRAVA_MAX_TENTATIVAS},
+        "lease_ate": {"$lte": agora},
+    }
+    if chave:
+        filtro["_id"] = chave
+    evento = mongo_db[COLECAO_EVENTOS_STRAVA].find_one_and_update(
+        filtro,
+        {"$set": {"status": "processando", "lease_ate": agora + timedelta(seconds=EVENTOS_STRAVA_LEASE_S)},
+         "$inc": {"tentativas": 1}},
+        sort=[("recebido_em", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    if not evento:
+        return False
+
+    try:
+        processado = processar_evento_webhook(evento["payload"])
+    except Exception as e:
+        logger.error(f"❌ Falha no processamento do evento Strava {evento['_id']}: {e}")
+        processado = False
+
+    if processado:
+        atualizacao = {"status": "processado",
+                       "expira_em": datetime.utcnow() + timedelta(days=EVENTOS_STRAVA_RETENCAO_DIAS)}
+    else:
+        # Backoff: cada tentativa espera mais um minuto
+        atualizacao = {"status": "erro",
+                       "lease_ate": datetime.utcnow() + timedelta(minutes=evento["tentativas"])}
+    mongo_db[COLECAO_EVENTOS_STRAVA].update_one({"_id": evento["_id"]}, {"$set": atualizacao})
+    return True
+
+
+def processar_eventos_strava_pendentes(limite: int = 20) -> int:
+    """Drena a fila (scheduler). Retorna quantos eventos foram tentados."""
+    total = 0
+    while total < limite and processar_evento_fila():
+        total += 1
+    return total
+
+
+def _lock_atleta(atleta_id: str) -> threading.Lock:
+    with _locks_atleta_guard:
+        if atleta_id not in _locks_atleta:
+            _locks_atleta[atleta_id] = threading.Lock()
+        return _locks_atleta[atleta_id]
+
 
-def obter_token_valido(usuario: dict) -> str:
-    """Renova o access_token caso esteja expirado."""
+def _token_ainda_valido(tokens: dict, antecedencia: int) -> bool:
+    return (tokens.get('expires_at') or 0) > (time.time() + antecedencia)
+
+
+def _ler_tokens(usuario_oid) -> dict:
+    doc = mongo_db["usuarios"].find_one({"_id": usuario_oid}, {"integracoes.strava.tokens": 1})
+    return ((doc or {}).get('integracoes', {}).get('strava', {}).get('tokens')) or {}
+
+
+def _adquirir_lease_refresh(atleta_id: str) -> bool:
+    """Lease por atleta na coleção 'strava_token_leases' (mesmo padrão dos locks do scheduler)."""
+    agora = datetime.utcnow()
+    try:
+        mongo_db["strava_token_leases"].delete_one({"_id": atleta_id, "expire_at": {"$lt": agora}})
+        mongo_db["strava_token_leases"].insert_one({
+            "_id": atleta_id,
+            "expire_at": agora + timedelta(seconds=LEASE_REFRESH_TTL_S),
+            "pid": os.getpid()
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def _liberar_lease_refresh(atleta_id: str):
+    try:
+        mongo_db["strava_token_leases"].delete_one({"_id": atleta_id, "pid": os.getpid()})
+    except Exception:
+        pass
+
+
+def _aguardar_token_renovado(usuario_oid, refresh_antigo: str, antecedencia: int) -> str:
+    """Outro worker está renovando: espera ele gravar o token novo e reaproveita."""
+    limite = time.time() + ESPERA_REFRESH_MAX_S
+    tokens = {}
+    while time.time() < limite:
+        time.sleep(0.5)
+        tokens = _ler_tokens(usuario_oid)
+        if tokens.get('refresh_token') != refresh_antigo or _token_ainda_valido(tokens, antecedencia):
+            return tokens.get('access_token')
+    # Timeout: o token atual ainda serve se não expirou de fato
+    if _token_ainda_valido(tokens, 0):
+        return tokens.get('access_token')
+    logger.error("❌ Timeout aguardando renovação de token Strava por outro worker.")
+    return None
+
+
+def _renovar_token(usuario_oid, tokens: dict) -> str:
+    payload = {
+        'client_id': os.getenv('STRAVA_CLIENT_ID'),
+        'client_secret': os.getenv('STRAVA_CLIENT_SECRET'),
+        'grant_type': 'refresh_token',
+        'refresh_token': tokens.get('refresh_token')
+    }
+    res = strava_oauth_token(payload)
+
+    if res is None or res.status_code != 200:
+        logger.error(f"❌ Refresh de token Strava recusado ({getattr(res, 'status_code', 'sem resposta')})")
+        return None
+
+    novos = res.json()
+    # Compare-and-set: só grava se ninguém trocou o refresh_token nesse meio-tempo
+    resultado = mongo_db["usuarios"].update_one(
+        {"_id": usuario_oid, "integracoes.strava.tokens.refresh_token": tokens.get('refresh_token')},
+        {"$set": {
+            "integracoes.strava.tokens.access_token": novos.get('access_token'),
+            "integracoes.strava.tokens.refresh_token": novos.get('refresh_token'),
+            "integracoes.strava.tokens.expires_at": novos.get('expires_at'),
+            "updated_at": datetime.now().isoformat()
+        }}
+    )
+    if resultado.matched_count == 0:
+        logger.warning("⚠️ Tokens Strava já atualizados por outro processo; mantendo os gravados.")
+    return novos.get('access_token')
+
+
+def obter_token_valido(usuario: dict, antecedencia: int = TOKEN_ANTECEDENCIA_S) -> str:
+    """
+    Renova o access_token caso esteja expirado.
+    Single-flight: lock por atleta no processo + lease no MongoDB entre workers;
+    quem não ganha o lease espera e reaproveita o token renovado.
+    """
     integracao = usuario.get('integracoes', {}).get('strava', {})
     tokens = integracao.get('tokens', {})
-    
-    if tokens.get('expires_at', 0) > (time.time() + 300):
+
+    if _token_ainda_valido(tokens, antecedencia):
         return tokens.get('access_token')
-        
+
+    if mongo_db is None:
+        return None
+
+    atleta_id = str(integracao.get('atleta_id') or usuario["_id"])
+
     try:
-        payload = {
-            'client_id': os.getenv('STRAVA_CLIENT_ID'),
-            'client_secret': os.getenv('STRAVA_CLIENT_SECRET'),
-            'grant_type': 'refresh_token',
-            'refresh_token': tokens.get('refresh_token')
-        }
-        res = requests.post("https://www.strava.com/oauth/token", data=payload, timeout=10)
-        
-        if res.status_code == 200:
-            novos = res.json()
-            mongo_db["usuarios"].update_one(
-                {"_id": usuario["_id"]},
-                {"$set": {
-                    "integracoes.strava.tokens.access_token": novos.get('access_token'),
-                    "integracoes.strava.tokens.refresh_token": novos.get('refresh_token'),
-                    "integracoes.strava.tokens.expires_at": novos.get('expires_at'),
-                    "updated_at": datetime.now().isoformat()
-                }}
-            )
-            return novos.get('access_token')
+        with _lock_atleta(atleta_id):
+            # Outra thread deste worker pode ter acabado de renovar
+            tokens = _ler_tokens(usuario["_id"])
+            if _token_ainda_valido(tokens, antecedencia):
+                return tokens.get('access_token')
+
+            if not _adquirir_lease_refresh(atleta_id):
+                return _aguardar_token_renovado(usuario["_id"], tokens.get('refresh_token'), antecedencia)
+
+            try:
+                return _renovar_token(usuario["_id"], tokens)
+            finally:
+                _liberar_lease_refresh(atleta_id)
     except Exception as e:
         logger.error(f"❌ Falha crítica OAuth: {e}")
     return None
 
+
+def renovar_tokens_atletas_ativos() -> int:
+    """
+    Renovação proativa: atletas com evento recente cujo token expira em breve.
+    Tira o refresh do caminho crítico dos webhooks. Retorna quantos foram renovados.
+    """
+    if mongo_db is None:
+        return 0
+
+    desde = (datetime.now() - timedelta(days=DIAS_ATLETA_ATIVO)).isoformat()
+    filtro = {
+        "integracoes.strava.ultimo_evento_em": {"$gte": desde},
+        "integracoes.strava.tokens.expires_at": {"$lt": time.time() + TOKEN_ANTECEDENCIA_PROATIVA_S},
+    }
+    count = 0
+    for usuario in mongo_db["usuarios"].find(filtro, {"integracoes.strava": 1}):
+        if obter_token_valido(usuario, antecedencia=TOKEN_ANTECEDENCIA_PROATIVA_S):
+            count += 1
+    return count
+
 def calcular_xp_avancado(treino: dict) -> tuple:
     """Calcula XP e identifica bônus para a narrativa da IA."""
     xp = 0
@@ -189,4 +659,267 @@ def calcular_xp_avancado(treino: dict) -> tuple:
         xp += 40
         motivos.append("🔥 Superação (Suffer Score)")
 
-    return xp, motivos
\ No newline at end of file
+    return xp, motivos
+
+# =========================================================
+# 🗄️ ARQUIVO DO PAYLOAD BRUTO (COMPRIMIDO, SOB DEMANDA)
+# =========================================================
+
+def _comprimir(dados: bytes) -> tuple:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(dados)
+    return "zlib", zlib.compress(dados, 6)
+
+
+def _descomprimir(codec: str, dados: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Payload em zstd, mas o pacote 'zstandard' não está instalado.")
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return zlib.decompress(dados)
+
+
+def _documento_bruto(treino: dict, user_id: str) -> dict:
+    original = json.dumps(treino, default=str, separators=(",", ":")).encode("utf-8")
+    codec, comprimido = _comprimir(original)
+    return {
+        "_id": int(treino.get("id") or 0),
+        "user_id": user_id,
+        "codec": codec,
+        "payload": Binary(comprimido),
+        "tamanho_original": len(original),
+        "arquivado_em": datetime.now().isoformat()
+    }
+
+
+def arquivar_payload_bruto(treino: dict, user_id: str) -> bool:
+    """Guarda o JSON completo do Strava em 'atividades_strava_raw' (substitui versão anterior)."""
+    if mongo_db is None:
+        return False
+    try:
+        doc = _documento_bruto(treino, user_id)
+        mongo_db["atividades_strava_raw"].replace_one({"_id": doc["_id"]}, doc, upsert=True)
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Falha ao arquivar payload bruto da atividade {treino.get('id')}: {e}")
+        return False
+
+
+def carregar_payload_bruto(atividade_id) -> dict:
+    """Carrega o JSON original do Strava (polyline, splits, laps...). None se não arquivado."""
+    if mongo_db is None:
+        return None
+    try:
+        doc = mongo_db["atividades_strava_raw"].find_one({"_id": int(atividade_id)})
+        if not doc:
+            return None
+        return json.loads(_descomprimir(doc.get("codec"), bytes(doc["payload"])))
+    except Exception as e:
+        logger.error(f"❌ Erro ao carregar payload bruto da atividade {atividade_id}: {e}")
+        return None
+
+
+# =========================================================
+# 📚 BACKFILL DO HISTÓRICO STRAVA
+# =========================================================
+
+def _epoch_da_data(data_iso: str) -> int:
+    """'2024-03-10T09:15:00Z' -> epoch (segundos)."""
+    try:
+        return calendar.timegm(time.strptime(data_iso, "%Y-%m-%dT%H:%M:%SZ"))
+    except Exception:
+        return 0
+
+
+def iniciar_backfill_strava(user_id: str) -> bool:
+    """
+    Cria o checkpoint do atleta (se ainda não existir) e dispara a importação
+    em background. Chamado após o vínculo OAuth.
+    """
+    if mongo_db is None:
+        return False
+    try:
+        mongo_db["strava_backfill"].update_one(
+            {"_id": user_id},
+            {"$setOnInsert": {
+                "status": "pendente",
+                "antes_de": int(time.time()),
+                "importadas": 0,
+                "paginas": 0,
+                "executando_ate": None,
+                "criado_em": datetime.now().isoformat()
+            }},
+            upsert=True
+        )
+        threading.Thread(target=executar_backfill_strava, args=(user_id,), daemon=True).start()
+        return True
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar backfill Strava de {user_id}: {e}")
+        return False
+
+
+def _reservar_backfill(user_id: str):
+    """Garante que só uma execução por atleta rode por vez (entre threads e workers)."""
+    agora = datetime.utcnow()
+    return mongo_db["strava_backfill"].find_one_and_update(
+        {
+            "_id": user_id,
+            "status": {"$in": ["pendente", "pausado"]},
+            "$or": [{"executando_ate": None}, {"executando_ate": {"$lt": agora}}],
+        },
+        {"$set": {"executando_ate": agora + timedelta(minutes=BACKFILL_LEASE_MIN), "pid": os.getpid()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _finalizar_execucao_backfill(user_id: str, status: str):
+    mongo_db["strava_backfill"].update_one(
+        {"_id": user_id},
+        {"$set": {"status": status, "executando_ate": None, "atualizado_em": datetime.now().isoformat()}}
+    )
+
+
+def executar_backfill_strava(user_id: str, max_paginas: int = BACKFILL_PAGINAS_POR_EXECUCAO) -> int:
+    """
+    Importa o histórico do atleta página a página (do mais recente para o mais antigo),
+    retomando do checkpoint 'antes_de'. Usa a prioridade de backfill do cliente Strava:
+    se a cota reservada acabar, pausa e o scheduler retoma depois.
+
+    As atividades históricas recebem aura_analysis (XP calculado para a IA e para o
+    histórico), mas o XP NÃO é creditado na conta — xp_creditado=False.
+    Retorna o número de atividades novas inseridas nesta execução.
+    """
+    if mongo_db is None:
+        return 0
+
+    try:
+        checkpoint = _reservar_backfill(user_id)
+    except Exception as e:
+        logger.error(f"❌ Erro ao reservar backfill de {user_id}: {e}")
+        return 0
+    if not checkpoint:
+        return 0
+
+    status_final = "pausado"
+    inseridas_total = 0
+    try:
+        usuario = mongo_db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"integracoes.strava": 1})
+        if not usuario:
+            status_final = "erro"
+            return 0
+
+        antes_de = checkpoint.get("antes_de") or int(time.time())
+
+        for _ in range(max_paginas):
+            access_token = obter_token_valido(usuario)
+            if not access_token:
+                status_final = "erro"
+                break
+
+            resp = strava_get(
+                "/athlete/activities", access_token,
+                params={"before": antes_de, "per_page": BACKFILL_POR_PAGINA},
+                prioridade=PRIORIDADE_BACKFILL
+            )
+            if resp is None:
+                logger.info(f"⏸️ Backfill de {user_id} pausado (cota de backfill esgotada).")
+                break
+            if resp.status_code in (401, 403):
+                logger.warning(f"⚠️ Backfill de {user_id} sem autorização ({resp.status_code}).")
+                status_final = "erro"
+                break
+            if resp.status_code != 200:
+                logger.error(f"❌ Erro Strava API no backfill ({resp.status_code})")
+                break
+
+            pagina = resp.json() or []
+            if not pagina:
+                status_final = "concluido"
+                break
+
+            processado_em = datetime.now().isoformat()
+            docs = []
+            brutos = []
+            for treino in pagina:
+                xp, bonus = calcular_xp_avancado(treino)
+                atividade = obter_schema_atividade_strava(treino, user_id)
+                atividade["aura_analysis"] = {
+                    "xp_ganho": xp,
+                    "tipo_esporte": treino.get("type"),
+                    "distancia_km": round(treino.get("distance", 0) / 1000, 2),
+                    "bonus_detectados": bonus,
+                    "origem": "backfill",
+                    "xp_creditado": False,
+                    "processed_at": processado_em
+                }
+                docs.append(atividade)
+                brutos.append(_documento_bruto(treino, user_id))
+
+            # ordered=False: duplicatas (índice único em 'id') não interrompem o lote
+            try:
+                resultado = mongo_db["atividades_strava"].insert_many(docs, ordered=False)
+                inseridas = len(resultado.inserted_ids)
+            except BulkWriteError as bwe:
+                inseridas = bwe.details.get("nInserted", 0)
+            inseridas_total += inseridas
+            try:
+                mongo_db["atividades_strava_raw"].insert_many(brutos, ordered=False)
+            except BulkWriteError:
+                pass
+
+            menor_data = min((_epoch_da_data(t.get("start_date", "")) for t in pagina), default=0)
+            cursor_avancou = 0 < menor_data < antes_de
+            if cursor_avancou:
+                antes_de = menor_data
+
+            mongo_db["strava_backfill"].update_one(
+                {"_id": user_id},
+                {
+                    "$set": {
+                        "antes_de": antes_de,
+                        "executando_ate": datetime.utcnow() + timedelta(minutes=BACKFILL_LEASE_MIN),
+                        "atualizado_em": processado_em
+                    },
+                    "$inc": {"importadas": inseridas, "paginas": 1}
+                }
+            )
+
+            if not cursor_avancou:
+                status_final = "concluido"
+                break
+
+            if len(pagina) < BACKFILL_POR_PAGINA:
+                status_final = "concluido"
+                break
+
+            time.sleep(BACKFILL_PAUSA_ENTRE_PAGINAS_S)
+
+        logger.info(f"📚 Backfill Strava {user_id}: +{inseridas_total} atividades ({status_final}).")
+        return inseridas_total
+    except Exception as e:
+        logger.error(f"❌ Erro no backfill Strava de {user_id}: {e}")
+        return inseridas_total
+    finally:
+        try:
+            _finalizar_execucao_backfill(user_id, status_final)
+        except Exception:
+            pass
+
+
+def retomar_backfills_pendentes(limite: int = 20) -> int:
+    """Retoma backfills pausados/interrompidos. Chamado pelo scheduler."""
+    if mongo_db is None:
+        return 0
+    agora = datetime.utcnow()
+    pendentes = mongo_db["strava_backfill"].find(
+        {
+            "status": {"$in": ["pendente", "pausado"]},
+            "$or": [{"executando_ate": None}, {"executando_ate": {"$lt": agora}}],
+        },
+        {"_id": 1}
+    ).limit(limite)
+    total = 0
+    for cp in pendentes:
+        total += executar_backfill_strava(cp["_id"])
+    return total
+
@@ -0,0 +1,333 @@
+"""
+logic_strava_api.py — Cliente HTTP compartilhado da API do Strava.
+
+- Sessão keep-alive (pool de conexões) reutilizada por todas as chamadas do worker.
+- Lê os headers X-RateLimit-Limit / X-RateLimit-Usage de cada resposta.
+- Token bucket compartilhado entre os 4 workers Gunicorn via MongoDB
+  (coleção 'strava_rate_limit': um documento por janela de 15 min e um por dia).
+- Fila de prioridade no processo: webhooks passam na frente do backfill, e o
+  backfill só pode consumir uma fração da cota de cada janela.
+- Backoff exponencial com jitter em 429 / 5xx / falhas de rede.
+"""
+
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from datetime import datetime
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from data_manager import mongo_db
+
+logger = logging.getLogger("AURA_STRAVA_API")
+
+STRAVA_API_URL   = "https://www.strava.com/api/v3"
+STRAVA_OAUTH_URL = "https://www.strava.com/oauth/token"
+
+COLECAO_RATE_LIMIT = "strava_rate_limit"
+
+# Prioridades (menor número = atendido primeiro)
+PRIORIDADE_WEBHOOK  = 0
+PRIORIDADE_BACKFILL = 1
+
+# Fração da cota de cada janela que cada prioridade pode consumir.
+# O backfill nunca passa da metade, deixando folga para os webhooks da manhã.
+_FRACAO_COTA = {PRIORIDADE_WEBHOOK: 1.0, PRIORIDADE_BACKFILL: 0.5}
+
+# Margem de segurança por janela (chamadas em voo em outros workers)
+_RESERVA_COTA = 5
+
+_JANELA_15MIN = 900
+_JANELA_DIA   = 86400
+
+_TIMEOUT = (3.05, 10)          # (connect, read)
+_MAX_CONCORRENTES = 2          # chamadas simultâneas ao Strava por worker
+_ESPERA_MAXIMA_WEBHOOK = 20    # segundos que um webhook aceita esperar por cota
+
+# Limites reais informados pelo Strava (atualizados a cada resposta)
+_limites: dict = {
+    "15m": int(os.getenv("STRAVA_LIMITE_15MIN", 200)),
+    "dia": int(os.getenv("STRAVA_LIMITE_DIARIO", 2000)),
+}
+
+# ──────────────────────────────────────────────────────────────
+# Sessão HTTP (keep-alive)
+# ──────────────────────────────────────────────────────────────
+_sessao_http: Optional[requests.Session] = None
+_sessao_lock = threading.Lock()
+
+
+def _sessao() -> requests.Session:
+    global _sessao_http
+    if _sessao_http is None:
+        with _sessao_lock:
+            if _sessao_http is None:
+                s = requests.Session()
+                s.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=_MAX_CONCORRENTES * 2))
+                s.headers.update({"Accept": "application/json"})
+                _sessao_http = s
+    return _sessao_http
+
+
+# ──────────────────────────────────────────────────────────────
+# Fila de prioridade (por worker)
+# ──────────────────────────────────────────────────────────────
+_fila_cond = threading.Condition()
+_fila: list = []
+_fila_seq = itertools.count()
+_em_voo = 0
+
+
+def _entrar_na_fila(prioridade: int):
+    """Bloqueia até ser a vez desta chamada (menor prioridade, depois ordem de chegada)."""
+    global _em_voo
+    with _fila_cond:
+        item = (prioridade, next(_fila_seq))
+        heapq.heappush(_fila, item)
+        while _fila[0] != item or _em_voo >= _MAX_CONCORRENTES:
+            _fila_cond.wait(timeout=1.0)
+        heapq.heappop(_fila)
+        _em_voo += 1
+        _fila_cond.notify_all()
+
+
+def _sair_da_fila():
+    global _em_voo
+    with _fila_cond:
+        _em_voo -= 1
+        _fila_cond.notify_all()
+
+
+# ──────────────────────────────────────────────────────────────
+# Token bucket compartilhado (MongoDB)
+# ──────────────────────────────────────────────────────────────
+
+def _inicio_janela(agora: float, tamanho: int) -> int:
+    return int(agora // tamanho) * tamanho
+
+
+def _consumir_token(janela: str, inicio: int, tamanho: int, teto: int) -> bool:
+    """
+    Incrementa atomicamente o contador da janela se ainda houver cota.
+    O upsert recebe DuplicateKeyError quando o documento já existe e não casou
+    o filtro: ou está no teto, ou outro worker acabou de criá-lo (primeiras
+    chamadas da janela). O servidor não repete esse upsert por causa do $lt,
+    então repetimos sem upsert — só nada casar de novo significa bucket vazio.
+    """
+    filtro = {"_id": f"{janela}:{inicio}", "usados": {"$lt": teto}}
+    try:
+        mongo_db[COLECAO_RATE_LIMIT].find_one_and_update(
+            filtro,
+            {
+                "$inc": {"usados": 1},
+                "$setOnInsert": {"expire_at": datetime.utcfromtimestamp(inicio + tamanho * 2)},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return True
+    except DuplicateKeyError:
+        return mongo_db[COLECAO_RATE_LIMIT].find_one_and_update(filtro, {"$inc": {"usados": 1}}) is not None
+
+
+def _devolver_token(janela: str, inicio: int):
+    try:
+        mongo_db[COLECAO_RATE_LIMIT].update_one({"_id": f"{janela}:{inicio}"}, {"$inc": {"usados": -1}})
+    except Exception:
+        pass
+
+
+def _reservar_cota(prioridade: int) -> float:
+    """
+    Tenta consumir 1 token das janelas de 15 min e diária.
+    Retorna 0 se a chamada pode seguir; senão, os segundos até a cota liberar.
+    """
+    if mongo_db is None:
+        return 0
+
+    agora = time.time()
+    fracao = _FRACAO_COTA.get(prioridade, 1.0)
+    inicio_15 = _inicio_janela(agora, _JANELA_15MIN)
+    inicio_dia = _inicio_janela(agora, _JANELA_DIA)
+    teto_15 = max(1, int(_limites["15m"] * fracao) - _RESERVA_COTA)
+    teto_dia = max(1, int(_limites["dia"] * fracao) - _RESERVA_COTA)
+
+    try:
+        if not _consumir_token("15m", inicio_15, _JANELA_15MIN, teto_15):
+            return inicio_15 + _JANELA_15MIN - agora
+        if not _consumir_token("dia", inicio_dia, _JANELA_DIA, teto_dia):
+            _devolver_token("15m", inicio_15)
+            return inicio_dia + _JANELA_DIA - agora
+        return 0
+    except Exception as e:
+        # Bucket indisponível não deve derrubar a integração: seguimos sem pacing.
+        logger.warning(f"⚠️ [STRAVA] Falha no token bucket, seguindo sem controle de cota: {e}")
+        return 0
+
+
+def _parse_par(valor: str) -> Optional[tuple]:
+    """Converte '100,1000' em (100, 1000)."""
+    try:
+        a, b = str(valor).split(",")[:2]
+        return int(a.strip()), int(b.strip())
+    except Exception:
+        return None
+
+
+def parse_rate_limit_headers(headers) -> dict:
+    """
+    Extrai limites e uso do Strava dos headers da resposta.
+    Retorna {"limite_15m", "limite_dia", "uso_15m", "uso_dia"} (apenas os presentes).
+    """
+    resultado = {}
+    limite = _parse_par(headers.get("X-RateLimit-Limit", ""))
+    uso = _parse_par(headers.get("X-RateLimit-Usage", ""))
+    if limite:
+        resultado["limite_15m"], resultado["limite_dia"] = limite
+    if uso:
+        resultado["uso_15m"], resultado["uso_dia"] = uso
+    return resultado
+
+
+def _sincronizar_uso(headers):
+    """Alinha limites locais e contadores compartilhados com o que o Strava reportou."""
+    info = parse_rate_limit_headers(headers)
+    if not info:
+        return
+    if info.get("limite_15m"):
+        _limites["15m"] = info["limite_15m"]
+    if info.get("limite_dia"):
+        _limites["dia"] = info["limite_dia"]
+
+    if mongo_db is None or "uso_15m" not in info:
+        return
+    agora = time.time()
+    try:
+        for janela, tamanho, uso in (("15m", _JANELA_15MIN, info["uso_15m"]),
+                                     ("dia", _JANELA_DIA, info["uso_dia"])):
+            inicio = _inicio_janela(agora, tamanho)
+            mongo_db[COLECAO_RATE_LIMIT].update_one(
+                {"_id": f"{janela}:{inicio}"},
+                {"$max": {"usados": uso},
+                 "$setOnInsert": {"expire_at": datetime.utcfromtimestamp(inicio + tamanho * 2)}},
+                upsert=True,
+            )
+    except Exception as e:
+        logger.warning(f"⚠️ [STRAVA] Falha ao sincronizar uso da cota: {e}")
+
+
+def _marcar_cota_esgotada():
+    """Após um 429, trava a janela atual para todos os workers."""
+    if mongo_db is None:
+        return
+    agora = time.time()
+    inicio = _inicio_janela(agora, _JANELA_15MIN)
+    try:
+        mongo_db[COLECAO_RATE_LIMIT].update_one(
+            {"_id": f"15m:{inicio}"},
+            {"$max": {"usados": _limites["15m"]},
+             "$setOnInsert": {"expire_at": datetime.utcfromtimestamp(inicio + _JANELA_15MIN * 2)}},
+            upsert=True,
+        )
+    except Exception:
+        pass
+
+
+def _tempo_backoff(tentativa: int) -> float:
+    return min(30, (2 ** tentativa)) + random.uniform(0, 1)
+
+
+# ──────────────────────────────────────────────────────────────
+# API pública
+# ──────────────────────────────────────────────────────────────
+
+def requisitar_strava(metodo: str, url: str, prioridade: int = PRIORIDADE_WEBHOOK,
+                      consumir_cota: bool = True, espera_maxima: float = None,
+                      tentativas: int = 4, **kwargs) -> Optional[requests.Response]:
+    """
+    Executa uma chamada ao Strava respeitando fila, cota compartilhada e backoff.
+    Retorna a Response (qualquer status não-retentável) ou None se a cota não
+    liberou dentro de espera_maxima ou todas as tentativas falharam.
+    """
+    if espera_maxima is None:
+        espera_maxima = _ESPERA_MAXIMA_WEBHOOK if prioridade == PRIORIDADE_WEBHOOK else 0
+    kwargs.setdefault("timeout", _TIMEOUT)
+
+    _entrar_na_fila(prioridade)
+    try:
+        esperado = 0.0
+        for tentativa in range(tentativas):
+            if consumir_cota:
+                espera = _reservar_cota(prioridade)
+                if espera > 0:
+                    if esperado + espera > espera_maxima:
+                        logger.warning(f"⏳ [STRAVA] Cota esgotada (prioridade {prioridade}), "
+                                       f"libera em {int(espera)}s. Chamada adiada.")
+                        return None
+                    time.sleep(espera)
+                    esperado += espera
+                    continue
+
+            try:
+                resp = _sessao().request(metodo, url, **kwargs)
+            except requests.RequestException as e:
+                logger.warning(f"⚠️ [STRAVA] Falha de rede ({e}), tentativa {tentativa + 1}/{tentativas}")
+                time.sleep(_tempo_backoff(tentativa))
+                continue
+
+            _sincronizar_uso(resp.headers)
+
+            if resp.status_code == 429:
+                _marcar_cota_esgotada()
+                retry_after = resp.headers.get("Retry-After")
+                espera = float(retry_after) if retry_after and retry_after.isdigit() else _tempo_backoff(tentativa)
+                if esperado + espera > espera_maxima:
+                    logger.warning(f"🚦 [STRAVA] 429 recebido (prioridade {prioridade}). Chamada adiada.")
+                    return None
+                time.sleep(espera)
+                esperado += espera
+                continue
+
+            if resp.status_code >= 500:
+                logger.warning(f"⚠️ [STRAVA] {resp.status_code} do Strava, tentativa {tentativa + 1}/{tentativas}")
+                time.sleep(_tempo_backoff(tentativa))
+                continue
+
+            return resp
+
+        logger.error(f"❌ [STRAVA] {metodo} {url} falhou após {tentativas} tentativas.")
+        return None
+    finally:
+        _sair_da_fila()
+
+
+def strava_get(caminho: str, access_token: str, params: dict = None,
+               prioridade: int = PRIORIDADE_WEBHOOK, **kwargs) -> Optional[requests.Response]:
+    """GET autenticado em /api/v3 (ex.: caminho='/activities/123')."""
+    return requisitar_strava(
+        "GET",
+        f"{STRAVA_API_URL}{caminho}",
+        prioridade=prioridade,
+        headers={"Authorization": f"Bearer {access_token}"},
+        params=params,
+        **kwargs,
+    )
+
+
+def strava_oauth_token(payload: dict) -> Optional[requests.Response]:
+    """
+    POST em /oauth/token (troca de code ou refresh). Não consome cota da API.
+    O authorization code é de uso único: sem retry, senão uma resposta perdida
+    vira invalid_grant na segunda tentativa.
+    """
+    tentativas = 1 if payload.get("grant_type") == "authorization_code" else 4
+    return requisitar_strava("POST", STRAVA_OAUTH_URL, consumir_cota=False,
+                             tentativas=tentativas, data=payload)
@@ -0,0 +1,444 @@
+"""
+Migrações de dados do MongoDB (executar manualmente, uma vez por ambiente).
+Execução: source venv/bin/activate && python3 migracoes.py <nome_da_migracao>
+
+Todas as migrações são idempotentes: podem ser re-executadas com segurança
+e retomam de onde pararam se interrompidas.
+"""
+
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from data_manager import mongo_db
+
+LOTE = 200
+
+
+# ──────────────────────────────────────────────────────────────
+# atividades_strava: JSON completo → documento compacto + arquivo bruto
+# ──────────────────────────────────────────────────────────────
+def compactar_atividades_strava():
+    from logic_strava import _documento_bruto
+    from schema import obter_schema_atividade_strava
+
+    col = mongo_db["atividades_strava"]
+    col_raw = mongo_db["atividades_strava_raw"]
+    compactadas = 0
+
+    while True:
+        lote = list(col.find({"compacto": {"$ne": True}}).limit(LOTE))
+        if not lote:
+            break
+
+        brutos, substituicoes = [], []
+        for doc in lote:
+            user_id = doc.get("user_id", "")
+            analise = doc.get("aura_analysis", {})
+            bruto = {k: v for k, v in doc.items() if k not in ("_id", "user_id", "aura_analysis")}
+            brutos.append(ReplaceOne({"_id": int(doc.get("id") or 0)},
+                                     _documento_bruto(bruto, user_id), upsert=True))
+
+            compacto = obter_schema_atividade_strava(bruto, user_id)
+            compacto["aura_analysis"] = analise
+            substituicoes.append(ReplaceOne({"_id": doc["_id"]}, compacto))
+
+        # Arquiva antes de compactar: se cair no meio, nada se perde
+        col_raw.bulk_write(brutos, ordered=False)
+        col.bulk_write(substituicoes, ordered=False)
+        compactadas += len(lote)
+        print(f"  🗜️  {compactadas} atividades compactadas...")
+
+    print(f"\n✅ Concluído: {compactadas} atividades migradas para o schema compacto.")
+
+
+# ──────────────────────────────────────────────────────────────
+# Clas.membros / solicitacoes_pendentes → coleção cla_membros
+# Rodar logo após o deploy: as rotas já leem apenas de cla_membros.
+# ──────────────────────────────────────────────────────────────
+def migrar_membros_clas():
+    col_clas = mongo_db["Clas"]
+    col_membros = mongo_db["cla_membros"]
+    migrados = 0
+
+    filtro = {"$or": [{"membros": {"$exists": True}}, {"solicitacoes_pendentes": {"$exists": True}}]}
+    for cla in col_clas.find(filtro, {"membros": 1, "solicitacoes_pendentes": 1}):
+        cla_id = str(cla["_id"])
+        ops = []
+        for m in cla.get("membros", []):
+            if not m.get("user_id"):
+                continue
+            ops.append(UpdateOne(
+                {"cla_id": cla_id, "user_id": m["user_id"]},
+                {"$set": {
+                    "cargo":           m.get("cargo", "member"),
+                    "xp_contribuicao": m.get("xp_contribuicao", 0),
+                    "joined_at":       m.get("joined_at", ""),
+                }},
+                upsert=True
+            ))
+        for sol in cla.get("solicitacoes_pendentes", []):
+            if not sol.get("user_id"):
+                continue
+            # $setOnInsert: quem já é membro não volta a ser "pendente"
+            ops.append(UpdateOne(
+                {"cla_id": cla_id, "user_id": sol["user_id"]},
+                {"$setOnInsert": {
+                    "cargo":         "pendente",
+                    "nome":          sol.get("nome", "Atleta"),
+                    "nivel":         sol.get("nivel", 1),
+                    "solicitado_em": sol.get("solicitado_em", ""),
+                }},
+                upsert=True
+            ))
+        if ops:
+            col_membros.bulk_write(ops, ordered=False)
+
+        num_membros = col_membros.count_documents(
+            {"cla_id": cla_id, "cargo": {"$in": ["owner", "co-leader", "member"]}}
+        )
+        col_clas.update_one(
+            {"_id": cla["_id"]},
+            {"$set": {"num_membros": num_membros},
+             "$unset": {"membros": "", "solicitacoes_pendentes": ""}}
+        )
+        migrados += 1
+        print(f"  ⚔️  Clã {cla_id}: {num_membros} membros")
+
+    print(f"\n✅ Concluído: {migrados} clãs migrados para cla_membros.")
+
+
+# ──────────────────────────────────────────────────────────────
+# amizades: par_id canônico + membros (remove arestas duplicadas)
+# Rodar logo após o deploy: as rotas já buscam apenas por par_id/membros.
+# ──────────────────────────────────────────────────────────────
+def canonizar_amizades():
+    col = mongo_db["amizades"]
+    prioridade = {"aceita": 0, "pendente": 1, "recusada": 2}
+    pares = {}
+
+    for rel in col.find({}, {"solicitante_id": 1, "receptor_id": 1, "status": 1, "created_at": 1}):
+        sol, rec = rel.get("solicitante_id"), rel.get("receptor_id")
+        if not sol or not rec:
+            continue
+        chave = ":".join(sorted((sol, rec)))
+        pares.setdefault(chave, []).append(rel)
+
+    ops, duplicadas = [], []
+    for chave, relacoes in pares.items():
+        # Mantém a relação mais forte (aceita > pendente > recusada), depois a mais antiga
+        relacoes.sort(key=lambda r: (prioridade.get(r.get("status"), 3), r.get("created_at", "")))
+        manter = relacoes[0]
+        duplicadas.extend(r["_id"] for r in relacoes[1:])
+        ops.append(UpdateOne(
+            {"_id": manter["_id"]},
+            {"$set": {"par_id": chave, "membros": [manter["solicitante_id"], manter["receptor_id"]]}}
+        ))
+
+    # Remove duplicadas antes de gravar par_id: o índice único não pode colidir
+    for i in range(0, len(duplicadas), LOTE):
+        col.delete_many({"_id": {"$in": duplicadas[i:i + LOTE]}})
+    for i in range(0, len(ops), LOTE):
+        col.bulk_write(ops[i:i + LOTE], ordered=False)
+        print(f"  🤝 {min(i + LOTE, len(ops))}/{len(ops)} amizades canonizadas...")
+
+    col.create_index("par_id", unique=True, sparse=True)
+    print(f"\n✅ Concluído: {len(ops)} pares canonizados, {len(duplicadas)} duplicadas removidas.")
+
+
+# ──────────────────────────────────────────────────────────────
+# usuarios.aura_code: backfill em lotes + índice único
+# Detecta colisões do truncamento em 8 caracteres (no lote e contra o banco)
+# e resolve com gerar_aura_code(user_id, tentativa+1).
+# ──────────────────────────────────────────────────────────────
+def atribuir_aura_codes():
+    from data_manager import gerar_aura_code, AURA_CODE_TENTATIVAS
+
+    col = mongo_db["usuarios"]
+
+    # 1. Códigos duplicados já gravados pela geração preguiçosa: mantém o mais antigo
+    repetidos = list(col.aggregate([
+        {"$match": {"aura_code": {"$exists": True}}},
+        {"$group": {"_id": "$aura_code", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ], allowDiskUse=True))
+    for grupo in repetidos:
+        excedentes = sorted(grupo["ids"])[1:]
+        col.update_many({"_id": {"$in": excedentes}}, {"$unset": {"aura_code": ""}})
+    if repetidos:
+        print(f"  ⚠️  {len(repetidos)} códigos duplicados liberados para reatribuição.")
+
+    # 2. Backfill em lotes ordenados por _id
+    ultimo_id, atribuidos, colisoes = None, 0, 0
+    while True:
+        filtro = {"aura_code": {"$exists": False}}
+        if ultimo_id is not None:
+            filtro["_id"] = {"$gt": ultimo_id}
+        lote = [d["_id"] for d in col.find(filtro, {"_id": 1}).sort("_id", 1).limit(LOTE)]
+        if not lote:
+            break
+        ultimo_id = lote[-1]
+
+        tentativas = {oid: 0 for oid in lote}
+        codigos = {oid: gerar_aura_code(oid) for oid in lote}
+        for _ in range(AURA_CODE_TENTATIVAS):
+            em_uso = {d["aura_code"] for d in col.find(
+                {"aura_code": {"$in": list(codigos.values())}}, {"aura_code": 1}
+            )}
+            vistos, conflitantes = set(), []
+            for oid, code in codigos.items():
+                if code in em_uso or code in vistos:
+                    conflitantes.append(oid)
+                vistos.add(code)
+            if not conflitantes:
+                break
+            colisoes += len(conflitantes)
+            for oid in conflitantes:
+                tentativas[oid] += 1
+                codigos[oid] = gerar_aura_code(oid, tentativas[oid])
+
+        ops = [UpdateOne({"_id": oid, "aura_code": {"$exists": False}}, {"$set": {"aura_code": code}})
+               for oid, code in codigos.items()]
+        col.bulk_write(ops, ordered=False)
+        atribuidos += len(ops)
+        print(f"  🪪 {atribuidos} Aura Codes atribuídos...")
+
+    col.create_index("aura_code", unique=True, sparse=True)
+    print(f"\n✅ Concluído: {atribuidos} usuários com Aura Code ({colisoes} colisões resolvidas).")
+
+
+# ──────────────────────────────────────────────────────────────
+# usuarios.estatisticas_publicas.atividades: contagem inicial do perfil público
+# ──────────────────────────────────────────────────────────────
+
+def contar_estatisticas_publicas():
+    from bson.objectid import ObjectId
+
+    # Uma agregação sobre 'atividades' (índice user_id) em vez de um count por usuário.
+    # Só preenche quem ainda não tem contador: não sobrescreve os $inc já feitos.
+    contagens = mongo_db["atividades"].aggregate([
+        {"$group": {"_id": "$user_id", "total": {"$sum": 1}}},
+    ], allowDiskUse=True)
+
+    ops, gravados = [], 0
+    for c in contagens:
+        if not ObjectId.is_valid(str(c["_id"])):
+            continue
+        ops.append(UpdateOne(
+            {"_id": ObjectId(str(c["_id"])), "estatisticas_publicas.atividades": {"$exists": False}},
+            {"$set": {"estatisticas_publicas.atividades": c["total"]}}
+        ))
+        if len(ops) >= LOTE:
+            gravados += mongo_db["usuarios"].bulk_write(ops, ordered=False).modified_count
+            ops = []
+            print(f"  📊 {gravados} contadores gravados...")
+    if ops:
+        gravados += mongo_db["usuarios"].bulk_write(ops, ordered=False).modified_count
+
+    print(f"\n✅ Concluído: {gravados} usuários com contador de atividades.")
+
+
+# ──────────────────────────────────────────────────────────────
+# desafios: cópia dos dados do profissional (profissional_*)
+# ──────────────────────────────────────────────────────────────
+
+def desnormalizar_profissionais_desafios():
+    from data_desafios import sincronizar_profissional_desafios
+
+    # Um update_many por profissional (não por desafio); re-executar só recopia
+    prof_ids = [p for p in mongo_db["desafios"].distinct("profissional_id") if p]
+    alterados = 0
+    for i, prof_id in enumerate(prof_ids, 1):
+        alterados += sincronizar_profissional_desafios(prof_id)
+        if i % LOTE == 0:
+            print(f"  🏆 {i}/{len(prof_ids)} profissionais sincronizados...")
+
+    print(f"\n✅ Concluído: {alterados} desafios atualizados ({len(prof_ids)} profissionais).")
+
+
+# ──────────────────────────────────────────────────────────────
+# desafios/profissionais: soma_avaliacoes inicial (contadores incrementais)
+# ──────────────────────────────────────────────────────────────
+
+def reconciliar_avaliacoes():
+    from data_desafios import reconciliar_avaliacoes as _reconciliar
+
+    for colecao, dados in _reconciliar(corrigir=True).items():
+        print(f"  ⭐ {colecao}: {dados}")
+    print("\n✅ Concluído: soma/total de avaliações recalculados a partir das inscrições.")
+
+
+# ──────────────────────────────────────────────────────────────
+# ledger_xp: créditos de atividades do app no período dos quadros semanal/mensal
+# ──────────────────────────────────────────────────────────────
+
+def registrar_atividades_ledger_xp():
+    from data_global import _inicio_periodo
+
+    # Só o que os quadros de período enxergam; a chave é a mesma usada por
+    # registrar_atividade, então re-executar (ou rodar após o deploy) não duplica.
+    # XP de missões anterior ao ledger não tem registro datado e não é recuperável.
+    desde = min(_inicio_periodo("semanal"), _inicio_periodo("mensal"))
+    cursor = mongo_db["atividades"].find(
+        {"created_at": {"$gte": desde}, "xp_concedido": {"$gt": 0}},
+        {"user_id": 1, "xp_concedido": 1, "created_at": 1}
+    )
+
+    ops, gravados = [], 0
+    for a in cursor:
+        ops.append(UpdateOne(
+            {"_id": f"atividade:{a['_id']}"},
+            {"$setOnInsert": {
+                "origem": "atividade",
+                "user_id": a.get("user_id"),
+                "estado": "aplicado",
+                "xp": int(a["xp_concedido"]),
+                "aplicado_em": a["created_at"],
+            }},
+            upsert=True
+        ))
+        if len(ops) >= LOTE:
+            gravados += mongo_db["ledger_xp"].bulk_write(ops, ordered=False).upserted_count
+            ops = []
+            print(f"  📒 {gravados} créditos registrados...")
+    if ops:
+        gravados += mongo_db["ledger_xp"].bulk_write(ops, ordered=False).upserted_count
+
+    print(f"\n✅ Concluído: {gravados} atividades desde {desde[:10]} registradas no ledger_xp.")
+
+
+# ──────────────────────────────────────────────────────────────
+# atividades_strava: remove cópias do mesmo id (find_one/insert antigo) + índice único
+# Sem o índice, webhook e backfill não deduplicam por id.
+# ──────────────────────────────────────────────────────────────
+
+def deduplicar_atividades_strava():
+    col = mongo_db["atividades_strava"]
+    grupos = col.aggregate([
+        {"$match": {"id": {"$exists": True}}},
+        {"$group": {"_id": "$id", "docs": {"$push": {
+            "_id": "$_id",
+            "xp_creditado": "$aura_analysis.xp_creditado",
+            "processed_at": "$aura_analysis.processed_at",
+        }}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ], allowDiskUse=True)
+
+    duplicadas, ids = [], 0
+    for g in grupos:
+        # Mantém a versão creditada pelo webhook (não a do backfill), depois a mais recente
+        docs = sorted(g["docs"], key=lambda d: (d.get("xp_creditado") is not False,
+                                                d.get("processed_at") or ""), reverse=True)
+        duplicadas.extend(d["_id"] for d in docs[1:])
+        ids += 1
+
+    for i in range(0, len(duplicadas), LOTE):
+        col.delete_many({"_id": {"$in": duplicadas[i:i + LOTE]}})
+        print(f"  🧹 {min(i + LOTE, len(duplicadas))}/{len(duplicadas)} cópias removidas...")
+
+    col.create_index("id", unique=True, sparse=True)
+    print(f"\n✅ Concluído: {len(duplicadas)} cópias de {ids} atividades removidas; índice único id ativo.")
+
+
+# ──────────────────────────────────────────────────────────────
+# ledger_xp: XP de atividades Strava creditado antes do ledger
+# Sem essa linha, update/replay do webhook recreditaria o XP e delete não estornaria.
+# ──────────────────────────────────────────────────────────────
+
+def registrar_strava_legado_ledger_xp():
+    from logic_strava import _documento_credito_legado
+
+    # Mesma chave que o webhook grava sob demanda: re-executar não duplica
+    cursor = mongo_db["atividades_strava"].find(
+        {"aura_analysis.xp_creditado": {"$exists": False}, "aura_analysis.xp_ganho": {"$gt": 0}},
+        {"id": 1, "user_id": 1, "aura_analysis": 1}
+    )
+
+    ops, gravados = [], 0
+    for a in cursor:
+        if a.get("id") is None or mongo_db["ledger_xp"].find_one(
+                {"atividade_id": a["id"], "estado": "aplicado"}, {"_id": 1}):
+            continue
+        credito = _documento_credito_legado(a)
+        if not credito:
+            continue
+        ops.append(UpdateOne({"_id": credito.pop("_id")}, {"$setOnInsert": credito}, upsert=True))
+        if len(ops) >= LOTE:
+            gravados += mongo_db["ledger_xp"].bulk_write(ops, ordered=False).upserted_count
+            ops = []
+            print(f"  📒 {gravados} créditos Strava legados registrados...")
+    if ops:
+        gravados += mongo_db["ledger_xp"].bulk_write(ops, ordered=False).upserted_count
+
+    print(f"\n✅ Concluído: {gravados} atividades Strava legadas registradas no ledger_xp.")
+
+
+# ──────────────────────────────────────────────────────────────
+# Clas.nome: renomeia duplicatas (maiúsculas/acentos) e cria o índice único
+# ──────────────────────────────────────────────────────────────
+
+def unificar_nomes_clas():
+    from data_clas import COLACAO_NOME_CLA, INDICE_NOME_CLA
+
+    col = mongo_db["Clas"]
+    # $group com o collation do índice: "Força" e "forca" caem no mesmo grupo
+    grupos = col.aggregate([
+        {"$sort": {"data_criacao": 1, "_id": 1}},
+        {"$group": {"_id": "$nome", "ids": {"$push": "$_id"}, "total": {"$sum": 1}}},
+        {"$match": {"total": {"$gt": 1}}},
+    ], collation=COLACAO_NOME_CLA, allowDiskUse=True)
+
+    renomeados = 0
+    for g in grupos:
+        # O clã mais antigo mantém o nome; os demais ganham sufixo numérico livre
+        for cla_id in g["ids"][1:]:
+            atual = col.find_one({"_id": cla_id}, {"nome": 1})
+            n = 2
+            while col.find_one({"nome": f"{atual['nome']} {n}"}, {"_id": 1}, collation=COLACAO_NOME_CLA):
+                n += 1
+            col.update_one({"_id": cla_id}, {"$set": {"nome": f"{atual['nome']} {n}"}})
+            renomeados += 1
+            print(f"  🏰 '{atual['nome']}' → '{atual['nome']} {n}'")
+
+    # Sem try: se ainda houver conflito, a migração falha com o erro do MongoDB
+    col.create_index("nome", unique=True, collation=COLACAO_NOME_CLA, name=INDICE_NOME_CLA)
+    print(f"\n✅ Concluído: {renomeados} clãs renomeados; índice {INDICE_NOME_CLA} ativo.")
+
+
+MIGRACOES = {
+    "compactar_atividades_strava": compactar_atividades_strava,
+    "migrar_membros_clas":         migrar_membros_clas,
+    "canonizar_amizades":          canonizar_amizades,
+    "atribuir_aura_codes":         atribuir_aura_codes,
+    "contar_estatisticas_publicas": contar_estatisticas_publicas,
+    "desnormalizar_profissionais_desafios": desnormalizar_profissionais_desafios,
+    "reconciliar_avaliacoes":      reconciliar_avaliacoes,
+    "registrar_atividades_ledger_xp": registrar_atividades_ledger_xp,
+    "unificar_nomes_clas":         unificar_nomes_clas,
+    "deduplicar_atividades_strava": deduplicar_atividades_strava,
+    "registrar_strava_legado_ledger_xp": registrar_strava_legado_ledger_xp,
+}
+
+
+def main():
+    if mongo_db is None:
+        print("❌ MongoDB inacessível. Verifique MONGODB_URI no .env")
+        sys.exit(1)
+
+    if len(sys.argv) < 2 or sys.argv[1] not in MIGRACOES:
+        print(f"Uso: python3 migracoes.py <{'|'.join(MIGRACOES)}>")
+        sys.exit(1)
+
+    try:
+        MIGRACOES[sys.argv[1]]()
+    except BulkWriteError as e:
+        print(f"❌ Erro em lote: {e.details.get('writeErrors', [])[:3]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
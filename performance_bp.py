@@ -9,14 +9,13 @@ Fluxo financeiro:
   - Plano mensal profissional: R$49,90/mês após 3 meses grátis
 """
 
-import os
 import logging
-import requests as _requests
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from bson.objectid import ObjectId
 
-from data_manager import mongo_db
+from auth_jwt import token_required
+from data_manager import mongo_db, carregar_resumos_usuarios
 from data_user import carregar_memoria
 from schema import (
     obter_schema_padrao_profissional,
@@ -24,7 +23,14 @@ from schema import (
     obter_schema_padrao_inscricao,
     obter_schema_padrao_mensagem_desafio,
 )
-from logic_asaas import criar_cobranca, criar_ou_buscar_cliente
+from logic_asaas import criar_cobranca, criar_ou_buscar_cliente, asaas_request, obter_qrcode_pix
+from logic_chat import buscar_mensagens, aguardar_mensagens, publicar, canal_desafio, canal_privado
+from logic_retencao_chat import executar_retencao_chat, expiracao_mensagem_chat
+from data_desafios import (
+    listar_catalogo, resumo_profissional, sincronizar_profissional_desafios, registrar_avaliacao,
+    perfil_saude_aluno, estatisticas_treino, obter_coorte_saude, obter_roster, contar_inscritos_pagos,
+    CATALOGO_LIMITE_MAX
+)
 
 logger = logging.getLogger("AURA_PERFORMANCE")
 
@@ -35,34 +41,12 @@ performance_bp = Blueprint("performance", __name__)
 # ──────────────────────────────────────────────────────────────
 
 def _get_user_id(request_obj):
-    """Extrai o user_id do token JWT já validado pelo middleware externo."""
-    return request_obj.environ.get("current_user_id", "")
-
-
-def _token_required(f):
-    """Decorador leve que reutiliza o middleware JWT de rotas_api.py via environ."""
-    from functools import wraps
-    from flask import request as req
-    import jwt as pyjwt
-
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        auth = req.headers.get("Authorization", "")
-        if auth.startswith("Bearer "):
-            token = auth[7:]
-        if not token:
-            return jsonify({"erro": "Token ausente"}), 401
-        try:
-            secret = os.getenv("JWT_SECRET", "aura_secret_dev")
-            payload = pyjwt.decode(token, secret, algorithms=["HS256"])
-            user_id = payload.get("user_id") or payload.get("id") or payload.get("sub")
-            if not user_id:
-                return jsonify({"erro": "Token inválido"}), 401
-        except Exception:
-            return jsonify({"erro": "Token inválido ou expirado"}), 401
-        return f(user_id, *args, **kwargs)
-    return decorated
+    """user_id do token JWT já validado pelo decorator (flask.g)."""
+    return getattr(g, "current_user_id", "")
+
+
+# Mesmo decorator de rotas_api.py (auth_jwt): segredo único + cache de claims verificados
+_token_required = token_required
 
 
 def _obter_profissional(user_id: str):
@@ -203,6 +187,8 @@ def atualizar_meu_perfil(current_user_id):
         )
         if resultado.matched_count == 0:
             return jsonify({"erro": "Perfil não encontrado"}), 404
+        if update.keys() & {"foto_perfil_url", "tipo_profissional"}:
+            sincronizar_profissional_desafios(current_user_id)
 
         return jsonify({"sucesso": True}), 200
 
@@ -232,23 +218,18 @@ def solicitar_verificacao(current_user_id):
         nome = usuario.get("nome", "Profissional AURA") if usuario else "Profissional AURA"
         email = usuario.get("email", "") if usuario else ""
 
-        import requests as req
-        asaas_key = os.getenv("ASAAS_ACCESS_TOKEN")
-        headers = {"access_token": asaas_key, "Content-Type": "application/json"}
+        customer_id = criar_ou_buscar_cliente({"nome": nome, "email": email}, current_user_id)
+        if not customer_id:
+            return jsonify({"erro": "Falha ao registrar dados no gateway."}), 502
 
-        customer_resp = req.post("https://api.asaas.com/v3/customers", headers=headers, json={
-            "name": nome, "email": email
-        }, timeout=10)
-        customer_id = customer_resp.json().get("id")
-
-        cobranca = req.post("https://api.asaas.com/v3/payments", headers=headers, json={
+        cobranca = asaas_request("POST", "/payments", json={
             "customer": customer_id,
             "billingType": "PIX",
             "value": 99.90,
             "dueDate": (datetime.now() + timedelta(days=3)).strftime("%Y-%m-%d"),
             "description": "Verificação de Credenciais AURA Performance",
             "externalReference": f"verificacao_{current_user_id}",
-        }, timeout=10)
+        })
         dados_cobranca = cobranca.json()
 
         mongo_db["profissionais"].update_one(
@@ -350,6 +331,7 @@ def criar_desafio(current_user_id):
         doc["duracao_dias"] = duracao
         doc["status"]      = "ativo" if dados.get("publicar") else "rascunho"
         doc["updated_at"]  = datetime.now().isoformat()
+        doc.update(resumo_profissional(current_user_id))
 
         resultado = mongo_db["desafios"].insert_one(doc)
         desafio_id = str(resultado.inserted_id)
@@ -374,14 +356,14 @@ def meus_desafios(current_user_id):
             {"profissional_id": current_user_id},
             sort=[("criado_em", -1)]
         )
+        cursor = list(cursor)
+        # Inscrições pagas de todos os desafios numa única agregação
+        pagos = contar_inscritos_pagos([str(d["_id"]) for d in cursor])
         desafios = []
         for d in cursor:
             d = _serializar(d)
             # Receita total gerada
-            inscritos = mongo_db["inscricoes_desafio"].count_documents({
-                "desafio_id": d["id"],
-                "status_pagamento": "PAGO"
-            })
+            inscritos = pagos.get(d["id"], 0)
             receita = round(d.get("preco", 0) * inscritos * 0.80, 2)
             d["inscritos_pagos"] = inscritos
             d["receita_profissional"] = receita
@@ -445,22 +427,17 @@ def inscritos_desafio(current_user_id, desafio_id):
         if not _assinatura_prof_ativa(prof):
             return jsonify(_ERRO_ASSINATURA), 403
 
-        cursor = mongo_db["inscricoes_desafio"].find({"desafio_id": desafio_id})
+        cursor = list(mongo_db["inscricoes_desafio"].find({"desafio_id": desafio_id}))
+        # Enriquece com dados básicos do usuário (1 query para todos)
+        usuarios = carregar_resumos_usuarios(ins.get("user_id") for ins in cursor)
         inscritos = []
         for ins in cursor:
             ins = _serializar(ins)
-            # Enriquece com dados básicos do usuário
-            try:
-                u = mongo_db["usuarios"].find_one(
-                    {"_id": ObjectId(ins["user_id"])},
-                    {"nome": 1, "foto_perfil": 1, "nivel": 1}
-                )
-                if u:
-                    ins["nome"]  = u.get("nome", "Atleta")
-                    ins["foto"]  = u.get("foto_perfil", "")
-                    ins["nivel"] = u.get("nivel", 1)
-            except Exception:
-                pass
+            u = usuarios.get(ins.get("user_id", ""))
+            if u:
+                ins["nome"]  = u.get("nome", "Atleta")
+                ins["foto"]  = u.get("foto_perfil", "")
+                ins["nivel"] = u.get("nivel", 1)
             inscritos.append(ins)
 
         return jsonify(inscritos), 200
@@ -470,6 +447,37 @@ def inscritos_desafio(current_user_id, desafio_id):
         return jsonify([]), 200
 
 
+@performance_bp.route("/desafios/<desafio_id>/roster", methods=["GET"])
+@_token_required
+def roster_desafio(current_user_id, desafio_id):
+    """
+    Roster paginado do desafio (apenas owner) com resumo dos alunos e progresso geral.
+    ?pagina=1&por_pagina=50&status_pagamento=PAGO
+    """
+    try:
+        if mongo_db is None or not ObjectId.is_valid(desafio_id):
+            return jsonify({"erro": "Inválido"}), 400
+
+        desafio = mongo_db["desafios"].find_one({"_id": ObjectId(desafio_id)}, {"profissional_id": 1})
+        if not desafio or desafio.get("profissional_id") != current_user_id:
+            return jsonify({"erro": "Sem permissão"}), 403
+
+        prof = _obter_profissional(current_user_id)
+        if not _assinatura_prof_ativa(prof):
+            return jsonify(_ERRO_ASSINATURA), 403
+
+        return jsonify(obter_roster(
+            desafio_id,
+            pagina=request.args.get("pagina", 1, type=int),
+            por_pagina=request.args.get("por_pagina", 50, type=int),
+            status_pagamento=request.args.get("status_pagamento", "").strip().upper(),
+        )), 200
+
+    except Exception as e:
+        logger.error(f"[PERF] Erro roster_desafio: {e}")
+        return jsonify({"erro": str(e)}), 500
+
+
 # ══════════════════════════════════════════════════════════════
 # ROTAS DE DESAFIOS — USUÁRIO
 # ══════════════════════════════════════════════════════════════
@@ -478,63 +486,41 @@ def inscritos_desafio(current_user_id, desafio_id):
 @_token_required
 def listar_desafios(current_user_id):
     """
-    Lista desafios ativos com filtros.
-    ?tipo=emagrecimento&duracao=30&verificado=true
+    Lista desafios ativos com filtros, melhor avaliados primeiro.
+    ?tipo=emagrecimento&duracao=30&verificado=true&tipo_profissional=personal&q=texto
+    Próxima página: ?apos=<id do último desafio recebido>&limite=N
     """
     try:
         if mongo_db is None:
             return jsonify([]), 200
 
-        filtro: dict = {"status": "ativo"}
-        tipo = request.args.get("tipo")
-        if tipo:
-            filtro["tipo"] = tipo
-
+        filtros: dict = {
+            "tipo":              request.args.get("tipo"),
+            "profissional_tipo": request.args.get("tipo_profissional"),
+        }
         duracao = request.args.get("duracao")
         if duracao and duracao.isdigit():
-            filtro["duracao_dias"] = int(duracao)
+            filtros["duracao_dias"] = int(duracao)
+        if request.args.get("verificado") == "true":
+            filtros["profissional_verificado"] = True
 
-        tipo_prof = request.args.get("tipo_profissional")
+        # Filtros e ordenação no índice; dados do profissional já vêm no documento
+        try:
+            cursor = listar_catalogo(
+                filtros,
+                busca=request.args.get("q", "").strip(),
+                apos=request.args.get("apos", ""),
+                limite=request.args.get("limite", CATALOGO_LIMITE_MAX, type=int),
+            )
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
 
-        cursor = mongo_db["desafios"].find(filtro).sort("avaliacao_media", -1).limit(100)
         desafios = []
         for d in cursor:
             d = _serializar(d)
-            # Enriquece com dados do profissional
-            prof_doc = mongo_db["profissionais"].find_one(
-                {"user_id": d["profissional_id"]},
-                {"nome_profissional": 1, "tipo_profissional": 1,
-                 "status_verificacao": 1, "foto_perfil_url": 1, "bio": 1}
-            )
-            # Dados do usuário do profissional
-            try:
-                u = mongo_db["usuarios"].find_one(
-                    {"_id": ObjectId(d["profissional_id"])},
-                    {"nome": 1, "foto_perfil": 1}
-                )
-                if u:
-                    d["profissional_nome"] = u.get("nome", "Profissional")
-                    d["profissional_foto"] = u.get("foto_perfil", "")
-            except Exception:
-                d["profissional_nome"] = "Profissional"
-                d["profissional_foto"] = ""
-
-            verificado = False
-            if prof_doc:
-                verificado = prof_doc.get("status_verificacao") == "verificado"
-                d["profissional_tipo"] = prof_doc.get("tipo_profissional", "")
-                if not d.get("profissional_foto") and prof_doc.get("foto_perfil_url"):
-                    d["profissional_foto"] = prof_doc["foto_perfil_url"]
-            d["profissional_verificado"] = verificado
-
-            # Filtro opcional por tipo de profissional
-            if tipo_prof and d.get("profissional_tipo", "") != tipo_prof:
-                continue
-
-            # Filtro verificado
-            if request.args.get("verificado") == "true" and not verificado:
-                continue
-
+            d.setdefault("profissional_nome", "Profissional")
+            d.setdefault("profissional_foto", "")
+            d.setdefault("profissional_verificado", False)
             desafios.append(d)
 
         return jsonify(desafios), 200
@@ -591,14 +577,10 @@ def detalhe_desafio(current_user_id, desafio_id):
             {"desafio_id": desafio_id, "avaliacao": {"$ne": None}},
             {"avaliacao": 1, "comentario": 1, "user_id": 1}
         ).sort("data_inscricao", -1).limit(5))
+        autores = carregar_resumos_usuarios(av.get("user_id") for av in avals)
         for av in avals:
-            try:
-                u2 = mongo_db["usuarios"].find_one(
-                    {"_id": ObjectId(av["user_id"])}, {"nome": 1}
-                )
-                av["nome_usuario"] = u2.get("nome", "Atleta") if u2 else "Atleta"
-            except Exception:
-                av["nome_usuario"] = "Atleta"
+            u2 = autores.get(av.get("user_id", ""))
+            av["nome_usuario"] = u2.get("nome", "Atleta") if u2 else "Atleta"
             av.pop("_id", None)
             av.pop("user_id", None)
         d["avaliacoes_recentes"] = avals
@@ -810,61 +792,106 @@ def enviar_mensagem(current_user_id, desafio_id):
             "remetente_nome": memoria.get("nome", "Atleta"),
             "remetente_tipo": "profissional" if is_profissional else "aluno",
             "texto":          texto,
+            "expira_em":      expiracao_mensagem_chat(),
         })
 
         mongo_db["chat_desafios"].insert_one(doc)
-        return jsonify({"sucesso": True}), 201
+        publicar(canal_desafio(desafio_id))
+        return jsonify({"sucesso": True, "id": str(doc["_id"])}), 201
 
     except Exception as e:
         logger.error(f"[PERF] Erro enviar_mensagem: {e}")
         return jsonify({"erro": str(e)}), 500
 
 
+# 'expira_em' é interno (índice TTL): não vai para o app
+_PROJECAO_CHAT_DESAFIO = {"expira_em": 0}
+
+
+def _filtro_chat_grupo(current_user_id: str, desafio_id: str):
+    """
+    Valida acesso ao chat de GRUPO e devolve (filtro, resposta_de_erro).
+    Compatível com documentos legados (tipo_mensagem="broadcast", sem campo canal).
+    """
+    desafio = mongo_db["desafios"].find_one({"_id": ObjectId(desafio_id)}, {"profissional_id": 1})
+    if not desafio:
+        return None, (jsonify([]), 200)
+
+    is_profissional = desafio.get("profissional_id") == current_user_id
+    if not is_profissional:
+        inscricao = mongo_db["inscricoes_desafio"].find_one({
+            "desafio_id": desafio_id,
+            "user_id": current_user_id,
+            "status_pagamento": "PAGO",
+        }, {"_id": 1})
+        if not inscricao:
+            return None, (jsonify({"erro": "Você precisa estar inscrito para ver mensagens"}), 403)
+
+    return {
+        "desafio_id": desafio_id,
+        "$or": [
+            {"canal": "grupo"},
+            {"tipo_mensagem": "broadcast", "canal": {"$exists": False}},
+        ],
+    }, None
+
+
 @performance_bp.route("/chat/<desafio_id>/mensagens", methods=["GET"])
 @_token_required
 def listar_mensagens(current_user_id, desafio_id):
     """
-    Retorna mensagens do chat de GRUPO.
+    Retorna mensagens do chat de GRUPO em ordem cronológica (padrão: as últimas 300).
     Profissional e alunos pagos veem todas as mensagens do grupo.
-    Compatível com documentos legados (tipo_mensagem="broadcast", sem campo canal).
+    Query: ?after=<id|ts> só as novas | ?before=<id|ts> histórico | ?limite=
     """
     try:
         if mongo_db is None or not ObjectId.is_valid(desafio_id):
             return jsonify([]), 200
 
-        desafio = mongo_db["desafios"].find_one({"_id": ObjectId(desafio_id)})
-        if not desafio:
-            return jsonify([]), 200
+        filtro, erro = _filtro_chat_grupo(current_user_id, desafio_id)
+        if erro:
+            return erro
 
-        is_profissional = desafio.get("profissional_id") == current_user_id
-        if not is_profissional:
-            inscricao = mongo_db["inscricoes_desafio"].find_one({
-                "desafio_id": desafio_id,
-                "user_id": current_user_id,
-                "status_pagamento": "PAGO",
-            })
-            if not inscricao:
-                return jsonify({"erro": "Você precisa estar inscrito para ver mensagens"}), 403
+        limite = min(max(1, request.args.get("limite", 300, type=int)), 300)
+        msgs = buscar_mensagens(
+            "chat_desafios", filtro, "enviada_em", limite,
+            after=request.args.get("after", ""), before=request.args.get("before", ""),
+            projecao=_PROJECAO_CHAT_DESAFIO
+        )
+        return jsonify(msgs), 200
 
-        # Documentos novos (canal="grupo") + legados (tipo_mensagem="broadcast" sem campo canal)
-        filtro = {
-            "desafio_id": desafio_id,
-            "$or": [
-                {"canal": "grupo"},
-                {"tipo_mensagem": "broadcast", "canal": {"$exists": False}},
-            ],
-        }
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    except Exception as e:
+        logger.error(f"[PERF] Erro listar_mensagens: {e}")
+        return jsonify([]), 200
+
+
+@performance_bp.route("/chat/<desafio_id>/mensagens/aguardar", methods=["GET"])
+@_token_required
+def aguardar_mensagens_grupo(current_user_id, desafio_id):
+    """Long-poll do chat de GRUPO: mensagens depois de ?after=<id>, ou [] após ~20s."""
+    try:
+        if mongo_db is None or not ObjectId.is_valid(desafio_id):
+            return jsonify([]), 200
+        after = request.args.get("after", "")
+        if not after:
+            return jsonify({"erro": "after é obrigatório"}), 400
 
-        cursor = mongo_db["chat_desafios"].find(filtro).sort("enviada_em", 1).limit(300)
-        msgs = []
-        for m in cursor:
-            m.pop("_id", None)
-            msgs.append(m)
+        filtro, erro = _filtro_chat_grupo(current_user_id, desafio_id)
+        if erro:
+            return erro
 
+        msgs = aguardar_mensagens(
+            "chat_desafios", filtro, "enviada_em", canal_desafio(desafio_id), after, 300,
+            projecao=_PROJECAO_CHAT_DESAFIO
+        )
         return jsonify(msgs), 200
 
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
     except Exception as e:
-        logger.error(f"[PERF] Erro listar_mensagens: {e}")
+        logger.error(f"[PERF] Erro aguardar_mensagens_grupo: {e}")
         return jsonify([]), 200
 
 
@@ -916,58 +943,107 @@ def enviar_mensagem_privada(current_user_id, desafio_id, aluno_id):
             "remetente_nome": memoria.get("nome", "Atleta"),
             "remetente_tipo": "profissional" if is_profissional else "aluno",
             "texto":          texto,
+            "expira_em":      expiracao_mensagem_chat(),
         })
 
         mongo_db["chat_desafios"].insert_one(doc)
-        return jsonify({"sucesso": True}), 201
+        publicar(canal_privado(desafio_id, dupla))
+        return jsonify({"sucesso": True, "id": str(doc["_id"])}), 201
 
     except Exception as e:
         logger.error(f"[PERF] Erro enviar_mensagem_privada: {e}")
         return jsonify({"erro": str(e)}), 500
 
 
+def _acesso_chat_privado(current_user_id: str, desafio_id: str, aluno_id: str):
+    """Valida acesso ao chat privado e devolve (filtro, outro_id, resposta_de_erro)."""
+    desafio = mongo_db["desafios"].find_one({"_id": ObjectId(desafio_id)}, {"profissional_id": 1})
+    if not desafio:
+        return None, None, (jsonify([]), 200)
+
+    profissional_id = desafio.get("profissional_id", "")
+    is_profissional = profissional_id == current_user_id
+    is_aluno        = current_user_id == aluno_id
+
+    if not is_profissional and not is_aluno:
+        return None, None, (jsonify({"erro": "Sem permissão para este chat"}), 403)
+
+    dupla  = _dupla_id(profissional_id, aluno_id)
+    filtro = {"canal": "privado", "desafio_id": desafio_id, "dupla_id": dupla}
+    outro_id = aluno_id if is_profissional else profissional_id
+    return filtro, outro_id, None
+
+
+def _marcar_lidas(filtro: dict, outro_id: str, msgs: list):
+    """Marca como lidas as mensagens recebidas que acabaram de ser entregues."""
+    ids = [ObjectId(m["id"]) for m in msgs if m.get("remetente_id") == outro_id and not m.get("lida")]
+    if ids:
+        mongo_db["chat_desafios"].update_many(
+            {**filtro, "_id": {"$in": ids}},
+            {"$set": {"lida": True}},
+        )
+
+
 @performance_bp.route("/chat/<desafio_id>/privado/<aluno_id>/mensagens", methods=["GET"])
 @_token_required
 def listar_mensagens_privadas(current_user_id, desafio_id, aluno_id):
     """
-    Retorna mensagens do chat privado entre profissional e um aluno específico.
+    Retorna mensagens do chat privado entre profissional e um aluno específico,
+    em ordem cronológica (padrão: as últimas 100).
     Acessível pelo profissional do desafio ou pelo próprio aluno.
+    Query: ?after=<id|ts> só as novas | ?before=<id|ts> histórico | ?limite=
     """
     try:
         if mongo_db is None or not ObjectId.is_valid(desafio_id):
             return jsonify([]), 200
 
-        desafio = mongo_db["desafios"].find_one({"_id": ObjectId(desafio_id)})
-        if not desafio:
-            return jsonify([]), 200
-
-        profissional_id = desafio.get("profissional_id", "")
-        is_profissional = profissional_id == current_user_id
-        is_aluno        = current_user_id == aluno_id
+        filtro, outro_id, erro = _acesso_chat_privado(current_user_id, desafio_id, aluno_id)
+        if erro:
+            return erro
 
-        if not is_profissional and not is_aluno:
-            return jsonify({"erro": "Sem permissão para este chat"}), 403
+        limite = min(max(1, request.args.get("limite", 100, type=int)), 100)
+        msgs = buscar_mensagens(
+            "chat_desafios", filtro, "enviada_em", limite,
+            after=request.args.get("after", ""), before=request.args.get("before", ""),
+            projecao=_PROJECAO_CHAT_DESAFIO
+        )
+        _marcar_lidas(filtro, outro_id, msgs)
+        return jsonify(msgs), 200
 
-        dupla  = _dupla_id(profissional_id, aluno_id)
-        filtro = {"canal": "privado", "desafio_id": desafio_id, "dupla_id": dupla}
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    except Exception as e:
+        logger.error(f"[PERF] Erro listar_mensagens_privadas: {e}")
+        return jsonify([]), 200
 
-        cursor = mongo_db["chat_desafios"].find(filtro).sort("enviada_em", 1).limit(100)
-        msgs = []
-        for m in cursor:
-            m.pop("_id", None)
-            msgs.append(m)
 
-        # Marca mensagens recebidas como lidas
-        outro_id = aluno_id if is_profissional else profissional_id
-        mongo_db["chat_desafios"].update_many(
-            {**filtro, "remetente_id": outro_id, "lida": False},
-            {"$set": {"lida": True}},
+@performance_bp.route("/chat/<desafio_id>/privado/<aluno_id>/mensagens/aguardar", methods=["GET"])
+@_token_required
+def aguardar_mensagens_privadas(current_user_id, desafio_id, aluno_id):
+    """Long-poll do chat privado: mensagens depois de ?after=<id>, ou [] após ~20s."""
+    try:
+        if mongo_db is None or not ObjectId.is_valid(desafio_id):
+            return jsonify([]), 200
+        after = request.args.get("after", "")
+        if not after:
+            return jsonify({"erro": "after é obrigatório"}), 400
+
+        filtro, outro_id, erro = _acesso_chat_privado(current_user_id, desafio_id, aluno_id)
+        if erro:
+            return erro
+
+        msgs = aguardar_mensagens(
+            "chat_desafios", filtro, "enviada_em",
+            canal_privado(desafio_id, filtro["dupla_id"]), after, 100,
+            projecao=_PROJECAO_CHAT_DESAFIO
         )
-
+        _marcar_lidas(filtro, outro_id, msgs)
         return jsonify(msgs), 200
 
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
     except Exception as e:
-        logger.error(f"[PERF] Erro listar_mensagens_privadas: {e}")
+        logger.error(f"[PERF] Erro aguardar_mensagens_privadas: {e}")
         return jsonify([]), 200
 
 
@@ -975,94 +1051,22 @@ def listar_mensagens_privadas(current_user_id, desafio_id, aluno_id):
 
 def limpar_mensagens_chat() -> tuple:
     """
-    Aplica os dois critérios de retenção independentemente por canal:
-      - Grupo:  máx 300 mensagens OU 30 dias por desafio_id
-      - Privado: máx 100 mensagens OU 30 dias por (desafio_id, dupla_id)
-    Retorna (total_grupo_deletadas, total_privado_deletadas).
+    Retenção dos chats (ver logic_retencao_chat): excedente por canal numa única
+    agregação + remoção em lote; os 30 dias ficam a cargo do índice TTL em 'expira_em'.
+      - Grupo:  máx CHAT_LIMITE_GRUPO (300) mensagens por desafio_id
+      - Privado: máx CHAT_LIMITE_PRIVADO (100) por (desafio_id, dupla_id)
+      - Clã:    máx CHAT_LIMITE_CLA (300) por cla_id
+    Retorna (total_desafios_deletadas, 0, total_cla_deletadas): grupo e privado
+    saem da mesma agregação em chat_desafios e são somados no primeiro campo.
     """
-    if mongo_db is None:
-        return 0, 0
-
-    limite_30d    = (datetime.now() - timedelta(days=30)).isoformat()
-    total_grupo   = 0
-    total_privado = 0
-
-    # ── GRUPO ────────────────────────────────────────────────────────────────
-    desafio_ids = mongo_db["chat_desafios"].distinct("desafio_id", {"canal": "grupo"})
-    for did in desafio_ids:
-        base = {"canal": "grupo", "desafio_id": did}
-
-        # 1. Critério de data (30 dias)
-        r = mongo_db["chat_desafios"].delete_many({**base, "enviada_em": {"$lt": limite_30d}})
-        total_grupo += r.deleted_count
-
-        # 2. Critério de contagem (300)
-        if mongo_db["chat_desafios"].count_documents(base) > 300:
-            cutoff = list(
-                mongo_db["chat_desafios"]
-                .find(base, {"enviada_em": 1})
-                .sort("enviada_em", -1)
-                .skip(300)
-                .limit(1)
-            )
-            if cutoff:
-                r2 = mongo_db["chat_desafios"].delete_many(
-                    {**base, "enviada_em": {"$lte": cutoff[0]["enviada_em"]}}
-                )
-                total_grupo += r2.deleted_count
-
-    # ── PRIVADO ──────────────────────────────────────────────────────────────
-    pares = list(mongo_db["chat_desafios"].aggregate([
-        {"$match": {"canal": "privado"}},
-        {"$group": {"_id": {"desafio_id": "$desafio_id", "dupla_id": "$dupla_id"}}},
-    ]))
-    for par in pares:
-        did  = par["_id"]["desafio_id"]
-        duid = par["_id"]["dupla_id"]
-        base = {"canal": "privado", "desafio_id": did, "dupla_id": duid}
-
-        # 1. Critério de data (30 dias)
-        r = mongo_db["chat_desafios"].delete_many({**base, "enviada_em": {"$lt": limite_30d}})
-        total_privado += r.deleted_count
-
-        # 2. Critério de contagem (100)
-        if mongo_db["chat_desafios"].count_documents(base) > 100:
-            cutoff = list(
-                mongo_db["chat_desafios"]
-                .find(base, {"enviada_em": 1})
-                .sort("enviada_em", -1)
-                .skip(100)
-                .limit(1)
-            )
-            if cutoff:
-                r2 = mongo_db["chat_desafios"].delete_many(
-                    {**base, "enviada_em": {"$lte": cutoff[0]["enviada_em"]}}
-                )
-                total_privado += r2.deleted_count
-
-    # ── CHAT_CLÃ ─────────────────────────────────────────────────────────────────
-    # Critérios: 300 msgs/clã OU 30 dias. Campo de data: created_at
-    cla_ids = mongo_db["chat_cla"].distinct("cla_id")
-    total_cla = 0
-    for cid in cla_ids:
-        base = {"cla_id": cid}
-        r = mongo_db["chat_cla"].delete_many({**base, "created_at": {"$lt": limite_30d}})
-        total_cla += r.deleted_count
-        if mongo_db["chat_cla"].count_documents(base) > 300:
-            cutoff = list(
-                mongo_db["chat_cla"]
-                .find(base, {"created_at": 1})
-                .sort("created_at", -1)
-                .skip(300)
-                .limit(1)
-            )
-            if cutoff:
-                r2 = mongo_db["chat_cla"].delete_many(
-                    {**base, "created_at": {"$lte": cutoff[0]["created_at"]}}
-                )
-                total_cla += r2.deleted_count
-
-    return total_grupo, total_privado, total_cla
+    relatorio = executar_retencao_chat()
+    desafios = relatorio.get("chat_desafios", {})
+    cla = relatorio.get("chat_cla", {})
+    return (
+        desafios.get("expiradas", 0) + desafios.get("excedentes", 0),
+        0,
+        cla.get("expiradas", 0) + cla.get("excedentes", 0),
+    )
 
 
 # ══════════════════════════════════════════════════════════════
@@ -1124,20 +1128,11 @@ def retomar_pagamento_desafio(current_user_id, inscricao_id):
         if not asaas_id:
             return jsonify({"erro": "Dados de pagamento não encontrados para esta inscrição"}), 404
 
-        headers = {
-            "Content-Type": "application/json",
-            "access_token": os.getenv("ASAAS_ACCESS_TOKEN", ""),
-        }
         metodo = inscricao.get("metodo_pagamento", "pix")
 
         if metodo == "pix":
-            resp = _requests.get(
-                f"https://www.asaas.com/api/v3/payments/{asaas_id}/pixQrCode",
-                headers=headers,
-                timeout=10,
-            )
-            if resp.status_code == 200:
-                qr = resp.json()
+            qr = obter_qrcode_pix(asaas_id)
+            if qr:
                 return jsonify({
                     "inscricao_id": inscricao_id,
                     "tipo": "pix",
@@ -1148,11 +1143,7 @@ def retomar_pagamento_desafio(current_user_id, inscricao_id):
             # QR vencido ou indisponível — cai no fallback abaixo
 
         # Cartão ou fallback de PIX sem QR: busca dados do pagamento para pegar invoiceUrl
-        resp2 = _requests.get(
-            f"https://www.asaas.com/api/v3/payments/{asaas_id}",
-            headers=headers,
-            timeout=10,
-        )
+        resp2 = asaas_request("GET", f"/payments/{asaas_id}")
         if resp2.status_code == 200:
             data = resp2.json()
             return jsonify({
@@ -1191,41 +1182,9 @@ def avaliar_desafio(current_user_id, inscricao_id):
             return jsonify({"erro": "Você já avaliou este desafio"}), 409
 
         comentario = str(dados.get("comentario", "")).strip()[:500]
-        mongo_db["inscricoes_desafio"].update_one(
-            {"_id": ObjectId(inscricao_id)},
-            {"$set": {"avaliacao": nota, "comentario": comentario}}
-        )
-
-        # Recalcula média do desafio
-        desafio_id = inscricao.get("desafio_id")
-        pipeline = [
-            {"$match": {"desafio_id": desafio_id, "avaliacao": {"$ne": None}}},
-            {"$group": {"_id": None, "media": {"$avg": "$avaliacao"}, "total": {"$sum": 1}}}
-        ]
-        res = list(mongo_db["inscricoes_desafio"].aggregate(pipeline))
-        if res:
-            media = round(res[0]["media"], 1)
-            total = res[0]["total"]
-            mongo_db["desafios"].update_one(
-                {"_id": ObjectId(desafio_id)},
-                {"$set": {"avaliacao_media": media, "total_avaliacoes": total}}
-            )
-            # Recalcula média do profissional
-            profissional_id = inscricao.get("profissional_id")
-            if profissional_id:
-                pipeline2 = [
-                    {"$match": {"profissional_id": profissional_id, "avaliacao": {"$ne": None}}},
-                    {"$group": {"_id": None, "media": {"$avg": "$avaliacao"}, "total": {"$sum": 1}}}
-                ]
-                res2 = list(mongo_db["inscricoes_desafio"].aggregate(pipeline2))
-                if res2:
-                    mongo_db["profissionais"].update_one(
-                        {"user_id": profissional_id},
-                        {"$set": {
-                            "avaliacao_media": round(res2[0]["media"], 1),
-                            "total_avaliacoes": res2[0]["total"],
-                        }}
-                    )
+        # Soma/contagem incrementais no desafio e no profissional (sem re-agregar o histórico)
+        if not registrar_avaliacao(inscricao, nota, comentario):
+            return jsonify({"erro": "Você já avaliou este desafio"}), 409
 
         return jsonify({"sucesso": True}), 200
 
@@ -1270,46 +1229,15 @@ def saude_do_aluno(current_user_id, aluno_id):
         if not aluno:
             return jsonify({"erro": "Aluno não encontrado"}), 404
 
-        # Mesma migração reversa usada em carregar_memoria(): preenche o subdocumento
-        # com os campos legados (peso_kg/altura_cm na raiz) se ele ainda não existir.
-        perfil_saude = aluno.get("perfil_saude") or {}
-        if not perfil_saude.get("peso_kg") and aluno.get("peso_kg") is not None:
-            perfil_saude["peso_kg"] = aluno.get("peso_kg")
-        if not perfil_saude.get("altura_cm") and aluno.get("altura_cm") is not None:
-            perfil_saude["altura_cm"] = aluno.get("altura_cm")
-
         # Dados derivados da coleção "atividades" (não duplicados no perfil_saude).
-        ha_7_dias = (datetime.now() - timedelta(days=7)).isoformat()
-        treinos_completados_total = mongo_db["atividades"].count_documents({
-            "user_id": aluno_id, "tipo": "Treino",
-        })
-        frequencia_treino_semanal = mongo_db["atividades"].count_documents({
-            "user_id": aluno_id, "tipo": "Treino",
-            "data_atividade": {"$gte": ha_7_dias},
-        })
-
-        def _campo_health(campo):
-            """Retorna o subdocumento {valor, fonte, sincronizado_em} ou None."""
-            v = perfil_saude.get(campo)
-            if isinstance(v, dict):
-                return v
-            return None
+        treinos = estatisticas_treino([aluno_id]).get(aluno_id, {})
 
         return jsonify({
             "aluno_id": aluno_id,
             "nome":     aluno.get("nome", "Atleta"),
-            "perfil_saude": {
-                "peso_kg":            perfil_saude.get("peso_kg"),
-                "altura_cm":          perfil_saude.get("altura_cm"),
-                "percentual_gordura": perfil_saude.get("percentual_gordura"),
-                "atualizado_em":      perfil_saude.get("atualizado_em", ""),
-                "fc_repouso":         _campo_health("fc_repouso"),
-                "passos_diarios":     _campo_health("passos_diarios"),
-                "calorias_ativas":    _campo_health("calorias_ativas"),
-                "sono_horas":         _campo_health("sono_horas"),
-            },
-            "frequencia_treino_semanal": frequencia_treino_semanal,
-            "treinos_completados_total": treinos_completados_total,
+            "perfil_saude": perfil_saude_aluno(aluno),
+            "frequencia_treino_semanal": treinos.get("semana", 0),
+            "treinos_completados_total": treinos.get("total", 0),
             "grant": {
                 "desafio_id":      grant.get("desafio_id"),
                 "data_concessao":  grant.get("data_concessao"),
@@ -1322,6 +1250,33 @@ def saude_do_aluno(current_user_id, aluno_id):
         return jsonify({"erro": str(e)}), 500
 
 
+@performance_bp.route("/alunos/coorte", methods=["GET"])
+@_token_required
+def coorte_saude(current_user_id):
+    """
+    Painel do profissional: todos os alunos com grant ativo numa única chamada.
+    ?ordenar=frequencia|total|nome|expiracao&pagina=1&por_pagina=50
+    """
+    try:
+        if mongo_db is None:
+            return jsonify({"erro": "Banco indisponível"}), 500
+
+        prof = _obter_profissional(current_user_id)
+        if not _assinatura_prof_ativa(prof):
+            return jsonify(_ERRO_ASSINATURA), 403
+
+        return jsonify(obter_coorte_saude(
+            current_user_id,
+            ordenar=request.args.get("ordenar", "frequencia"),
+            pagina=request.args.get("pagina", 1, type=int),
+            por_pagina=request.args.get("por_pagina", 50, type=int),
+        )), 200
+
+    except Exception as e:
+        logger.error(f"[PERF] Erro coorte_saude: {e}")
+        return jsonify({"erro": str(e)}), 500
+
+
 # ══════════════════════════════════════════════════════════════
 # ROTA DE PROGRESSO (aluno registra dia concluído)
 # ══════════════════════════════════════════════════════════════
@@ -2,9 +2,6 @@ import logging
 import os
 import secrets
 import concurrent.futures
-import requests
-import jwt
-from functools import wraps
 from datetime import datetime, timedelta
 from typing import Dict, Any
 from flask import request, jsonify, Blueprint
@@ -13,11 +10,34 @@ from pymongo.errors import DuplicateKeyError
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # --- IMPORTAÇÕES DA NOVA ARQUITETURA ---
+# JWT (emissão, verificação com cache e revogação) vive em auth_jwt.py, compartilhado com performance_bp
+from auth_jwt import gerar_token_jwt, token_required, token_do_request, revogar_token
+from logic_identidade import verificar_token_google, verificar_token_apple, ProvedorIndisponivel
 from data_user import carregar_memoria, salvar_memoria, gastar_moedas
 from data_manager import (
     obter_ranking_global, ler_plano, mongo_db,
-    buscar_usuario_por_email, criar_novo_usuario, atualizar_usuario
+    buscar_usuario_por_email, criar_novo_usuario, atualizar_usuario,
+    carregar_resumos_usuarios, atribuir_aura_code
 )
+from data_clas import (
+    obter_cargo, eh_membro, adicionar_membro, remover_membro, definir_cargo,
+    listar_membros, registrar_solicitacao, remover_solicitacao, listar_solicitacoes,
+    obter_ranking_clas, obter_posicao_cla, buscar_clas, invalidar_resumo_cla, nome_cla_em_uso,
+    CARGOS_LIDERANCA
+)
+from data_social import (
+    status_amizade, criar_pedido, responder_pedido, desfazer_amizade, listar_amigos_ids,
+    publicar_evento_social, obter_feed, obter_ranking_amigos,
+    obter_perfil_publico, incrementar_estatistica
+)
+from data_desafios import sincronizar_profissional_desafios
+from logic_chat import buscar_mensagens, aguardar_mensagens, publicar, canal_cla
+from logic_retencao_chat import expiracao_mensagem_chat
+from data_notificacoes import (
+    criar_notificacao, contar_nao_lidas, marcar_todas_lidas, recontar_nao_lidas,
+    listar_notificacoes as listar_notificacoes_usuario
+)
+from data_global import obter_pagina_ranking, obter_posicao_ranking, QUADROS_RANKING
 from logic_gamificacao import (
     gerar_missoes_diarias, aplicar_xp, normalizar_ofensiva,
     registrar_conclusao_missao, ativar_seguro_ofensiva
@@ -25,7 +45,8 @@ from logic_gamificacao import (
 from logic_equilibrio import calcular_e_atualizar_equilibrio
 from logic import processar_comando, processar_comando_com_imagem
 from logic_feedback import gerar_feedback_emocional
-from logic_asaas import criar_cobranca
+from logic_asaas import criar_cobranca, obter_qrcode_pix
+from logic_pagamentos import registrar_evento as registrar_evento_pagamento, EVENTOS_ASAAS_PAGO
 
 # [AURA LOGISTICS] Importação do novo serviço de frete
 from logic_frete import calcular_cotacao_frete
@@ -36,55 +57,6 @@ logger = logging.getLogger("AURA_API_ROTAS")
 # [AURA FIX 404] Blueprint SEM prefixo interno para não duplicar com o registro no app.py
 api_bp = Blueprint('api_bp', __name__)
 
-# ===================================================
-# 🔐 JWT — CONFIGURAÇÃO E HELPERS
-# ===================================================
-
-JWT_SECRET    = os.getenv("JWT_SECRET", "aura-mude-esta-chave-em-producao")
-JWT_ALGORITHM = "HS256"
-JWT_EXP_DAYS  = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES_DAYS", 30))
-
-def gerar_token_jwt(user_id: str) -> str:
-    """Gera um token JWT assinado. Validade lida de JWT_ACCESS_TOKEN_EXPIRES_DAYS no .env."""
-    payload = {
-        "user_id": str(user_id),
-        "iat": datetime.utcnow(),
-        "exp": datetime.utcnow() + timedelta(days=JWT_EXP_DAYS)
-    }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
-
-# ===================================================
-# 🔐 MIDDLEWARE DE AUTENTICAÇÃO (JWT NATIVO)
-# ===================================================
-
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({"erro": "Token mal formatado"}), 401
-
-        if not token:
-            return jsonify({"erro": "Token ausente"}), 401
-
-        try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            current_user_id = payload.get("user_id")
-            if not current_user_id:
-                return jsonify({"erro": "Token inválido: user_id ausente"}), 401
-        except jwt.ExpiredSignatureError:
-            return jsonify({"erro": "Sessão expirada. Faça login novamente."}), 401
-        except jwt.InvalidTokenError:
-            # Token inválido ou adulterado — rejeita sem fallback
-            return jsonify({"erro": "Token inválido. Faça login novamente."}), 401
-
-        return f(current_user_id, *args, **kwargs)
-    return decorated
-
 # ===================================================
 # 🔐 AUTENTICAÇÃO NATIVA — REGISTER / LOGIN / SOCIAL
 # ===================================================
@@ -116,49 +88,28 @@ def auth_social():
         email         = None
         nome_provedor = ''
 
-        # ── Verificação Google ──────────────────────────────────────────
+        # ── Verificação Google (local, JWKS em cache; tokeninfo só sem chave) ──
         if provider == 'google':
-            resp = requests.get(
-                "https://oauth2.googleapis.com/tokeninfo",
-                params={"id_token": token_social},
-                timeout=10
-            )
-            if resp.status_code != 200:
-                logger.warning(f"Google tokeninfo rejeitou: {resp.text[:200]}")
+            try:
+                info = verificar_token_google(token_social)
+            except ValueError as e:
+                logger.warning(f"Token Google rejeitado: {e}")
                 return jsonify({"erro": "Token Google inválido"}), 401
-            info = resp.json()
             email         = info.get('email', '').strip().lower()
             nome_provedor = info.get('name', '') or info.get('given_name', '')
 
-        # ── Verificação Apple ───────────────────────────────────────────
+        # ── Verificação Apple (local, JWKS em cache) ────────────────────
         elif provider == 'apple':
             try:
-                from jose import jwt as jose_jwt
-
-                keys_resp = requests.get("https://appleid.apple.com/auth/keys", timeout=10)
-                if keys_resp.status_code != 200:
-                    return jsonify({"erro": "Falha ao buscar chaves Apple"}), 502
-                apple_keys = keys_resp.json().get('keys', [])
-
-                header = jose_jwt.get_unverified_header(token_social)
-                kid    = header.get('kid')
-                key    = next((k for k in apple_keys if k.get('kid') == kid), None)
-                if not key:
-                    return jsonify({"erro": "Chave pública Apple não encontrada"}), 401
-
-                payload = jose_jwt.decode(
-                    token_social,
-                    key,
-                    algorithms=['RS256'],
-                    issuer='https://appleid.apple.com',
-                    options={"verify_aud": False}
-                )
-                email = payload.get('email', '').strip().lower()
-                # Apple fornece nome apenas no primeiro login (via frontend)
-                nome_provedor = ''
-            except Exception as e:
+                payload = verificar_token_apple(token_social)
+            except ProvedorIndisponivel:
+                return jsonify({"erro": "Falha ao buscar chaves Apple"}), 502
+            except ValueError as e:
                 logger.error(f"Verificação Apple falhou: {e}")
                 return jsonify({"erro": "Token Apple inválido"}), 401
+            email = payload.get('email', '').strip().lower()
+            # Apple fornece nome apenas no primeiro login (via frontend)
+            nome_provedor = ''
 
         if not email:
             return jsonify({"erro": "E-mail não disponível no token do provedor"}), 400
@@ -370,6 +321,19 @@ def _html_confirmacao_compra(nome: str, valor_total: float, itens: list) -> str:
     """
 
 
+@api_bp.route('/auth/logout', methods=['POST'])
+@token_required
+def logout(current_user_id):
+    """Revoga o token atual (deny-list até o 'exp'). O app descarta o token localmente."""
+    try:
+        revogar_token(token_do_request())
+        logger.info(f"👋 Logout: token revogado para {current_user_id}")
+        return jsonify({"sucesso": True}), 200
+    except Exception as e:
+        logger.error(f"Erro no logout de {current_user_id}: {e}")
+        return jsonify({"erro": str(e)}), 500
+
+
 @api_bp.route('/auth/forgot-password', methods=['POST', 'OPTIONS'])
 def forgot_password():
     if request.method == 'OPTIONS':
@@ -953,6 +917,8 @@ def atualizar_biometria(current_user_id):
 
         sucesso = salvar_memoria(current_user_id, update_payload)
         logger.info(f"Biometria/Perfil atualizado para {current_user_id}: {list(update_payload.keys())}")
+        if update_payload.keys() & {"nome", "foto_perfil"}:
+            sincronizar_profissional_desafios(current_user_id)
         return jsonify({"sucesso": sucesso})
     except Exception as e:
         logger.error(f"Erro ao atualizar biometria/auth para {current_user_id}: {e}")
@@ -1049,6 +1015,8 @@ def configurar_onboarding(current_user_id):
 
         sucesso = salvar_memoria(current_user_id, update_payload)
         logger.info(f"Onboarding concluído para {current_user_id}")
+        if update_payload.keys() & {"nome", "foto_perfil"}:
+            sincronizar_profissional_desafios(current_user_id)
         return jsonify({"sucesso": sucesso, "onboarding_completo": True})
     except Exception as e:
         logger.error(f"Erro ao configurar onboarding para {current_user_id}: {e}")
@@ -1071,6 +1039,63 @@ def get_ranking_cla(current_user_id):
         return jsonify({"ranking": []})
 
 
+@api_bp.route('/ranking', methods=['GET'])
+@token_required
+def get_ranking_paginado(current_user_id):
+    """
+    Ranking materializado (geral | semanal | mensal) com paginação por cursor.
+    Query: ?quadro=geral&apos=<posicao da última linha recebida>&limite=50
+    Sempre inclui 'minha_posicao' do usuário autenticado, mesmo fora do top.
+    """
+    try:
+        quadro = request.args.get("quadro", "geral")
+        if quadro not in QUADROS_RANKING:
+            return jsonify({"erro": f"Quadro inválido. Use: {', '.join(QUADROS_RANKING)}"}), 400
+        try:
+            apos = int(request.args.get("apos", 0))
+            limite = int(request.args.get("limite", 50))
+        except ValueError:
+            return jsonify({"erro": "Parâmetros de paginação inválidos"}), 400
+
+        pagina = obter_pagina_ranking(quadro, apos, limite)
+        pagina["quadro"] = quadro
+        pagina["minha_posicao"] = obter_posicao_ranking(current_user_id, quadro)
+        return jsonify(pagina), 200
+    except Exception as e:
+        logger.error(f"Erro ao buscar ranking paginado: {e}")
+        return jsonify({"ranking": [], "proximo": None, "minha_posicao": None}), 200
+
+
+@api_bp.route('/cla/ranking/clas', methods=['GET'])
+@token_required
+def get_ranking_clas(current_user_id):
+    """
+    Ranking clã x clã por total_xp (mantido via $inc a cada XP ganho).
+    Query: ?pagina=1&por_pagina=20. Inclui 'meu_cla' com a posição do clã do usuário.
+    """
+    try:
+        try:
+            pagina = int(request.args.get("pagina", 1))
+            por_pagina = int(request.args.get("por_pagina", 20))
+        except ValueError:
+            return jsonify({"erro": "Parâmetros de paginação inválidos"}), 400
+
+        meu_cla = None
+        if mongo_db is not None and ObjectId.is_valid(current_user_id):
+            user_doc = mongo_db["usuarios"].find_one({"_id": ObjectId(current_user_id)}, {"cla_atual_id": 1}) or {}
+            if user_doc.get("cla_atual_id"):
+                meu_cla = obter_posicao_cla(user_doc["cla_atual_id"])
+
+        return jsonify({
+            "clas":       obter_ranking_clas(pagina, por_pagina),
+            "pagina":     max(1, pagina),
+            "meu_cla":    meu_cla,
+        }), 200
+    except Exception as e:
+        logger.error(f"Erro ao buscar ranking de clãs: {e}")
+        return jsonify({"clas": [], "pagina": 1, "meu_cla": None}), 200
+
+
 @api_bp.route('/cla/criar', methods=['POST'])
 @token_required
 def criar_cla(current_user_id):
@@ -1084,11 +1109,6 @@ def criar_cla(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco de dados indisponível"}), 500
 
-        # Garante unicidade do nome (case-insensitive)
-        existente = mongo_db["Clas"].find_one({"nome": {"$regex": f"^{nome}$", "$options": "i"}})
-        if existente:
-            return jsonify({"erro": "Já existe um clã com esse nome"}), 409
-
         tipo_cla = str(dados.get("tipo", "aberto")).strip().lower()
         if tipo_cla not in ("aberto", "fechado"):
             tipo_cla = "aberto"
@@ -1102,13 +1122,7 @@ def criar_cla(current_user_id):
             "tags":               list(dados.get("tags", [])),
             "tipo":               tipo_cla,
             "lider_id":           current_user_id,
-            "membros": [{
-                "user_id":        current_user_id,
-                "cargo":          "owner",
-                "xp_contribuicao": 0,
-                "joined_at":      agora
-            }],
-            "solicitacoes_pendentes": [],
+            "num_membros":        0,
             "nivel":              1,
             "total_xp":           0,
             "missao_ativa_tipo":  (dados.get("tags") or ["Híbrido"])[0].split(" ")[0] if dados.get("tags") else "Híbrido",
@@ -1119,8 +1133,17 @@ def criar_cla(current_user_id):
             "updated_at":         agora
         }
 
-        resultado = mongo_db["Clas"].insert_one(doc_cla)
+        # Unicidade do nome garantida pelo índice único com collation (sem maiúsculas/acentos)
+        if nome_cla_em_uso(nome):
+            return jsonify({"erro": "Já existe um clã com esse nome"}), 409
+        try:
+            resultado = mongo_db["Clas"].insert_one(doc_cla)
+        except DuplicateKeyError:
+            return jsonify({"erro": "Já existe um clã com esse nome"}), 409
         cla_id = str(resultado.inserted_id)
+        adicionar_membro(cla_id, current_user_id, cargo="owner")
+        doc_cla["num_membros"] = 1
+        doc_cla["membros"] = listar_membros(cla_id)
 
         # Atualiza o usuário com o ID do clã recém criado
         salvar_memoria(current_user_id, {"cla_atual_id": cla_id})
@@ -1145,13 +1168,12 @@ def listar_clas():
         cursor = mongo_db["Clas"].find(
             {"ativo": True},
             {"_id": 1, "nome": 1, "descricao": 1, "emblema": 1, "cor": 1,
-             "tags": 1, "nivel": 1, "total_xp": 1, "membros": 1, "tipo": 1}
+             "tags": 1, "nivel": 1, "total_xp": 1, "num_membros": 1, "tipo": 1}
         ).sort("total_xp", -1).limit(50)
         clans = []
         for d in cursor:
             d["id"] = str(d.pop("_id"))
-            d["num_membros"] = len(d.get("membros", []))
-            d.pop("membros", None)
+            d.setdefault("num_membros", 0)
             d.setdefault("tipo", "aberto")
             clans.append(d)
         return jsonify(clans), 200
@@ -1160,6 +1182,22 @@ def listar_clas():
         return jsonify({"erro": "Falha ao buscar clãs. Tente novamente."}), 500
 
 
+@api_bp.route('/cla/buscar', methods=['GET'])
+def buscar_clas_rota():
+    """Busca clãs ativos por prefixo do nome (?q=) e/ou tag (?tag=). Público."""
+    try:
+        q = request.args.get("q", "").strip()
+        tag = request.args.get("tag", "").strip()
+        if not q and not tag:
+            return jsonify({"erro": "Informe q ou tag"}), 400
+        if mongo_db is None:
+            return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente."}), 503
+        return jsonify(buscar_clas(q, tag, request.args.get("limite", 20, type=int))), 200
+    except Exception as e:
+        logger.error(f"Erro ao buscar clãs: {e}")
+        return jsonify({"erro": "Falha ao buscar clãs. Tente novamente."}), 500
+
+
 @api_bp.route('/cla/entrar', methods=['POST'])
 @token_required
 def entrar_cla(current_user_id):
@@ -1172,13 +1210,12 @@ def entrar_cla(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
 
-        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id), "ativo": True})
+        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id), "ativo": True}, {"tipo": 1})
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        # Verifica se já é membro
-        membros = cla.get("membros", [])
-        if any(m["user_id"] == current_user_id for m in membros):
+        # Verifica se já é membro (point query em cla_membros)
+        if eh_membro(cla_id, current_user_id):
             salvar_memoria(current_user_id, {"cla_atual_id": cla_id})
             logger.info(f"[CLA] Re-sincronizando cla_atual_id para usuário {current_user_id} no clã {cla_id}")
             return jsonify({"sucesso": True, "ja_membro": True}), 200
@@ -1187,34 +1224,15 @@ def entrar_cla(current_user_id):
 
         # Clã fechado → adiciona solicitação pendente em vez de entrar direto
         if tipo_cla == "fechado":
-            solicitacoes = cla.get("solicitacoes_pendentes", [])
-            if any(s["user_id"] == current_user_id for s in solicitacoes):
-                return jsonify({"status": "solicitacao_enviada", "ja_solicitado": True}), 200
-
             user_data = carregar_memoria(current_user_id) or {}
-            mongo_db["Clas"].update_one(
-                {"_id": ObjectId(cla_id)},
-                {"$push": {"solicitacoes_pendentes": {
-                    "user_id":      current_user_id,
-                    "nome":         user_data.get("nome", "Atleta"),
-                    "nivel":        user_data.get("nivel", 1),
-                    "solicitado_em": datetime.now().isoformat()
-                }}}
-            )
+            if not registrar_solicitacao(cla_id, current_user_id,
+                                         user_data.get("nome", "Atleta"), user_data.get("nivel", 1)):
+                return jsonify({"status": "solicitacao_enviada", "ja_solicitado": True}), 200
             logger.info(f"[CLA] Solicitação de entrada enviada por {current_user_id} para clã fechado {cla_id}")
             return jsonify({"status": "solicitacao_enviada"}), 200
 
         # Clã aberto → entra diretamente
-        agora = datetime.now().isoformat()
-        mongo_db["Clas"].update_one(
-            {"_id": ObjectId(cla_id)},
-            {"$push": {"membros": {
-                "user_id": current_user_id,
-                "cargo": "member",
-                "xp_contribuicao": 0,
-                "joined_at": agora
-            }}, "$set": {"updated_at": agora}}
-        )
+        adicionar_membro(cla_id, current_user_id)
         salvar_memoria(current_user_id, {"cla_atual_id": cla_id})
         return jsonify({"sucesso": True}), 200
     except Exception as e:
@@ -1232,16 +1250,14 @@ def listar_solicitacoes_cla(current_user_id, cla_id):
         if not ObjectId.is_valid(cla_id):
             return jsonify({"erro": "ID do clã inválido"}), 400
 
-        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id), "ativo": True})
+        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id), "ativo": True}, {"_id": 1})
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        membros = cla.get("membros", [])
-        meu_cargo = next((m.get("cargo") for m in membros if m["user_id"] == current_user_id), None)
-        if meu_cargo not in ("owner", "co-leader"):
+        if obter_cargo(cla_id, current_user_id) not in CARGOS_LIDERANCA:
             return jsonify({"erro": "Apenas líderes podem ver as solicitações"}), 403
 
-        return jsonify({"solicitacoes": cla.get("solicitacoes_pendentes", [])}), 200
+        return jsonify({"solicitacoes": listar_solicitacoes(cla_id)}), 200
     except Exception as e:
         logger.error(f"Erro ao listar solicitações do clã {cla_id}: {e}")
         return jsonify({"erro": str(e)}), 500
@@ -1264,38 +1280,21 @@ def responder_solicitacao_cla(current_user_id, cla_id):
         if not solicitante_id:
             return jsonify({"erro": "user_id é obrigatório"}), 400
 
-        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id), "ativo": True})
+        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id), "ativo": True}, {"_id": 1})
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        membros = cla.get("membros", [])
-        meu_cargo = next((m.get("cargo") for m in membros if m["user_id"] == current_user_id), None)
-        if meu_cargo not in ("owner", "co-leader"):
+        if obter_cargo(cla_id, current_user_id) not in CARGOS_LIDERANCA:
             return jsonify({"erro": "Apenas líderes podem responder solicitações"}), 403
 
-        # Remove da lista de solicitações em qualquer caso
-        mongo_db["Clas"].update_one(
-            {"_id": ObjectId(cla_id)},
-            {"$pull": {"solicitacoes_pendentes": {"user_id": solicitante_id}}}
-        )
-
         if aceitar:
-            # Verifica que ainda não é membro
-            if not any(m["user_id"] == solicitante_id for m in membros):
-                agora = datetime.now().isoformat()
-                mongo_db["Clas"].update_one(
-                    {"_id": ObjectId(cla_id)},
-                    {"$push": {"membros": {
-                        "user_id": solicitante_id,
-                        "cargo": "member",
-                        "xp_contribuicao": 0,
-                        "joined_at": agora
-                    }}, "$set": {"updated_at": agora}}
-                )
+            # Promove a solicitação a membro (no-op se já for membro)
+            if adicionar_membro(cla_id, solicitante_id):
                 salvar_memoria(solicitante_id, {"cla_atual_id": cla_id})
                 logger.info(f"[CLA] Solicitação de {solicitante_id} aceita no clã {cla_id} por {current_user_id}")
             return jsonify({"sucesso": True, "acao": "aceito"}), 200
         else:
+            remover_solicitacao(cla_id, solicitante_id)
             logger.info(f"[CLA] Solicitação de {solicitante_id} recusada no clã {cla_id} por {current_user_id}")
             return jsonify({"sucesso": True, "acao": "recusado"}), 200
 
@@ -1316,12 +1315,7 @@ def sair_cla(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
 
-        agora = datetime.now().isoformat()
-        mongo_db["Clas"].update_one(
-            {"_id": ObjectId(cla_id)},
-            {"$pull": {"membros": {"user_id": current_user_id}},
-             "$set": {"updated_at": agora}}
-        )
+        remover_membro(cla_id, current_user_id)
         salvar_memoria(current_user_id, {"cla_atual_id": None})
         return jsonify({"sucesso": True}), 200
     except Exception as e:
@@ -1347,10 +1341,13 @@ def enviar_chat_cla(current_user_id):
             "user_id":   current_user_id,
             "user_name": str(dados.get("user_name", "Membro")),
             "message":   message,
-            "created_at": datetime.now().isoformat()
+            "created_at": datetime.now().isoformat(),
+            "expira_em": expiracao_mensagem_chat(),
         }
         mongo_db["chat_cla"].insert_one(doc_msg)
+        publicar(canal_cla(cla_id))
         doc_msg["id"] = str(doc_msg.pop("_id"))
+        doc_msg.pop("expira_em", None)
         return jsonify(doc_msg), 201
     except Exception as e:
         logger.error(f"Erro no chat do clã: {e}")
@@ -1369,6 +1366,9 @@ def get_cla(current_user_id, cla_id):
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
         cla["id"] = str(cla.pop("_id"))
+        # Compatibilidade com o frontend: 'membros' agora vem de cla_membros
+        cla["membros"] = listar_membros(cla["id"])
+        cla.setdefault("num_membros", len(cla["membros"]))
         return jsonify(cla), 200
     except Exception as e:
         logger.error(f"Erro ao buscar clã {cla_id}: {e}")
@@ -1385,20 +1385,16 @@ def get_membros_cla(current_user_id, cla_id):
         if mongo_db is None:
             logger.error(f"❌ get_membros_cla: mongo_db indisponível para clã {cla_id}")
             return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente."}), 503
-        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id)}, {"membros": 1})
+        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id)}, {"_id": 1})
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        membros_raw = cla.get("membros", [])
+        membros_raw = listar_membros(cla_id)
+        usuarios = carregar_resumos_usuarios(m.get("user_id", "") for m in membros_raw)
         membros_out = []
         for m in membros_raw:
             uid = m.get("user_id", "")
-            user_doc = {}
-            if ObjectId.is_valid(uid):
-                user_doc = mongo_db["usuarios"].find_one(
-                    {"_id": ObjectId(uid)},
-                    {"nome": 1, "nivel": 1, "foto_perfil": 1, "xp_total": 1}
-                ) or {}
+            user_doc = usuarios.get(uid, {})
             cargo_key = m.get("cargo", "member")
             membros_out.append({
                 "id":       uid,
@@ -1423,28 +1419,59 @@ def get_membros_cla(current_user_id, cla_id):
         return jsonify({"erro": "Falha ao buscar membros. Tente novamente."}), 500
 
 
+_PROJECAO_CHAT_CLA = {"_id": 1, "cla_id": 1, "user_id": 1, "user_name": 1, "message": 1, "created_at": 1}
+
+
 @api_bp.route('/cla/<cla_id>/chat', methods=['GET'])
 @token_required
 def get_chat_cla(current_user_id, cla_id):
-    """Retorna as últimas 100 mensagens do chat do clã."""
+    """
+    Mensagens do chat do clã em ordem cronológica (padrão: as últimas 100).
+    Query: ?after=<id|ts> só as novas (polling incremental) | ?before=<id|ts> histórico | ?limite=
+    """
     try:
         if mongo_db is None:
             logger.error(f"❌ get_chat_cla: mongo_db indisponível para clã {cla_id}")
             return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente."}), 503
-        cursor = mongo_db["chat_cla"].find(
-            {"cla_id": cla_id},
-            {"_id": 1, "cla_id": 1, "user_id": 1, "user_name": 1, "message": 1, "created_at": 1}
-        ).sort("created_at", 1).limit(100)
-        msgs = []
-        for m in cursor:
-            m["id"] = str(m.pop("_id"))
-            msgs.append(m)
+        limite = min(max(1, request.args.get("limite", 100, type=int)), 100)
+        msgs = buscar_mensagens(
+            "chat_cla", {"cla_id": cla_id}, "created_at", limite,
+            after=request.args.get("after", ""), before=request.args.get("before", ""),
+            projecao=_PROJECAO_CHAT_CLA
+        )
         return jsonify(msgs), 200
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
     except Exception as e:
         logger.error(f"Erro ao buscar chat do clã {cla_id}: {e}")
         return jsonify({"erro": "Falha ao carregar chat. Tente novamente."}), 500
 
 
+@api_bp.route('/cla/<cla_id>/chat/aguardar', methods=['GET'])
+@token_required
+def aguardar_chat_cla(current_user_id, cla_id):
+    """
+    Long-poll do chat do clã: responde assim que chegar mensagem depois de ?after=<id>
+    ou com [] após ~20s. O app chama de novo em seguida com o último id recebido.
+    """
+    try:
+        if mongo_db is None:
+            return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente."}), 503
+        after = request.args.get("after", "")
+        if not after:
+            return jsonify({"erro": "after é obrigatório"}), 400
+        msgs = aguardar_mensagens(
+            "chat_cla", {"cla_id": cla_id}, "created_at", canal_cla(cla_id), after, 100,
+            projecao=_PROJECAO_CHAT_CLA
+        )
+        return jsonify(msgs), 200
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Erro no long-poll do chat do clã {cla_id}: {e}")
+        return jsonify([]), 200
+
+
 # ===================================================
 # 🧠 COMANDO DO MESTRE (IA HÍBRIDA)
 # ===================================================
@@ -1543,8 +1570,10 @@ def concluir_missao(current_user_id):
             m["progresso_pct"] = 100
             salvar_memoria(current_user_id, memoria)
 
-            resultado = aplicar_xp(current_user_id, m.get("xp", 0))
+            resultado = aplicar_xp(current_user_id, m.get("xp", 0), origem="missao")
             dados_ofensiva = registrar_conclusao_missao(current_user_id)
+            incrementar_estatistica(current_user_id, "missoes")
+            publicar_evento_social(current_user_id, "missao", m.get("titulo", "Missão Diária"), m.get("xp", 0))
             return jsonify({
                 "sucesso": True,
                 "xp_ganho":       m.get("xp", 0),
@@ -1632,6 +1661,7 @@ def webhook_revenuecat():
     """
     Webhook oficial para o RevenueCat.
     Verifica o header Authorization se REVENUECAT_WEBHOOK_SECRET estiver definido.
+    Reenvios do mesmo evento (event.id) são confirmados sem reaplicar efeitos.
     """
     # Verificação de assinatura RevenueCat (Bearer token no header Authorization)
     if _RC_WEBHOOK_SECRET:
@@ -1642,69 +1672,15 @@ def webhook_revenuecat():
             return jsonify({"erro": "Forbidden"}), 403
 
     try:
-        dados = request.get_json(force=True)
-        evento = dados.get("event", {})
-        tipo = evento.get("type")
-        app_user_id = evento.get("app_user_id") # Este é o aura_user_id do Base44
-
-        if not app_user_id:
+        if mongo_db is None:
+            return jsonify({"erro": "Banco indisponível"}), 500
+        dados = request.get_json(force=True) or {}
+        if not (dados.get("event") or {}).get("app_user_id"):
             return jsonify({"status": "ignorado", "motivo": "sem app_user_id"}), 200
 
-        product_id = evento.get("product_id", "").lower()
-        agora_iso  = datetime.now().isoformat()
-
-        # ── Assinatura de PROFISSIONAL (aura_profissional_mensal) ──────────────
-        if "profissional" in product_id:
-            if tipo in ["INITIAL_PURCHASE", "RENEWAL", "SUBSCRIBER_ALIAS"]:
-                expira = (datetime.now() + timedelta(days=32)).isoformat()
-                mongo_db["profissionais"].update_one(
-                    {"user_id": app_user_id},
-                    {"$set": {
-                        "plano_ativo":  True,
-                        "trial_ativo":  False,   # primeira IAP confirma saída do trial
-                        "plano_expira": expira,
-                        "updated_at":   agora_iso,
-                    }}
-                )
-                logger.info(f"💰 [PERF] Assinatura profissional ATIVADA para {app_user_id} até {expira}")
-            elif tipo in ["CANCELLATION", "EXPIRATION"]:
-                mongo_db["profissionais"].update_one(
-                    {"user_id": app_user_id},
-                    {"$set": {"plano_ativo": False, "updated_at": agora_iso}}
-                )
-                logger.info(f"🚫 [PERF] Assinatura profissional CANCELADA/EXPIRADA para {app_user_id}")
-            return jsonify({"status": "recebido"}), 200
-
-        # ── Assinatura de USUÁRIO COMUM (plus / pro) ───────────────────────────
-        novo_plano = "pro" if "pro" in product_id else "plus"
-
-        # 1. Compra ou Renovação com sucesso
-        if tipo in ["INITIAL_PURCHASE", "RENEWAL", "SUBSCRIBER_ALIAS"]:
-            vencimento = (datetime.now() + timedelta(days=32)).isoformat()
-            mongo_db["usuarios"].update_one(
-                {"_id": ObjectId(app_user_id)},
-                {"$set": {
-                    "plano": novo_plano,
-                    "status_assinatura": "ativo",
-                    "data_vencimento": vencimento,
-                    "updated_at": agora_iso,
-                }}
-            )
-            logger.info(f"💰 Assinatura {novo_plano} ATIVADA para o usuário {app_user_id}")
-
-        # 2. Cancelamento ou Expiração
-        elif tipo in ["CANCELLATION", "EXPIRATION"]:
-            mongo_db["usuarios"].update_one(
-                {"_id": ObjectId(app_user_id)},
-                {"$set": {
-                    "plano": "free",
-                    "status_assinatura": "expirado",
-                    "updated_at": agora_iso,
-                }}
-            )
-            logger.info(f"🚫 Assinatura FINALIZADA para o usuário {app_user_id}")
-
-        return jsonify({"status": "recebido"}), 200
+        # Grava e confirma; os efeitos são aplicados fora do request (logic_pagamentos)
+        novo = registrar_evento_pagamento("revenuecat", dados)
+        return jsonify({"status": "recebido" if novo else "duplicado"}), 200
     except Exception as e:
         logger.error(f"Erro no Webhook RevenueCat: {e}")
         return jsonify({"erro": "Erro interno no processamento do webhook"}), 500
@@ -1723,20 +1699,12 @@ def criar_pagamento(current_user_id):
 @api_bp.route('/pagamento/pix/qrcode/<asaas_id>', methods=['GET'])
 @token_required
 def buscar_qrcode_pix(current_user_id, asaas_id):
-    """Busca o QR Code PIX de um pagamento Asaas pelo seu ID."""
+    """Busca o QR Code PIX de um pagamento Asaas pelo seu ID (cache em pix_qrcodes)."""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "access_token": os.getenv("ASAAS_ACCESS_TOKEN", "")
-        }
-        resp = requests.get(
-            f"https://www.asaas.com/api/v3/payments/{asaas_id}/pixQrCode",
-            headers=headers,
-            timeout=10
-        )
-        if resp.status_code == 200:
-            return jsonify(resp.json()), 200
-        logger.warning(f"Asaas QR Code não disponível para {asaas_id}: {resp.status_code}")
+        qr = obter_qrcode_pix(asaas_id)
+        if qr:
+            return jsonify(qr), 200
+        logger.warning(f"Asaas QR Code não disponível para {asaas_id}")
         return jsonify({"erro": "QR Code não disponível para este pagamento."}), 404
     except Exception as e:
         logger.error(f"Erro ao buscar QR Code Asaas: {e}")
@@ -1856,8 +1824,10 @@ def _tentar_completar_missao_auto(user_id: str, tipo_atividade: str, duracao_str
             m["progresso_pct"] = 100
             salvar_memoria(user_id, memoria)
 
-            resultado_missao = aplicar_xp(user_id, m.get("xp", 0))
+            resultado_missao = aplicar_xp(user_id, m.get("xp", 0), origem="missao")
             dados_ofensiva = registrar_conclusao_missao(user_id)
+            incrementar_estatistica(user_id, "missoes")
+            publicar_evento_social(user_id, "missao", m.get("titulo", "Missão Diária"), m.get("xp", 0))
 
             completada = {
                 "nome":          m.get("titulo", "Missão Diária"),
@@ -1910,11 +1880,15 @@ def registrar_atividade(current_user_id):
         if mongo_db is None:
             logger.error(f"❌ registrar_atividade bloqueado: mongo_db indisponível para {current_user_id}")
             return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente em instantes."}), 503
-        mongo_db["atividades"].insert_one(doc_atividade)
+        ins_atividade = mongo_db["atividades"].insert_one(doc_atividade)
+        incrementar_estatistica(current_user_id, "atividades")
 
         resultado_xp = {}
         if xp_atividade > 0:
-            resultado_xp = aplicar_xp(current_user_id, xp_atividade)
+            resultado_xp = aplicar_xp(current_user_id, xp_atividade, origem="atividade",
+                                      chave_ledger=f"atividade:{ins_atividade.inserted_id}")
+        publicar_evento_social(current_user_id, "atividade", doc_atividade["titulo"], xp_atividade,
+                               tipo_atividade=doc_atividade["tipo"])
 
         # Tenta completar automaticamente uma missão diária correspondente
         tipo_atividade = dados.get("tipo", "")
@@ -2043,18 +2017,8 @@ def rota_cotar_frete(current_user_id):
 # ===================================================
 
 def _criar_notificacao(user_id: str, tipo: str, mensagem: str, meta: dict = None):
-    """Insere uma notificação na coleção. Silencia erros para não quebrar o fluxo principal."""
-    try:
-        mongo_db["notificacoes"].insert_one({
-            "user_id":   user_id,
-            "tipo":      tipo,        # "amizade_pedido" | "amizade_aceita" | "sistema" | "mercado"
-            "mensagem":  mensagem,
-            "meta":      meta or {},
-            "lida":      False,
-            "created_at": datetime.now().isoformat()
-        })
-    except Exception as e:
-        logger.error(f"Erro ao criar notificação: {e}")
+    """Insere uma notificação e incrementa o badge. Silencia erros para não quebrar o fluxo principal."""
+    criar_notificacao(user_id, tipo, mensagem, meta)
 
 
 @api_bp.route('/social/perfil/<user_id>', methods=['GET'])
@@ -2064,72 +2028,16 @@ def perfil_publico(current_user_id, user_id):
     try:
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
-
-        doc = mongo_db["usuarios"].find_one(
-            {"_id": ObjectId(user_id)},
-            {"nome": 1, "foto_perfil": 1, "xp_total": 1, "nivel": 1,
-             "objetivo": 1, "cla_atual_id": 1, "ofensiva_atual": 1,
-             "esportes_favoritos": 1}
-        )
-        if not doc:
+        if not ObjectId.is_valid(user_id):
             return jsonify({"erro": "Usuário não encontrado"}), 404
 
-        # Conta missões concluídas
-        missoes_count = mongo_db["atividades"].count_documents({"user_id": user_id})
-
-        # Dados do clã (objeto completo para exibir no modal de perfil)
-        cla_nome = ""
-        cla_info = None
-        cla_id = doc.get("cla_atual_id", "")
-        if cla_id:
-            try:
-                cla_doc = mongo_db["Clas"].find_one(
-                    {"_id": ObjectId(cla_id)},
-                    {"nome": 1, "nivel": 1, "emblema": 1, "cor": 1, "membros": 1, "tipo": 1}
-                )
-                if cla_doc:
-                    cla_nome = cla_doc.get("nome", "")
-                    cla_info = {
-                        "id":            cla_id,
-                        "nome":          cla_doc.get("nome", ""),
-                        "nivel":         cla_doc.get("nivel", 1),
-                        "emblema":       cla_doc.get("emblema", "shield"),
-                        "cor":           cla_doc.get("cor", "#FFD700"),
-                        "tipo":          cla_doc.get("tipo", "aberto"),
-                        "total_membros": len(cla_doc.get("membros", [])),
-                    }
-            except Exception:
-                pass
-
-        # Verifica status de amizade com o usuário logado
-        amizade = mongo_db["amizades"].find_one({
-            "$or": [
-                {"solicitante_id": current_user_id, "receptor_id": user_id},
-                {"solicitante_id": user_id, "receptor_id": current_user_id}
-            ]
-        })
-        status_amizade = "nenhum"
-        if amizade:
-            status_amizade = amizade.get("status", "nenhum")
-            if status_amizade == "pendente" and amizade.get("solicitante_id") == current_user_id:
-                status_amizade = "pendente_enviado"
-            elif status_amizade == "pendente":
-                status_amizade = "pendente_recebido"
+        # Projeção em cache (contadores já desnormalizados) + point lookup da amizade
+        perfil = obter_perfil_publico(user_id)
+        if not perfil:
+            return jsonify({"erro": "Usuário não encontrado"}), 404
 
-        return jsonify({
-            "user_id":          user_id,
-            "nome":             doc.get("nome", "Anônimo"),
-            "foto":             doc.get("foto_perfil", ""),
-            "nivel":            doc.get("nivel", 1),
-            "xp_total":         doc.get("xp_total", 0),
-            "objetivo":         doc.get("objetivo", ""),
-            "cla_nome":         cla_nome,
-            "cla":              cla_info,
-            "ofensiva_atual":   doc.get("ofensiva_atual", 0),
-            "esportes":         doc.get("esportes_favoritos", []),
-            "missoes_total":    missoes_count,
-            "status_amizade":   status_amizade,
-        }), 200
+        perfil["status_amizade"] = status_amizade(current_user_id, user_id)
+        return jsonify(perfil), 200
     except Exception as e:
         logger.error(f"Erro perfil público {user_id}: {e}")
         return jsonify({"erro": str(e)}), 500
@@ -2148,23 +2056,10 @@ def enviar_pedido_amizade(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
 
-        # Verifica se já existe relação
-        existente = mongo_db["amizades"].find_one({
-            "$or": [
-                {"solicitante_id": current_user_id, "receptor_id": receptor_id},
-                {"solicitante_id": receptor_id, "receptor_id": current_user_id}
-            ]
-        })
-        if existente:
+        # Índice único em par_id: relação existente (em qualquer direção) → 409
+        if not criar_pedido(current_user_id, receptor_id):
             return jsonify({"erro": "Pedido já existe ou vocês já são amigos"}), 409
 
-        mongo_db["amizades"].insert_one({
-            "solicitante_id": current_user_id,
-            "receptor_id":    receptor_id,
-            "status":         "pendente",
-            "created_at":     datetime.now().isoformat()
-        })
-
         # Notifica o receptor
         solicitante = carregar_memoria(current_user_id)
         nome_sol = solicitante.get("nome", "Alguém")
@@ -2192,14 +2087,7 @@ def remover_amizade(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
 
-        resultado = mongo_db["amizades"].delete_one({
-            "$or": [
-                {"solicitante_id": current_user_id, "receptor_id": amigo_id, "status": "aceita"},
-                {"solicitante_id": amigo_id, "receptor_id": current_user_id, "status": "aceita"},
-            ]
-        })
-
-        if resultado.deleted_count == 0:
+        if not desfazer_amizade(current_user_id, amigo_id):
             return jsonify({"erro": "Amizade não encontrada ou já removida"}), 404
 
         logger.info(f"💔 Amizade removida entre {current_user_id} e {amigo_id}")
@@ -2225,12 +2113,8 @@ def responder_pedido_amizade(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
 
-        novo_status = "aceita" if acao == "aceitar" else "recusada"
-        resultado = mongo_db["amizades"].update_one(
-            {"solicitante_id": solicitante_id, "receptor_id": current_user_id, "status": "pendente"},
-            {"$set": {"status": novo_status, "updated_at": datetime.now().isoformat()}}
-        )
-        if resultado.matched_count == 0:
+        novo_status = responder_pedido(solicitante_id, current_user_id, aceitar=(acao == "aceitar"))
+        if novo_status is None:
             return jsonify({"erro": "Pedido não encontrado"}), 404
 
         if acao == "aceitar":
@@ -2258,34 +2142,26 @@ def listar_amigos(current_user_id):
             logger.error(f"❌ listar_amigos: mongo_db indisponível para {current_user_id}")
             return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente."}), 503
 
-        relacoes = list(mongo_db["amizades"].find({
-            "$or": [
-                {"solicitante_id": current_user_id, "status": "aceita"},
-                {"receptor_id": current_user_id, "status": "aceita"}
-            ]
-        }))
+        relacoes = listar_amigos_ids(current_user_id)
+        usuarios = carregar_resumos_usuarios(
+            (rel["user_id"] for rel in relacoes), campos_extras=["objetivo", "ofensiva_atual"]
+        )
 
         amigos = []
         for rel in relacoes:
-            amigo_id = rel["receptor_id"] if rel["solicitante_id"] == current_user_id else rel["solicitante_id"]
-            try:
-                doc = mongo_db["usuarios"].find_one(
-                    {"_id": ObjectId(amigo_id)},
-                    {"nome": 1, "foto_perfil": 1, "nivel": 1, "xp_total": 1, "objetivo": 1, "ofensiva_atual": 1}
-                )
-                if doc:
-                    amigos.append({
-                        "user_id":       amigo_id,
-                        "nome":          doc.get("nome", "Anônimo"),
-                        "foto":          doc.get("foto_perfil", ""),
-                        "nivel":         doc.get("nivel", 1),
-                        "xp_total":      doc.get("xp_total", 0),
-                        "objetivo":      doc.get("objetivo", ""),
-                        "ofensiva_atual": doc.get("ofensiva_atual", 0),
-                        "amizade_desde": rel.get("updated_at", rel.get("created_at", "")),
-                    })
-            except Exception:
-                pass
+            amigo_id = rel["user_id"]
+            doc = usuarios.get(amigo_id)
+            if doc:
+                amigos.append({
+                    "user_id":       amigo_id,
+                    "nome":          doc.get("nome", "Anônimo"),
+                    "foto":          doc.get("foto_perfil", ""),
+                    "nivel":         doc.get("nivel", 1),
+                    "xp_total":      doc.get("xp_total", 0),
+                    "objetivo":      doc.get("objetivo", ""),
+                    "ofensiva_atual": doc.get("ofensiva_atual", 0),
+                    "amizade_desde": rel["desde"],
+                })
 
         amigos.sort(key=lambda a: a["xp_total"], reverse=True)
         return jsonify({"amigos": amigos}), 200
@@ -2294,50 +2170,83 @@ def listar_amigos(current_user_id):
         return jsonify({"erro": "Falha ao buscar amigos. Tente novamente."}), 500
 
 
+@api_bp.route('/social/feed', methods=['GET'])
+@token_required
+def feed_amigos(current_user_id):
+    """
+    Feed de atividades, missões e level-ups do usuário e dos amigos.
+    Query: ?limite=20&antes=<criado_em do último item recebido>
+    """
+    try:
+        try:
+            limite = int(request.args.get("limite", 20))
+        except ValueError:
+            return jsonify({"erro": "limite inválido"}), 400
+        return jsonify(obter_feed(current_user_id, limite, request.args.get("antes", ""))), 200
+    except Exception as e:
+        logger.error(f"Erro ao carregar feed de {current_user_id}: {e}")
+        return jsonify({"itens": [], "proximo": None}), 200
+
+
+@api_bp.route('/social/ranking_amigos', methods=['GET'])
+@token_required
+def ranking_amigos(current_user_id):
+    """Ranking entre amigos pelo XP dos últimos 7 dias (query opcional: ?dias=30)."""
+    try:
+        dias = min(max(1, int(request.args.get("dias", 7))), 30)
+        return jsonify({"ranking": obter_ranking_amigos(current_user_id, dias)}), 200
+    except Exception as e:
+        logger.error(f"Erro no ranking de amigos de {current_user_id}: {e}")
+        return jsonify({"ranking": []}), 200
+
+
 @api_bp.route('/social/notificacoes', methods=['GET'])
 @token_required
 def listar_notificacoes(current_user_id):
-    """Retorna as últimas 30 notificações do usuário, ordenadas por data desc."""
+    """
+    Caixa de entrada paginada (mais recentes primeiro).
+    Query: ?limite=30&antes=<created_at da última notificação recebida>
+    """
     try:
         if mongo_db is None:
             logger.error(f"❌ listar_notificacoes: mongo_db indisponível para {current_user_id}")
             return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente."}), 503
 
-        cursor = mongo_db["notificacoes"].find(
-            {"user_id": current_user_id}
-        ).sort("created_at", -1).limit(30)
-
-        notifs = []
-        for n in cursor:
-            notifs.append({
-                "id":        str(n["_id"]),
-                "tipo":      n.get("tipo", "sistema"),
-                "mensagem":  n.get("mensagem", ""),
-                "meta":      n.get("meta", {}),
-                "lida":      n.get("lida", False),
-                "created_at": n.get("created_at", ""),
-            })
-
-        nao_lidas = sum(1 for n in notifs if not n["lida"])
-        return jsonify({"notificacoes": notifs, "nao_lidas": nao_lidas}), 200
+        antes = request.args.get("antes", "")
+        pagina = listar_notificacoes_usuario(
+            current_user_id,
+            limite=request.args.get("limite", 30, type=int),
+            antes=antes
+        )
+        # 1ª página: recontagem corrige o badge se o contador divergiu
+        pagina["nao_lidas"] = contar_nao_lidas(current_user_id) if antes else recontar_nao_lidas(current_user_id)
+        return jsonify(pagina), 200
     except Exception as e:
         logger.error(f"Erro ao listar notificações de {current_user_id}: {e}")
         return jsonify({"erro": "Falha ao buscar notificações. Tente novamente."}), 500
 
 
+@api_bp.route('/social/notificacoes/badge', methods=['GET'])
+@token_required
+def badge_notificacoes(current_user_id):
+    """Contador de não lidas para o badge (leitura de um campo do usuário)."""
+    try:
+        return jsonify({"nao_lidas": contar_nao_lidas(current_user_id)}), 200
+    except Exception as e:
+        logger.error(f"Erro no badge de notificações de {current_user_id}: {e}")
+        return jsonify({"nao_lidas": 0}), 200
+
+
 @api_bp.route('/social/notificacoes/ler', methods=['POST'])
 @token_required
 def marcar_notificacoes_lidas(current_user_id):
-    """Marca todas as notificações do usuário como lidas."""
+    """Marca todas as notificações do usuário como lidas e zera o badge."""
     try:
         if mongo_db is None:
             logger.error(f"❌ marcar_notificacoes_lidas: mongo_db indisponível para {current_user_id}")
             return jsonify({"erro": "Serviço temporariamente indisponível. Tente novamente."}), 503
-        mongo_db["notificacoes"].update_many(
-            {"user_id": current_user_id, "lida": False},
-            {"$set": {"lida": True}}
-        )
-        return jsonify({"sucesso": True}), 200
+        marcadas = marcar_todas_lidas(current_user_id)
+        return jsonify({"sucesso": True, "marcadas": marcadas}), 200
     except Exception as e:
         logger.error(f"Erro ao marcar notificações lidas: {e}")
         return jsonify({"sucesso": False}), 500
@@ -2347,28 +2256,19 @@ def marcar_notificacoes_lidas(current_user_id):
 # 🪪 AURA CODE — Identificador único público (8 chars)
 # ===================================================
 
-def _gerar_aura_code(user_id: str) -> str:
-    """Deriva um código de 8 dígitos alfanuméricos do ObjectId. Determinístico e sem colisões."""
-    import hashlib
-    h = hashlib.sha256(str(user_id).encode()).hexdigest()
-    return h[:8].upper()
-
-
 @api_bp.route('/social/meu_codigo', methods=['GET'])
 @token_required
 def meu_aura_code(current_user_id):
-    """Retorna (e cria se necessário) o Aura Code do usuário logado."""
+    """Retorna o Aura Code do usuário logado (atribui na hora para contas antigas sem código)."""
     try:
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
         doc = mongo_db["usuarios"].find_one({"_id": ObjectId(current_user_id)}, {"aura_code": 1})
         code = doc.get("aura_code") if doc else None
         if not code:
-            code = _gerar_aura_code(current_user_id)
-            mongo_db["usuarios"].update_one(
-                {"_id": ObjectId(current_user_id)},
-                {"$set": {"aura_code": code}}
-            )
+            code = atribuir_aura_code(current_user_id)
+        if not code:
+            return jsonify({"erro": "Não foi possível gerar o Aura Code"}), 500
         return jsonify({"aura_code": code}), 200
     except Exception as e:
         logger.error(f"Erro ao buscar Aura Code: {e}")
@@ -2386,7 +2286,7 @@ def buscar_por_aura_code(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
 
-        # Migra usuários antigos que ainda não têm aura_code
+        # Índice único em aura_code: point lookup
         doc = mongo_db["usuarios"].find_one({"aura_code": code},
             {"nome": 1, "foto_perfil": 1, "nivel": 1, "xp_total": 1, "objetivo": 1})
         if not doc:
@@ -2397,19 +2297,7 @@ def buscar_por_aura_code(current_user_id):
             return jsonify({"erro": "Esse é o seu próprio código!"}), 400
 
         # Verifica status de amizade
-        amizade = mongo_db["amizades"].find_one({
-            "$or": [
-                {"solicitante_id": current_user_id, "receptor_id": uid},
-                {"solicitante_id": uid, "receptor_id": current_user_id}
-            ]
-        })
-        status_amizade = "nenhum"
-        if amizade:
-            status_amizade = amizade.get("status", "nenhum")
-            if status_amizade == "pendente" and amizade.get("solicitante_id") == current_user_id:
-                status_amizade = "pendente_enviado"
-            elif status_amizade == "pendente":
-                status_amizade = "pendente_recebido"
+        status_relacao = status_amizade(current_user_id, uid)
 
         return jsonify({
             "user_id":        uid,
@@ -2419,7 +2307,7 @@ def buscar_por_aura_code(current_user_id):
             "xp_total":       doc.get("xp_total", 0),
             "objetivo":       doc.get("objetivo", ""),
             "aura_code":      code,
-            "status_amizade": status_amizade,
+            "status_amizade": status_relacao,
         }), 200
     except Exception as e:
         logger.error(f"Erro ao buscar por código: {e}")
@@ -2446,13 +2334,13 @@ def criar_desafio_cla(current_user_id):
         if mongo_db is None:
             return jsonify({"erro": "Banco indisponível"}), 500
 
-        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id)})
+        cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id)}, {"_id": 1})
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
         # Verifica cargo
-        cargo = next((m.get("cargo") for m in cla.get("membros", []) if m.get("user_id") == current_user_id), None)
-        if cargo not in ("owner", "co-leader"):
+        cargo = obter_cargo(cla_id, current_user_id)
+        if cargo not in CARGOS_LIDERANCA:
             return jsonify({"erro": "Apenas líderes podem criar desafios"}), 403
 
         # Verifica se já há desafio ativo
@@ -2602,23 +2490,18 @@ def ranking_desafio(current_user_id, desafio_id):
             {"$limit": 50},
         ]
 
-        cursor = mongo_db["evidencias_desafio"].aggregate(pipeline)
+        agregados = list(mongo_db["evidencias_desafio"].aggregate(pipeline))
+        usuarios = carregar_resumos_usuarios(doc["_id"] for doc in agregados)
         ranking = []
-        for i, doc in enumerate(cursor):
+        for i, doc in enumerate(agregados):
             uid  = doc["_id"]
             foto = ""
             nivel = 1
-            try:
-                u = mongo_db["usuarios"].find_one(
-                    {"_id": ObjectId(uid)},
-                    {"foto_perfil": 1, "nivel": 1}
-                )
-                if u:
-                    fp = u.get("foto_perfil", "")
-                    foto  = fp if fp and not fp.startswith("data:") else ""
-                    nivel = u.get("nivel", 1)
-            except Exception:
-                pass
+            u = usuarios.get(uid)
+            if u:
+                fp = u.get("foto_perfil", "")
+                foto  = fp if fp and not fp.startswith("data:") else ""
+                nivel = u.get("nivel", 1)
 
             ranking.append({
                 "posicao":          i + 1,
@@ -2660,15 +2543,15 @@ def excluir_desafio_cla(current_user_id, desafio_id):
 
         cla_id = desafio.get("cla_id", "")
         try:
-            cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id)})
+            cla = mongo_db["Clas"].find_one({"_id": ObjectId(cla_id)}, {"_id": 1})
         except Exception:
             cla = None
 
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        cargo = next((m.get("cargo") for m in cla.get("membros", []) if m.get("user_id") == current_user_id), None)
-        if cargo not in ("owner", "co_leader"):
+        cargo = obter_cargo(cla_id, current_user_id)
+        if cargo not in CARGOS_LIDERANCA:
             return jsonify({"erro": "Apenas líderes e co-líderes podem excluir desafios"}), 403
 
         mongo_db["desafios_cla"].delete_one({"_id": oid})
@@ -2699,7 +2582,7 @@ def editar_cla(current_user_id, cla_id):
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        cargo = next((m.get("cargo") for m in cla.get("membros", []) if m.get("user_id") == current_user_id), None)
+        cargo = obter_cargo(cla_id, current_user_id)
         if cargo != "owner":
             return jsonify({"erro": "Apenas o líder pode editar o clã"}), 403
 
@@ -2711,7 +2594,13 @@ def editar_cla(current_user_id, cla_id):
         if "privado" in dados:
             update["privado"] = bool(dados["privado"])
 
-        mongo_db["Clas"].update_one({"_id": ObjectId(cla_id)}, {"$set": update})
+        if "nome" in update and nome_cla_em_uso(update["nome"], cla_id):
+            return jsonify({"erro": "Já existe um clã com esse nome"}), 409
+        try:
+            mongo_db["Clas"].update_one({"_id": ObjectId(cla_id)}, {"$set": update})
+        except DuplicateKeyError:
+            return jsonify({"erro": "Já existe um clã com esse nome"}), 409
+        invalidar_resumo_cla(cla_id)
         return jsonify({"sucesso": True}), 200
     except Exception as e:
         logger.error(f"Erro ao editar clã {cla_id}: {e}")
@@ -2735,15 +2624,11 @@ def promover_membro(current_user_id, cla_id):
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        cargo_solicitante = next((m.get("cargo") for m in cla.get("membros", []) if m.get("user_id") == current_user_id), None)
+        cargo_solicitante = obter_cargo(cla_id, current_user_id)
         if cargo_solicitante != "owner":
             return jsonify({"erro": "Apenas o líder pode promover membros"}), 403
 
-        resultado = mongo_db["Clas"].update_one(
-            {"_id": ObjectId(cla_id), "membros.user_id": alvo_id},
-            {"$set": {"membros.$.cargo": "co-leader", "updated_at": datetime.now().isoformat()}}
-        )
-        if resultado.matched_count == 0:
+        if not definir_cargo(cla_id, alvo_id, "co-leader"):
             return jsonify({"erro": "Membro não encontrado no clã"}), 404
 
         # Notifica o promovido
@@ -2774,8 +2659,8 @@ def expulsar_membro(current_user_id, cla_id):
         if not cla:
             return jsonify({"erro": "Clã não encontrado"}), 404
 
-        cargo_sol = next((m.get("cargo") for m in cla.get("membros", []) if m.get("user_id") == current_user_id), None)
-        cargo_alvo = next((m.get("cargo") for m in cla.get("membros", []) if m.get("user_id") == alvo_id), None)
+        cargo_sol = obter_cargo(cla_id, current_user_id)
+        cargo_alvo = obter_cargo(cla_id, alvo_id)
 
         if cargo_sol not in ("owner", "co-leader"):
             return jsonify({"erro": "Sem permissão para expulsar"}), 403
@@ -2784,11 +2669,7 @@ def expulsar_membro(current_user_id, cla_id):
         if cargo_alvo == "owner":
             return jsonify({"erro": "O líder não pode ser expulso"}), 403
 
-        mongo_db["Clas"].update_one(
-            {"_id": ObjectId(cla_id)},
-            {"$pull": {"membros": {"user_id": alvo_id}},
-             "$set":  {"updated_at": datetime.now().isoformat()}}
-        )
+        remover_membro(cla_id, alvo_id)
         # Remove vínculo do usuário expulso
         salvar_memoria(alvo_id, {"cla_atual_id": None})
         _criar_notificacao(alvo_id, "sistema",
@@ -2814,23 +2695,22 @@ def pedidos_pendentes(current_user_id):
         cursor = list(mongo_db["amizades"].find(
             {"receptor_id": current_user_id, "status": "pendente"}
         ))
+        usuarios = carregar_resumos_usuarios(
+            (rel["solicitante_id"] for rel in cursor), campos_extras=["objetivo"]
+        )
         pedidos = []
         for rel in cursor:
             uid = rel["solicitante_id"]
-            try:
-                doc = mongo_db["usuarios"].find_one({"_id": ObjectId(uid)},
-                    {"nome": 1, "foto_perfil": 1, "nivel": 1, "objetivo": 1})
-                if doc:
-                    pedidos.append({
-                        "user_id": uid,
-                        "nome":    doc.get("nome", "Anônimo"),
-                        "foto":    doc.get("foto_perfil", ""),
-                        "nivel":   doc.get("nivel", 1),
-                        "objetivo": doc.get("objetivo", ""),
-                        "created_at": rel.get("created_at", ""),
-                    })
-            except Exception:
-                pass
+            doc = usuarios.get(uid)
+            if doc:
+                pedidos.append({
+                    "user_id": uid,
+                    "nome":    doc.get("nome", "Anônimo"),
+                    "foto":    doc.get("foto_perfil", ""),
+                    "nivel":   doc.get("nivel", 1),
+                    "objetivo": doc.get("objetivo", ""),
+                    "created_at": rel.get("created_at", ""),
+                })
         return jsonify({"pedidos": pedidos}), 200
     except Exception as e:
         logger.error(f"Erro ao listar pedidos pendentes: {e}")
@@ -2911,6 +2791,7 @@ def webhook_asaas():
     """
     Webhook para receber confirmações de pagamento do Asaas.
     Verifica o header asaas-access-token se ASAAS_WEBHOOK_TOKEN estiver definido.
+    Reenvios e o par RECEIVED/CONFIRMED do mesmo pagamento não reaplicam efeitos.
     """
     if _ASAAS_WEBHOOK_TOKEN:
         provided = request.headers.get("asaas-access-token", "")
@@ -2919,137 +2800,17 @@ def webhook_asaas():
             return jsonify({"erro": "Forbidden"}), 403
 
     try:
-        dados = request.get_json(force=True)
-        evento  = dados.get("event")
-        payment = dados.get("payment", {})
-
-        if evento in ["PAYMENT_RECEIVED", "PAYMENT_CONFIRMED"]:
-            payment_id = payment.get("id")
-            if not payment_id:
-                return jsonify({"status": "ignorado", "motivo": "sem payment_id"}), 200
-
-            pedido = mongo_db["pedidos"].find_one({"asaas_id": payment_id})
-            if pedido:
-                update_fields = {
-                    "status": "PAGO",
-                    "pago_em": datetime.now().isoformat(),
-                    "updated_at": datetime.now().isoformat()
-                }
-                tipo_pedido = pedido.get("tipo", "marketplace")
-
-                # ── [PERFORMANCE] Ativar inscrição em desafio ────────────────
-                if tipo_pedido == "desafio":
-                    inscricao_id = pedido.get("inscricao_id")
-                    desafio_id   = pedido.get("desafio_id")
-                    if inscricao_id:
-                        try:
-                            mongo_db["inscricoes_desafio"].update_one(
-                                {"_id": ObjectId(inscricao_id)},
-                                {"$set": {"status_pagamento": "PAGO", "pago_em": datetime.now().isoformat()}}
-                            )
-                            # Incrementa vagas_ocupadas no desafio
-                            if desafio_id:
-                                mongo_db["desafios"].update_one(
-                                    {"_id": ObjectId(desafio_id)},
-                                    {"$inc": {"vagas_ocupadas": 1, "total_inscritos": 1}}
-                                )
-                                # Atualiza total_alunos do profissional
-                                d = mongo_db["desafios"].find_one({"_id": ObjectId(desafio_id)})
-                                if d:
-                                    mongo_db["profissionais"].update_one(
-                                        {"user_id": d.get("profissional_id")},
-                                        {"$inc": {"total_alunos": 1}}
-                                    )
-
-                                # ── [AURA NEW] Cria/renova o grant de acesso a dados de saúde ──
-                                # Só nasce aqui (pagamento confirmado), nunca na inscrição PENDING.
-                                try:
-                                    inscricao_doc = mongo_db["inscricoes_desafio"].find_one({"_id": ObjectId(inscricao_id)})
-                                    if inscricao_doc and d:
-                                        duracao_dias = int(d.get("duracao_dias", 30))
-                                        data_inicio_str = inscricao_doc.get("data_inicio") or datetime.now().strftime("%Y-%m-%d")
-                                        try:
-                                            data_inicio_dt = datetime.fromisoformat(data_inicio_str)
-                                        except ValueError:
-                                            data_inicio_dt = datetime.now()
-                                        data_expiracao = (data_inicio_dt + timedelta(days=duracao_dias)).isoformat()
-
-                                        mongo_db["grants_saude"].update_one(
-                                            {
-                                                "profissional_id": inscricao_doc.get("profissional_id", ""),
-                                                "aluno_id":         inscricao_doc.get("user_id", ""),
-                                                "desafio_id":       desafio_id,
-                                            },
-                                            {
-                                                "$set": {
-                                                    "inscricao_id":   inscricao_id,
-                                                    "data_concessao": datetime.now().isoformat(),
-                                                    "data_expiracao": data_expiracao,
-                                                    "status":         "ativo",
-                                                    "consentimento":  inscricao_doc.get("consentimento", {}),
-                                                    "atualizado_em":  datetime.now().isoformat(),
-                                                },
-                                                "$setOnInsert": {"criado_em": datetime.now().isoformat()},
-                                            },
-                                            upsert=True,
-                                        )
-                                        logger.info(f"✅ [PERF] Grant de saúde concedido: prof={inscricao_doc.get('profissional_id')} aluno={inscricao_doc.get('user_id')} até {data_expiracao}")
-                                except Exception as ge:
-                                    logger.error(f"[PERF] Erro ao criar grant de saúde: {ge}")
-                            logger.info(f"✅ [PERF] Inscrição {inscricao_id} ativada via webhook.")
-                        except Exception as we:
-                            logger.error(f"[PERF] Erro ao ativar inscrição no webhook: {we}")
-
-                # ── [PERFORMANCE] Marcar verificação de profissional como paga ──
-                elif tipo_pedido == "verificacao_profissional":
-                    user_id_prof = pedido.get("user_id", "")
-                    if user_id_prof:
-                        try:
-                            mongo_db["profissionais"].update_one(
-                                {"user_id": user_id_prof},
-                                {"$set": {"verificacao_paga": True, "updated_at": datetime.now().isoformat()}}
-                            )
-                            logger.info(f"✅ [PERF] Verificação paga para profissional {user_id_prof}.")
-                        except Exception as ve:
-                            logger.error(f"[PERF] Erro ao marcar verificação: {ve}")
-
-                # ── [MARKETPLACE] Notificação admin ──────────────────────────
-                elif tipo_pedido == "marketplace":
-                    update_fields["notificado_admin"] = False
-
-                mongo_db["pedidos"].update_one(
-                    {"asaas_id": payment_id},
-                    {"$set": update_fields}
-                )
-                logger.info(f"✅ Pedido {payment_id} ({tipo_pedido}) atualizado para PAGO no Atlas.")
-
-                # Notifica o usuário sobre confirmação de pagamento (somente marketplace)
-                if tipo_pedido == "marketplace":
-                    uid = pedido.get("user_id", "")
-                    pid = str(pedido.get("_id", ""))
-                    if uid and pid:
-                        _criar_notificacao(uid, "mercado",
-                                           "✅ Pagamento confirmado! Seu pedido já está sendo preparado.",
-                                           {"pedido_id": pid, "acao": "abrir_pedido"})
-                        # E-mail de confirmação de compra
-                        try:
-                            usuario_doc = carregar_memoria(uid)
-                            if usuario_doc:
-                                _enviar_email(
-                                    usuario_doc.get("email", ""),
-                                    "✅ Pedido confirmado — AURA Performance",
-                                    _html_confirmacao_compra(
-                                        usuario_doc.get("nome", "Atleta"),
-                                        float(pedido.get("valor_total", 0)),
-                                        pedido.get("itens", []),
-                                    )
-                                )
-                        except Exception as me:
-                            logger.error(f"Erro ao enviar e-mail de confirmação: {me}")
-            else:
-                logger.warning(f"⚠️ Webhook Asaas: pedido {payment_id} não encontrado no Atlas.")
-
-        return jsonify({"status": "received"}), 200
+        if mongo_db is None:
+            return jsonify({"erro": "Banco indisponível"}), 500
+        dados = request.get_json(force=True) or {}
+        if dados.get("event") not in EVENTOS_ASAAS_PAGO:
+            return jsonify({"status": "received"}), 200
+        if not (dados.get("payment") or {}).get("id"):
+            return jsonify({"status": "ignorado", "motivo": "sem payment_id"}), 200
+
+        # Grava e confirma; pedido/inscrição/grant são atualizados fora do request
+        novo = registrar_evento_pagamento("asaas", dados)
+        return jsonify({"status": "received" if novo else "duplicado"}), 200
 
     except Exception as e:
         logger.error(f"Erro no webhook Asaas: {e}")
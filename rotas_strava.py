@@ -1,12 +1,12 @@
 import os
 import logging
-import requests
 from flask import Blueprint, request, jsonify, redirect
 
 # Importações de Lógica e Dados
 # [AURA FIX] Garantindo que as rotas utilizem o Data Manager sincronizado com o Atlas
 from data_manager import salvar_conexao_strava
-from logic_strava import processar_evento_webhook
+from logic_strava import enfileirar_evento_webhook, iniciar_backfill_strava
+from logic_strava_api import strava_oauth_token
 from data_sensores import obter_dados_fisiologicos # Para sync imediato pós-login
 
 # Configuração de Logs
@@ -61,7 +61,6 @@ def strava_callback():
 
     # Troca Code por Access & Refresh Tokens
     try:
-        token_url = "https://www.strava.com/oauth/token"
         payload = {
             'client_id': os.getenv('STRAVA_CLIENT_ID'),
             'client_secret': os.getenv('STRAVA_CLIENT_SECRET'),
@@ -69,8 +68,10 @@ def strava_callback():
             'grant_type': 'authorization_code'
         }
         
-        # [AURA INFO] Timeout de 10s para evitar que o Render trave se a API do Strava oscilar
-        response = requests.post(token_url, data=payload, timeout=10)
+        # [AURA INFO] Sessão compartilhada com timeout para o Render não travar se o Strava oscilar (code é de uso único: sem retry)
+        response = strava_oauth_token(payload)
+        if response is None:
+            return jsonify({"erro": "Strava indisponível no momento, tente novamente"}), 503
         dados = response.json()
         
         if response.status_code == 200:
@@ -95,6 +96,8 @@ def strava_callback():
                     from data_manager import mongo_db
                     user_doc = mongo_db["usuarios"].find_one({"integracoes.strava.atleta_id": strava_atleta_id})
                     if user_doc:
+                        # Importa o histórico em background (paginado e com cota de backfill)
+                        iniciar_backfill_strava(str(user_doc["_id"]))
                         obter_dados_fisiologicos(str(user_doc["_id"]))
                 except:
                     pass
@@ -159,9 +162,10 @@ def webhook_strava():
         logger.info(f"🔔 Novo evento Strava: {evento.get('aspect_type')} de {evento.get('object_type')}")
         
         try:
-            # Processamento do evento para atualizar XP e contexto biofísico
-            processar_evento_webhook(evento)
+            # Só grava e responde: XP e contexto biofísico são processados fora do request
+            enfileirar_evento_webhook(evento)
             return jsonify({"status": "recebido"}), 200
         except Exception as e:
-            logger.error(f"❌ Falha no processamento do Webhook: {e}")
-            return jsonify({"status": "erro_interno_processado"}), 200
\ No newline at end of file
+            # Sem gravar, um 5xx faz o Strava reenviar o evento
+            logger.error(f"❌ Falha ao enfileirar o Webhook: {e}")
+            return jsonify({"status": "erro"}), 500
\ No newline at end of file
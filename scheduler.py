@@ -84,8 +84,8 @@ def rotina_diaria_manutencao():
         )
         logger.info(f"🔒 Assinaturas expiradas: {r2.modified_count}")
 
-        g, p, c = limpar_mensagens_chat()
-        logger.info(f"💬 Chat limpo: grupo={g} priv={p} clã={c}")
+        d, _, c = limpar_mensagens_chat()
+        logger.info(f"💬 Chat limpo: desafios={d} clã={c}")
 
         registrar_interacao_global(sentimento="sistema", tipo_acao="manutencao_diaria")
         logger.info("✅ [SCHEDULER] Manutenção concluída.")
@@ -252,6 +252,120 @@ def push_cla_atualizacoes():
         logger.error(f"[PUSH] Erro push_cla: {e}")
 
 
+# ──────────────────────────────────────────────────────────────
+# JOB: Renovação proativa de tokens Strava — a cada 15 min
+# Renova antes de expirar para atletas ativos, tirando o refresh
+# do caminho crítico dos webhooks.
+# ──────────────────────────────────────────────────────────────
+def renovar_tokens_strava():
+    # TTL menor que o intervalo: o lock expira antes da próxima execução
+    if not _acquire_lock("renovar_tokens_strava", ttl_segundos=600):
+        return
+    if mongo_db is None:
+        return
+
+    try:
+        from logic_strava import renovar_tokens_atletas_ativos
+        count = renovar_tokens_atletas_ativos()
+        logger.info(f"🔑 [SCHEDULER] Tokens Strava renovados proativamente: {count}")
+    except Exception as e:
+        logger.error(f"⚠️ [SCHEDULER] Erro na renovação de tokens Strava: {e}")
+
+
+# ──────────────────────────────────────────────────────────────
+# JOB: Retomada de backfills do Strava — a cada 30 min
+# Continua importações pausadas por cota ou interrompidas por restart.
+# ──────────────────────────────────────────────────────────────
+def retomar_backfills_strava():
+    if not _acquire_lock("retomar_backfills_strava", ttl_segundos=1500):
+        return
+    if mongo_db is None:
+        return
+
+    try:
+        from logic_strava import retomar_backfills_pendentes
+        total = retomar_backfills_pendentes()
+        logger.info(f"📚 [SCHEDULER] Backfill Strava retomado: +{total} atividades.")
+    except Exception as e:
+        logger.error(f"⚠️ [SCHEDULER] Erro ao retomar backfills Strava: {e}")
+
+
+# ──────────────────────────────────────────────────────────────
+# JOB: Fila de eventos do webhook Strava — a cada 1 min
+# Retoma eventos que falharam (cota, token) ou ficaram órfãos num restart.
+# ──────────────────────────────────────────────────────────────
+def processar_eventos_strava():
+    if not _acquire_lock("processar_eventos_strava", ttl_segundos=50):
+        return
+    if mongo_db is None:
+        return
+
+    try:
+        from logic_strava import processar_eventos_strava_pendentes
+        total = processar_eventos_strava_pendentes()
+        if total:
+            logger.info(f"🏃 [SCHEDULER] Eventos Strava reprocessados: {total}")
+    except Exception as e:
+        logger.error(f"⚠️ [SCHEDULER] Erro ao processar eventos Strava: {e}")
+
+
+# ──────────────────────────────────────────────────────────────
+# JOB: Materialização do ranking global — a cada 5 min
+# Um único worker recalcula os quadros; os demais só leem o snapshot.
+# ──────────────────────────────────────────────────────────────
+def materializar_rankings():
+    if not _acquire_lock("materializar_rankings", ttl_segundos=240):
+        return
+    if mongo_db is None:
+        return
+
+    try:
+        from data_global import materializar_ranking_global
+        totais = materializar_ranking_global()
+        logger.info(f"🏆 [SCHEDULER] Ranking materializado: {totais}")
+    except Exception as e:
+        logger.error(f"⚠️ [SCHEDULER] Erro ao materializar ranking: {e}")
+
+
+# ──────────────────────────────────────────────────────────────
+# JOB: Reconciliação das avaliações — diário às 03:30
+# Recalcula soma/total de desafios e profissionais a partir das
+# inscrições e corrige a deriva dos contadores incrementais.
+# ──────────────────────────────────────────────────────────────
+def reconciliar_avaliacoes_job():
+    if not _acquire_lock("reconciliar_avaliacoes", ttl_segundos=3600):
+        return
+    if mongo_db is None:
+        return
+
+    try:
+        from data_desafios import reconciliar_avaliacoes
+        relatorio = reconciliar_avaliacoes()
+        logger.info(f"⭐ [SCHEDULER] Avaliações reconciliadas: {relatorio}")
+    except Exception as e:
+        logger.error(f"⚠️ [SCHEDULER] Erro ao reconciliar avaliações: {e}")
+
+
+# ──────────────────────────────────────────────────────────────
+# JOB: Caixa de entrada de pagamentos — a cada 1 min
+# Reprocessa eventos de webhook pendentes, com falha ou com lease vencido
+# (ex.: worker reiniciado no meio do processamento).
+# ──────────────────────────────────────────────────────────────
+def processar_eventos_pagamento():
+    if not _acquire_lock("processar_eventos_pagamento", ttl_segundos=50):
+        return
+    if mongo_db is None:
+        return
+
+    try:
+        from logic_pagamentos import processar_pendentes
+        total = processar_pendentes()
+        if total:
+            logger.info(f"💳 [SCHEDULER] Eventos de pagamento reprocessados: {total}")
+    except Exception as e:
+        logger.error(f"⚠️ [SCHEDULER] Erro ao processar eventos de pagamento: {e}")
+
+
 # ──────────────────────────────────────────────────────────────
 # Inicialização (chamada de app.py no nível de módulo)
 # ──────────────────────────────────────────────────────────────
@@ -269,6 +383,7 @@ def iniciar_scheduler():
         ("push_cla",            push_cla_atualizacoes,    19,   0),
         ("push_ofensiva",       push_ofensiva_risco,      21,   30),
         ("push_mercado",        push_mercado_ofertas,     12,   0),
+        ("reconciliar_avaliacoes", reconciliar_avaliacoes_job, 3, 30),
     ]
     for job_id, func, hora, minuto in jobs:
         _scheduler.add_job(
@@ -281,8 +396,26 @@ def iniciar_scheduler():
             misfire_grace_time=1800,
         )
 
+    # Jobs de intervalo (id, função, minutos)
+    jobs_intervalo = [
+        ("renovar_tokens_strava",    renovar_tokens_strava,    15),
+        ("retomar_backfills_strava", retomar_backfills_strava, 30),
+        ("processar_eventos_strava", processar_eventos_strava, 1),
+        ("materializar_rankings",    materializar_rankings,    5),
+        ("processar_eventos_pagamento", processar_eventos_pagamento, 1),
+    ]
+    for job_id, func, minutos in jobs_intervalo:
+        _scheduler.add_job(
+            func,
+            "interval",
+            minutes=minutos,
+            id=job_id,
+            replace_existing=True,
+            misfire_grace_time=300,
+        )
+
     try:
         _scheduler.start()
-        logger.info(f"✅ Scheduler iniciado (PID {os.getpid()}) — 5 jobs agendados.")
+        logger.info(f"✅ Scheduler iniciado (PID {os.getpid()}) — {len(jobs) + len(jobs_intervalo)} jobs agendados.")
     except Exception as e:
         logger.error(f"❌ Falha ao iniciar scheduler: {e}")
@@ -47,6 +47,7 @@ def obter_schema_padrao_usuario(email: str = "", nome: str = "Atleta") -> Dict[s
         "plano": "free",                # free, plus, pro
         "status_assinatura": "inativo", # ativo, inativo, expirado
         "data_vencimento": "",          # Data ISO da expiração IAP
+        "asaas_customer_id": None,      # cus_xxx, salvo na 1ª cobrança (logic_asaas)
         "objetivo": "Performance Máxima", 
         "cla_atual_id": None,           
         
@@ -192,6 +193,7 @@ def obter_schema_padrao_profissional(user_id: str = "") -> Dict[str, Any]:
         "total_alunos":        0,
         "avaliacao_media":     0.0,
         "total_avaliacoes":    0,
+        "soma_avaliacoes":     0,
         "criado_em":           agora.isoformat(),
         "updated_at":          agora.isoformat(),
     }
@@ -205,6 +207,11 @@ def obter_schema_padrao_desafio(profissional_id: str = "") -> Dict[str, Any]:
     agora = datetime.now().isoformat()
     return {
         "profissional_id":    profissional_id,
+        # Cópia dos dados do profissional (data_desafios.sincronizar_profissional_desafios)
+        "profissional_nome":       "Profissional",
+        "profissional_foto":       "",
+        "profissional_tipo":       "",
+        "profissional_verificado": False,
         "titulo":             "",
         "descricao":          "",
         "tipo":               "emagrecimento",    # emagrecimento|hipertrofia|saude|performance|reabilitacao
@@ -225,6 +232,7 @@ def obter_schema_padrao_desafio(profissional_id: str = "") -> Dict[str, Any]:
         "total_inscritos":    0,
         "avaliacao_media":    0.0,
         "total_avaliacoes":   0,
+        "soma_avaliacoes":    0,
         "criado_em":          agora,
         "updated_at":         agora,
         "aura_comissao_pct":  20,
@@ -368,4 +376,37 @@ def obter_schema_padrao_pedido() -> Dict[str, Any]:
         "created_at": agora_iso,
         "updated_at": agora_iso,
         "versao_os": "3.3.0-Native"
-    }
\ No newline at end of file
+    }
+
+def obter_schema_atividade_strava(treino: Dict[str, Any], user_id: str = "") -> Dict[str, Any]:
+    """
+    Atividade Strava compacta (coleção 'atividades_strava').
+    Mantém os nomes de campo do Strava (sensores.py lê direto), tipados.
+    Polylines, splits, laps e segment efforts ficam em 'atividades_strava_raw'.
+    """
+    def _f(campo):
+        return float(treino.get(campo) or 0)
+
+    def _i(campo):
+        return int(treino.get(campo) or 0)
+
+    return {
+        "id":                   int(treino.get("id") or 0),
+        "user_id":              user_id,
+        "name":                 treino.get("name", ""),
+        "type":                 treino.get("type", "Workout"),
+        "sport_type":           treino.get("sport_type", treino.get("type", "Workout")),
+        "start_date":           treino.get("start_date", ""),
+        "start_date_local":     treino.get("start_date_local", ""),
+        "distance":             _f("distance"),
+        "moving_time":          _i("moving_time"),
+        "elapsed_time":         _i("elapsed_time"),
+        "total_elevation_gain": _f("total_elevation_gain"),
+        "average_speed":        _f("average_speed"),
+        "average_heartrate":    _f("average_heartrate"),
+        "max_heartrate":        _f("max_heartrate"),
+        "kilojoules":           _f("kilojoules"),
+        "suffer_score":         _i("suffer_score"),
+        "aura_analysis":        {},
+        "compacto":             True,
+    }
@@ -42,6 +42,8 @@ def coletar_dados(user_id: str, config_integracoes: Dict[str, Any]) -> Dict[str,
             # Buscamos as atividades das últimas 24 horas para compor o contexto
             cursor_atividades = mongo_db["atividades_strava"].find(
                 {"user_id": str(user_id)},
+                {"type": 1, "distance": 1, "average_heartrate": 1, "kilojoules": 1,
+                 "suffer_score": 1, "start_date_local": 1},
                 sort=[("start_date_local", DESCENDING)]
             ).limit(3) # Analisamos as 3 últimas para dar profundidade à IA
 
@@ -0,0 +1,177 @@
+"""
+Testa a autenticação JWT unificada (auth_jwt): cache de claims por worker e
+revogação (logout) pela deny-list 'jwt_revogados', sem MongoDB.
+
+Estratégia:
+- Substitui o mongo_db do módulo por um banco em memória que conta as consultas
+  à deny-list.
+- Simula "outro worker" esvaziando/expirando o cache local: o token revogado
+  precisa ser recusado assim que o cache deixa de servi-lo.
+- Chama a rota real /api/auth/logout e uma rota protegida de teste.
+
+Execução:  source venv/bin/activate && python3 test_auth_jwt.py
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault("JWT_SECRET", "segredo_de_teste")
+
+import jwt
+from flask import Flask, jsonify
+
+import auth_jwt
+import rotas_api
+
+PASS = "✅ PASSOU"
+FAIL = "❌ FALHOU"
+erros = []
+
+
+# ──────────────────────────────────────────────────────────────
+# Banco em memória (só a deny-list)
+# ──────────────────────────────────────────────────────────────
+class DenyListFalsa:
+    def __init__(self):
+        self.docs = {}
+        self.consultas = 0
+
+    def find_one(self, filtro, projecao=None):
+        self.consultas += 1
+        return self.docs.get(filtro["_id"])
+
+    def update_one(self, filtro, update, upsert=False):
+        self.docs.setdefault(filtro["_id"], {"_id": filtro["_id"]}).update(update.get("$set", {}))
+
+
+class BancoFalso(dict):
+    def __missing__(self, nome):
+        self[nome] = DenyListFalsa()
+        return self[nome]
+
+
+def _instalar(banco):
+    auth_jwt.mongo_db = banco
+    auth_jwt._cache_tokens.clear()
+
+
+def _app():
+    app = Flask(__name__)
+    app.register_blueprint(rotas_api.api_bp, url_prefix="/api")
+
+    @app.route("/protegida")
+    @auth_jwt.token_required
+    def protegida(current_user_id):
+        return jsonify({"user_id": current_user_id}), 200
+
+    return app
+
+
+def _expirar_cache_local():
+    """Como se o TTL do cache tivesse passado (ou a request caísse em outro worker)."""
+    with auth_jwt._cache_lock:
+        for token, (_, claims) in list(auth_jwt._cache_tokens.items()):
+            auth_jwt._cache_tokens[token] = (time.time() - 1, claims)
+
+
+def verificar(label: str, condicao: bool, detalhe: str = ""):
+    if condicao:
+        print(f"  {PASS}  {label}")
+    else:
+        print(f"  {FAIL}  {label} {detalhe}")
+        erros.append(label)
+
+
+# ──────────────────────────────────────────────────────────────
+# Testes
+# ──────────────────────────────────────────────────────────────
+def teste_cache_de_claims():
+    print("\n[1] Token válido: deny-list consultada só na 1ª verificação")
+    banco = BancoFalso()
+    _instalar(banco)
+
+    token = auth_jwt.gerar_token_jwt("user_1")
+    claims = [auth_jwt.verificar_token(token) for _ in range(5)]
+    verificar("claims com user_id e jti", claims[0].get("user_id") == "user_1" and claims[0].get("jti"))
+    verificar("1 consulta à deny-list para 5 verificações", banco["jwt_revogados"].consultas == 1,
+              f"(obtido {banco['jwt_revogados'].consultas})")
+
+
+def teste_revogado_apos_cache_miss():
+    print("\n[2] Token revogado por outro worker é recusado após o cache expirar")
+    banco = BancoFalso()
+    _instalar(banco)
+
+    token = auth_jwt.gerar_token_jwt("user_2")
+    auth_jwt.verificar_token(token)
+
+    # Revogação feita em outro processo: grava direto na deny-list compartilhada
+    claims = jwt.decode(token, auth_jwt.JWT_SECRET, algorithms=[auth_jwt.JWT_ALGORITHM])
+    banco["jwt_revogados"].update_one({"_id": claims["jti"]}, {"$set": {"user_id": "user_2"}}, upsert=True)
+
+    verificar("ainda aceito enquanto servido do cache local", auth_jwt.verificar_token(token)["user_id"] == "user_2")
+    _expirar_cache_local()
+    try:
+        auth_jwt.verificar_token(token)
+        verificar("recusado após cache miss", False)
+    except jwt.InvalidTokenError:
+        verificar("recusado após cache miss", True)
+
+
+def teste_logout_pela_rota():
+    print("\n[3] POST /api/auth/logout → mesmo token recebe 401")
+    banco = BancoFalso()
+    _instalar(banco)
+    cliente = _app().test_client()
+
+    token = auth_jwt.gerar_token_jwt("user_3")
+    headers = {"Authorization": f"Bearer {token}"}
+    antes = cliente.get("/protegida", headers=headers)
+    logout = cliente.post("/api/auth/logout", headers=headers)
+    depois = cliente.get("/protegida", headers=headers)
+
+    verificar("rota protegida aceita o token antes do logout", antes.status_code == 200)
+    verificar("logout responde 200", logout.status_code == 200, f"(obtido {logout.status_code})")
+    verificar("token revogado recebe 401", depois.status_code == 401, f"(obtido {depois.status_code})")
+
+    auth_jwt._cache_tokens.clear()
+    verificar("continua 401 sem cache (outro worker)",
+              cliente.get("/protegida", headers=headers).status_code == 401)
+
+
+def teste_token_sem_jti():
+    print("\n[4] Token antigo (sem jti) também pode ser revogado")
+    banco = BancoFalso()
+    _instalar(banco)
+
+    legado = jwt.encode({"user_id": "user_4", "exp": int(time.time()) + 600},
+                        auth_jwt.JWT_SECRET, algorithm=auth_jwt.JWT_ALGORITHM)
+    verificar("revogação aceita", auth_jwt.revogar_token(legado))
+    auth_jwt._cache_tokens.clear()
+    try:
+        auth_jwt.verificar_token(legado)
+        verificar("recusado depois de revogado", False)
+    except jwt.InvalidTokenError:
+        verificar("recusado depois de revogado", True)
+
+
+# ──────────────────────────────────────────────────────────────
+# Main
+# ──────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    mongo_original = auth_jwt.mongo_db
+
+    teste_cache_de_claims()
+    teste_revogado_apos_cache_miss()
+    teste_logout_pela_rota()
+    teste_token_sem_jti()
+
+    _instalar(mongo_original)
+
+    if erros:
+        print(f"\n❌ {len(erros)} falha(s): {erros}")
+        sys.exit(1)
+    else:
+        print("\n✅ Cache de JWT e revogação validados.")
+        sys.exit(0)
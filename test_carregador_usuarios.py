@@ -0,0 +1,348 @@
+"""
+Testa o carregador em lote de usuários (carregar_resumos_usuarios) e as rotas
+convertidas para ele, contando as queries feitas na coleção 'usuarios'.
+
+Estratégia:
+- Substitui o mongo_db dos módulos por um banco em memória que conta chamadas
+  de find/find_one por coleção (não precisa de MongoDB).
+- Monta um Flask mínimo com os blueprints reais e chama as rotas com JWT válido.
+- Verifica que N linhas custam 1 query em 'usuarios' (antes: N find_one).
+
+Execução:  source venv/bin/activate && python3 test_carregador_usuarios.py
+"""
+
+import os
+import sys
+
+os.environ.setdefault("JWT_SECRET", "segredo_de_teste")
+
+from bson.objectid import ObjectId
+from flask import Flask
+
+import data_manager
+import rotas_api
+import performance_bp as perf
+import admin_bp
+import data_clas
+import data_social
+import data_desafios
+
+PASS = "✅ PASSOU"
+FAIL = "❌ FALHOU"
+erros = []
+
+
+# ──────────────────────────────────────────────────────────────
+# Banco em memória com contagem de queries
+# ──────────────────────────────────────────────────────────────
+def _casa(doc: dict, filtro: dict) -> bool:
+    for chave, cond in (filtro or {}).items():
+        if chave == "$or":
+            if not any(_casa(doc, sub) for sub in cond):
+                return False
+            continue
+        if chave == "$and":
+            if not all(_casa(doc, sub) for sub in cond):
+                return False
+            continue
+        valor = doc.get(chave)
+        if isinstance(cond, dict):
+            if "$in" in cond and valor not in cond["$in"]:
+                return False
+            if "$ne" in cond and valor == cond["$ne"]:
+                return False
+        elif isinstance(valor, list):
+            if cond not in valor:
+                return False
+        elif valor != cond:
+            return False
+    return True
+
+
+class _Cursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return _Cursor(self[:n]) if n else self
+
+    def max_time_ms(self, *args):
+        return self
+
+
+class ColecaoContadora:
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+        self.chamadas = {"find": 0, "find_one": 0}
+
+    def find(self, filtro=None, projecao=None, **kwargs):
+        self.chamadas["find"] += 1
+        return _Cursor(dict(d) for d in self.docs if _casa(d, filtro))
+
+    def find_one(self, filtro=None, projecao=None, **kwargs):
+        self.chamadas["find_one"] += 1
+        for d in self.docs:
+            if _casa(d, filtro):
+                return dict(d)
+        return None
+
+    def aggregate(self, pipeline):
+        return _Cursor()
+
+
+class BancoFalso(dict):
+    def __missing__(self, nome):
+        self[nome] = ColecaoContadora()
+        return self[nome]
+
+
+def _instalar(banco):
+    data_manager.mongo_db = banco
+    data_clas.mongo_db = banco
+    data_social.mongo_db = banco
+    data_desafios.mongo_db = banco
+    rotas_api.mongo_db = banco
+    perf.mongo_db = banco
+    admin_bp.mongo_db = banco
+
+
+def _usuarios_sinteticos(n: int) -> list:
+    return [
+        {"_id": ObjectId(), "nome": f"Atleta {i}", "nivel": i % 7 + 1,
+         "foto_perfil": "", "xp_total": i * 10, "objetivo": "forca", "ofensiva_atual": i % 3,
+         "cpf": f"000000000{i:02d}"}
+        for i in range(n)
+    ]
+
+
+def _app():
+    app = Flask(__name__)
+    app.secret_key = "teste"
+    app.register_blueprint(rotas_api.api_bp, url_prefix="/api")
+    app.register_blueprint(perf.performance_bp, url_prefix="/api/performance")
+    return app
+
+
+def _auth(user_id: str) -> dict:
+    return {"Authorization": f"Bearer {rotas_api.gerar_token_jwt(user_id)}"}
+
+
+def verificar(label: str, condicao: bool, detalhe: str = ""):
+    if condicao:
+        print(f"  {PASS}  {label}")
+    else:
+        print(f"  {FAIL}  {label} {detalhe}")
+        erros.append(label)
+
+
+# ──────────────────────────────────────────────────────────────
+# Testes do carregador
+# ──────────────────────────────────────────────────────────────
+def teste_uma_query_para_n_ids():
+    print("\n[1] 50 ids → 1 find em 'usuarios'")
+    banco = BancoFalso()
+    users = _usuarios_sinteticos(50)
+    banco["usuarios"] = ColecaoContadora(users)
+    _instalar(banco)
+
+    res = data_manager.carregar_resumos_usuarios(str(u["_id"]) for u in users)
+    verificar("retorna os 50 usuários", len(res) == 50, f"(obtido {len(res)})")
+    verificar("1 find", banco["usuarios"].chamadas["find"] == 1, str(banco["usuarios"].chamadas))
+    verificar("0 find_one", banco["usuarios"].chamadas["find_one"] == 0)
+
+
+def teste_cache_da_request():
+    print("\n[2] Cache dentro da request")
+    banco = BancoFalso()
+    users = _usuarios_sinteticos(5)
+    banco["usuarios"] = ColecaoContadora(users)
+    _instalar(banco)
+    ids = [str(u["_id"]) for u in users]
+
+    with _app().test_request_context("/"):
+        data_manager.carregar_resumos_usuarios(ids)
+        data_manager.carregar_resumos_usuarios(ids[:3])
+        verificar("mesmos ids não voltam ao banco", banco["usuarios"].chamadas["find"] == 1)
+        data_manager.carregar_resumos_usuarios(ids, campos_extras=["cpf"])
+        verificar("campo extra novo força 1 nova query", banco["usuarios"].chamadas["find"] == 2)
+
+    with _app().test_request_context("/"):
+        data_manager.carregar_resumos_usuarios(ids)
+        verificar("cache não vaza entre requests", banco["usuarios"].chamadas["find"] == 3)
+
+
+def teste_ids_invalidos():
+    print("\n[3] Ids inválidos/vazios")
+    banco = BancoFalso()
+    banco["usuarios"] = ColecaoContadora(_usuarios_sinteticos(1))
+    _instalar(banco)
+
+    res = data_manager.carregar_resumos_usuarios(["", None, "nao-e-objectid"])
+    verificar("resultado vazio", res == {})
+    verificar("nenhuma query", banco["usuarios"].chamadas["find"] == 0)
+
+
+# ──────────────────────────────────────────────────────────────
+# Testes das rotas convertidas
+# ──────────────────────────────────────────────────────────────
+def teste_rota_membros_cla():
+    print("\n[4] GET /api/cla/<id>/membros com 50 membros")
+    banco = BancoFalso()
+    users = _usuarios_sinteticos(50)
+    cla_id = ObjectId()
+    banco["usuarios"] = ColecaoContadora(users)
+    banco["Clas"] = ColecaoContadora([{"_id": cla_id, "num_membros": 50}])
+    banco["cla_membros"] = ColecaoContadora([
+        {"cla_id": str(cla_id), "user_id": str(u["_id"]), "cargo": "owner" if i == 0 else "member",
+         "xp_contribuicao": 0} for i, u in enumerate(users)
+    ])
+    _instalar(banco)
+
+    resp = _app().test_client().get(f"/api/cla/{cla_id}/membros", headers=_auth(str(users[0]["_id"])))
+    verificar("status 200", resp.status_code == 200, f"(obtido {resp.status_code})")
+    verificar("50 membros", len(resp.get_json() or []) == 50)
+    verificar("usuarios: 1 find / 0 find_one",
+              banco["usuarios"].chamadas == {"find": 1, "find_one": 0}, str(banco["usuarios"].chamadas))
+
+
+def teste_rota_amigos():
+    print("\n[5] GET /api/social/amigos com 20 amigos")
+    banco = BancoFalso()
+    eu = str(ObjectId())
+    users = _usuarios_sinteticos(20)
+    banco["usuarios"] = ColecaoContadora(users)
+    banco["amizades"] = ColecaoContadora([
+        {"solicitante_id": eu, "receptor_id": str(u["_id"]), "membros": [eu, str(u["_id"])],
+         "status": "aceita"} for u in users
+    ])
+    _instalar(banco)
+
+    resp = _app().test_client().get("/api/social/amigos", headers=_auth(eu))
+    amigos = (resp.get_json() or {}).get("amigos", [])
+    verificar("20 amigos", len(amigos) == 20, f"(obtido {len(amigos)})")
+    verificar("campos extras presentes", all("objetivo" in a for a in amigos))
+    verificar("usuarios: 1 find / 0 find_one",
+              banco["usuarios"].chamadas == {"find": 1, "find_one": 0}, str(banco["usuarios"].chamadas))
+
+
+def teste_rota_inscritos():
+    print("\n[6] GET /api/performance/desafios/<id>/inscritos com 30 inscritos")
+    banco = BancoFalso()
+    prof = str(ObjectId())
+    desafio_id = ObjectId()
+    users = _usuarios_sinteticos(30)
+    banco["usuarios"] = ColecaoContadora(users)
+    banco["desafios"] = ColecaoContadora([{"_id": desafio_id, "profissional_id": prof}])
+    banco["profissionais"] = ColecaoContadora([{"user_id": prof, "plano_ativo": True}])
+    banco["inscricoes_desafio"] = ColecaoContadora([
+        {"_id": ObjectId(), "desafio_id": str(desafio_id), "user_id": str(u["_id"])} for u in users
+    ])
+    _instalar(banco)
+
+    resp = _app().test_client().get(f"/api/performance/desafios/{desafio_id}/inscritos", headers=_auth(prof))
+    inscritos = resp.get_json() or []
+    verificar("30 inscritos com nome", len(inscritos) == 30 and all("nome" in i for i in inscritos))
+    verificar("usuarios: 1 find / 0 find_one",
+              banco["usuarios"].chamadas == {"find": 1, "find_one": 0}, str(banco["usuarios"].chamadas))
+
+
+def teste_rota_listar_desafios():
+    print("\n[7] GET /api/performance/desafios?verificado=true com 40 desafios de 10 profissionais")
+    banco = BancoFalso()
+    users = _usuarios_sinteticos(10)
+    banco["usuarios"] = ColecaoContadora(users)
+    banco["profissionais"] = ColecaoContadora([
+        {"user_id": str(u["_id"]), "tipo_profissional": "personal", "status_verificacao": "verificado"}
+        for u in users
+    ])
+    # Dados do profissional já copiados no desafio (metade verificados)
+    banco["desafios"] = ColecaoContadora([
+        {"_id": ObjectId(), "status": "ativo", "profissional_id": str(users[i % 10]["_id"]),
+         "profissional_nome": users[i % 10]["nome"], "profissional_tipo": "personal",
+         "profissional_verificado": i % 2 == 0}
+        for i in range(40)
+    ])
+    _instalar(banco)
+
+    resp = _app().test_client().get("/api/performance/desafios?verificado=true", headers=_auth(str(ObjectId())))
+    desafios = resp.get_json() or []
+    verificar("20 desafios verificados", len(desafios) == 20, f"(obtido {len(desafios)})")
+    verificar("filtro aplicado na query (1 find em desafios)",
+              banco["desafios"].chamadas == {"find": 1, "find_one": 0}, str(banco["desafios"].chamadas))
+    verificar("usuarios: 0 queries",
+              banco["usuarios"].chamadas == {"find": 0, "find_one": 0}, str(banco["usuarios"].chamadas))
+    verificar("profissionais: 0 queries",
+              banco["profissionais"].chamadas == {"find": 0, "find_one": 0}, str(banco["profissionais"].chamadas))
+
+
+def teste_admin_pedidos():
+    print("\n[8] Painel admin: nome/CPF de 25 pedidos")
+    banco = BancoFalso()
+    users = _usuarios_sinteticos(25)
+    banco["usuarios"] = ColecaoContadora(users)
+    banco["pedidos"] = ColecaoContadora([
+        {"_id": ObjectId(), "user_id": str(u["_id"]), "created_at": "2026-01-01T10:00:00"} for u in users
+    ])
+    _instalar(banco)
+
+    app = _app()
+    app.register_blueprint(admin_bp.admin_bp)
+    cliente = app.test_client()
+    with cliente.session_transaction() as sess:
+        sess["admin"] = True
+    resp = cliente.get("/admin/pedidos")
+    verificar("status 200", resp.status_code == 200, f"(obtido {resp.status_code})")
+    verificar("CPF renderizado", b"00000000024" in resp.data)
+    verificar("usuarios: 1 find / 0 find_one",
+              banco["usuarios"].chamadas == {"find": 1, "find_one": 0}, str(banco["usuarios"].chamadas))
+
+
+def teste_coorte_profissional():
+    print("\n[9] GET /api/performance/alunos/coorte com 60 alunos (página de 25)")
+    banco = BancoFalso()
+    prof = str(ObjectId())
+    users = _usuarios_sinteticos(60)
+    banco["usuarios"] = ColecaoContadora(users)
+    banco["profissionais"] = ColecaoContadora([
+        {"user_id": prof, "plano_ativo": True, "plano_expira": "2999-01-01T00:00:00"}
+    ])
+    banco["grants_saude"] = ColecaoContadora([
+        {"profissional_id": prof, "aluno_id": str(u["_id"]), "status": "ativo",
+         "desafio_id": "d1", "data_expiracao": "2027-01-01"}
+        for u in users
+    ])
+    _instalar(banco)
+
+    resp = _app().test_client().get("/api/performance/alunos/coorte?ordenar=nome&por_pagina=25",
+                                    headers=_auth(prof))
+    dados = resp.get_json() or {}
+    verificar("25 alunos na página", len(dados.get("alunos", [])) == 25, f"(obtido {len(dados.get('alunos', []))})")
+    verificar("total da coorte", dados.get("total_alunos") == 60, f"(obtido {dados.get('total_alunos')})")
+    verificar("usuarios: 1 find / 0 find_one",
+              banco["usuarios"].chamadas == {"find": 1, "find_one": 0}, str(banco["usuarios"].chamadas))
+
+
+# ──────────────────────────────────────────────────────────────
+# Main
+# ──────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    mongo_original = data_manager.mongo_db
+
+    teste_uma_query_para_n_ids()
+    teste_cache_da_request()
+    teste_ids_invalidos()
+    teste_rota_membros_cla()
+    teste_rota_amigos()
+    teste_rota_inscritos()
+    teste_rota_listar_desafios()
+    teste_admin_pedidos()
+    teste_coorte_profissional()
+
+    _instalar(mongo_original)
+
+    if erros:
+        print(f"\n❌ {len(erros)} falha(s): {erros}")
+        sys.exit(1)
+    else:
+        print("\n✅ Carregador em lote validado: sem N+1 nas rotas convertidas.")
+        sys.exit(0)
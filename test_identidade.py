@@ -0,0 +1,112 @@
+"""
+Testa a validação local dos ID tokens Google/Apple (logic_identidade) sem rede.
+
+Estratégia:
+- Gera um par RSA em memória e instala a chave pública no cache de JWKS
+  (nenhum fetch aos provedores é feito).
+- Assina tokens RS256 como o Google/Apple fariam e chama os verificadores.
+
+Execução:  source venv/bin/activate && python3 test_identidade.py
+"""
+
+import sys
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt as jose_jwt
+
+import logic_identidade
+
+PASS = "✅ PASSOU"
+FAIL = "❌ FALHOU"
+erros = []
+
+KID = "kid-teste"
+
+
+def _gerar_chaves():
+    privada = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem_privada = privada.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    pem_publica = privada.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    publica = jwk.construct(pem_publica, "RS256").to_dict()
+    publica["kid"] = KID
+    return pem_privada, publica
+
+
+def _instalar_jwks(provedor: str, chave_publica: dict):
+    agora = time.time()
+    logic_identidade._jwks_cache[provedor] = {
+        "chaves": {KID: chave_publica}, "expira": agora + 3600, "buscado_em": agora,
+    }
+
+
+def _assinar(pem_privada: str, **claims) -> str:
+    base = {"sub": "123", "email": "atleta@aura.app", "iat": int(time.time()), "exp": int(time.time()) + 600}
+    base.update(claims)
+    return jose_jwt.encode(base, pem_privada, algorithm="RS256", headers={"kid": KID})
+
+
+def verificar(label: str, condicao: bool, detalhe: str = ""):
+    if condicao:
+        print(f"  {PASS}  {label}")
+    else:
+        print(f"  {FAIL}  {label} {detalhe}")
+        erros.append(label)
+
+
+# ──────────────────────────────────────────────────────────────
+# Testes
+# ──────────────────────────────────────────────────────────────
+def teste_google_com_at_hash(pem_privada):
+    print("\n[1] ID token Google com at_hash (fluxos Expo/web)")
+    token = _assinar(pem_privada, iss="https://accounts.google.com", aud="cliente", at_hash="abc123")
+    try:
+        claims = logic_identidade.verificar_token_google(token)
+        verificar("token aceito sem access_token", claims.get("email") == "atleta@aura.app")
+    except ValueError as e:
+        verificar("token aceito sem access_token", False, str(e))
+
+
+def teste_google_emissor_invalido(pem_privada):
+    print("\n[2] ID token com iss de outro emissor")
+    token = _assinar(pem_privada, iss="https://evil.example.com", aud="cliente")
+    try:
+        logic_identidade.verificar_token_google(token)
+        verificar("token rejeitado", False)
+    except ValueError:
+        verificar("token rejeitado", True)
+
+
+def teste_apple(pem_privada):
+    print("\n[3] ID token Apple válido")
+    token = _assinar(pem_privada, iss="https://appleid.apple.com", aud="app.aura")
+    try:
+        claims = logic_identidade.verificar_token_apple(token)
+        verificar("token aceito", claims.get("sub") == "123")
+    except ValueError as e:
+        verificar("token aceito", False, str(e))
+
+
+# ──────────────────────────────────────────────────────────────
+# Main
+# ──────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    pem_privada, chave_publica = _gerar_chaves()
+    _instalar_jwks("google", chave_publica)
+    _instalar_jwks("apple", chave_publica)
+
+    teste_google_com_at_hash(pem_privada)
+    teste_google_emissor_invalido(pem_privada)
+    teste_apple(pem_privada)
+
+    if erros:
+        print(f"\n❌ {len(erros)} falha(s): {erros}")
+        sys.exit(1)
+    else:
+        print("\n✅ Validação local de ID tokens OK.")
+        sys.exit(0)
@@ -0,0 +1,288 @@
+"""
+Testa a caixa de entrada idempotente dos webhooks de pagamento (logic_pagamentos)
+sem MongoDB e sem chamar o Asaas.
+
+Estratégia:
+- Substitui o mongo_db do módulo por um banco em memória (sem suporte a
+  transações, como um MongoDB standalone: exercita o fallback sem sessão).
+- Processa os eventos de forma síncrona (executor trocado por um que roda na hora).
+- Verifica que reenvios e o par PAYMENT_RECEIVED + PAYMENT_CONFIRMED não
+  contam a vaga, o aluno nem o grant duas vezes.
+
+Execução:  source venv/bin/activate && python3 test_pagamentos.py
+"""
+
+import sys
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+import logic_pagamentos
+
+PASS = "✅ PASSOU"
+FAIL = "❌ FALHOU"
+erros = []
+
+
+# ──────────────────────────────────────────────────────────────
+# Banco em memória (operações usadas por logic_pagamentos)
+# ──────────────────────────────────────────────────────────────
+def _casa(doc: dict, filtro: dict) -> bool:
+    for chave, cond in (filtro or {}).items():
+        if chave == "$or":
+            if not any(_casa(doc, f) for f in cond):
+                return False
+            continue
+        valor = doc.get(chave)
+        if isinstance(cond, dict):
+            if "$exists" in cond and (chave in doc) != cond["$exists"]:
+                return False
+            if "$ne" in cond and valor == cond["$ne"]:
+                return False
+            if "$in" in cond and valor not in cond["$in"]:
+                return False
+            if "$lt" in cond and not (valor is not None and valor < cond["$lt"]):
+                return False
+            if "$lte" in cond and not (valor is not None and valor <= cond["$lte"]):
+                return False
+        elif valor != cond:
+            return False
+    return True
+
+
+class _Resultado:
+    def __init__(self, modificados: int):
+        self.modified_count = modificados
+
+
+class Colecao:
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+
+    def insert_one(self, doc, session=None):
+        if any(d["_id"] == doc["_id"] for d in self.docs):
+            raise DuplicateKeyError("E11000 duplicate key")
+        self.docs.append(dict(doc))
+
+    def find_one(self, filtro=None, projecao=None, session=None):
+        return next((d for d in self.docs if _casa(d, filtro)), None)
+
+    @staticmethod
+    def _aplicar(doc, update):
+        for k, v in update.get("$set", {}).items():
+            alvo, *caminho = k.split(".")
+            if caminho:
+                doc.setdefault(alvo, {})[caminho[0]] = v
+            else:
+                doc[k] = v
+        for k, v in update.get("$inc", {}).items():
+            doc[k] = doc.get(k, 0) + v
+        for k in update.get("$unset", {}):
+            doc.pop(k, None)
+
+    def update_one(self, filtro, update, upsert=False, session=None):
+        doc = self.find_one(filtro)
+        if doc:
+            self._aplicar(doc, update)
+            return _Resultado(1)
+        if upsert:
+            novo = {k: v for k, v in filtro.items() if not isinstance(v, dict)}
+            novo.setdefault("_id", ObjectId())
+            self._aplicar(novo, update)
+            novo.update(update.get("$setOnInsert", {}))
+            self.docs.append(novo)
+        return _Resultado(0)
+
+    def find_one_and_update(self, filtro, update, projection=None, sort=None,
+                            return_document=None, session=None):
+        doc = self.find_one(filtro)
+        if not doc:
+            return None
+        antes = dict(doc)
+        self._aplicar(doc, update)
+        return dict(doc) if return_document else antes
+
+
+class _SessaoSemTransacao:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def with_transaction(self, funcao):
+        raise OperationFailure("Transaction numbers are only allowed on a replica set member", code=20)
+
+
+class _Cliente:
+    def start_session(self):
+        return _SessaoSemTransacao()
+
+
+class BancoFalso(dict):
+    client = _Cliente()
+
+    def __missing__(self, nome):
+        self[nome] = Colecao()
+        return self[nome]
+
+
+class _ExecutorSincrono:
+    def submit(self, funcao, *args):
+        funcao(*args)
+
+
+def _cenario_desafio():
+    """Banco com um desafio, o profissional e uma inscrição PENDING paga via 'pay_1'."""
+    banco = BancoFalso()
+    inscricao_id, desafio_id = ObjectId(), ObjectId()
+    banco["desafios"] = Colecao([{"_id": desafio_id, "profissional_id": "prof_1", "duracao_dias": 30,
+                                  "vagas_ocupadas": 0, "total_inscritos": 0}])
+    banco["profissionais"] = Colecao([{"_id": ObjectId(), "user_id": "prof_1", "total_alunos": 0}])
+    banco["inscricoes_desafio"] = Colecao([{"_id": inscricao_id, "user_id": "aluno_1",
+                                            "profissional_id": "prof_1", "status_pagamento": "PENDING",
+                                            "data_inicio": "2026-01-05"}])
+    banco["pedidos"] = Colecao([{"_id": ObjectId(), "asaas_id": "pay_1", "tipo": "desafio", "status": "PENDING",
+                                 "user_id": "aluno_1", "inscricao_id": str(inscricao_id),
+                                 "desafio_id": str(desafio_id)}])
+    return banco
+
+
+def _instalar(banco):
+    logic_pagamentos.mongo_db = banco
+    logic_pagamentos._executor = _ExecutorSincrono()
+    logic_pagamentos._transacoes_suportadas = None
+
+
+def _evento_asaas(evento_id: str, tipo: str, payment_id: str = "pay_1") -> dict:
+    return {"id": evento_id, "event": tipo, "payment": {"id": payment_id}}
+
+
+def verificar(label: str, condicao: bool, detalhe: str = ""):
+    if condicao:
+        print(f"  {PASS}  {label}")
+    else:
+        print(f"  {FAIL}  {label} {detalhe}")
+        erros.append(label)
+
+
+# ──────────────────────────────────────────────────────────────
+# Testes
+# ──────────────────────────────────────────────────────────────
+def teste_reenvio_do_mesmo_evento():
+    print("\n[1] Asaas reenvia o mesmo PAYMENT_RECEIVED")
+    banco = _cenario_desafio()
+    _instalar(banco)
+
+    evento = _evento_asaas("evt_1", "PAYMENT_RECEIVED")
+    primeiro = logic_pagamentos.registrar_evento("asaas", evento)
+    segundo = logic_pagamentos.registrar_evento("asaas", dict(evento))
+
+    desafio = banco["desafios"].docs[0]
+    verificar("1ª entrega registrada, 2ª reconhecida como duplicada", primeiro and not segundo)
+    verificar("vagas_ocupadas incrementado uma vez", desafio["vagas_ocupadas"] == 1,
+              f"(obtido {desafio['vagas_ocupadas']})")
+    verificar("um único evento na caixa de entrada", len(banco["eventos_pagamento"].docs) == 1)
+    verificar("evento marcado como processado", banco["eventos_pagamento"].docs[0]["status"] == "processado")
+
+
+def teste_received_e_confirmed():
+    print("\n[2] PAYMENT_RECEIVED + PAYMENT_CONFIRMED do mesmo pagamento")
+    banco = _cenario_desafio()
+    _instalar(banco)
+
+    logic_pagamentos.registrar_evento("asaas", _evento_asaas("evt_1", "PAYMENT_RECEIVED"))
+    logic_pagamentos.registrar_evento("asaas", _evento_asaas("evt_2", "PAYMENT_CONFIRMED"))
+
+    desafio = banco["desafios"].docs[0]
+    verificar("dois eventos processados", [e["status"] for e in banco["eventos_pagamento"].docs] == ["processado"] * 2)
+    verificar("vagas_ocupadas == 1", desafio["vagas_ocupadas"] == 1, f"(obtido {desafio['vagas_ocupadas']})")
+    verificar("total_inscritos == 1", desafio["total_inscritos"] == 1)
+    verificar("total_alunos do profissional == 1", banco["profissionais"].docs[0]["total_alunos"] == 1)
+    verificar("um grant de saúde", len(banco["grants_saude"].docs) == 1)
+    verificar("inscrição e pedido PAGO",
+              banco["inscricoes_desafio"].docs[0]["status_pagamento"] == "PAGO"
+              and banco["pedidos"].docs[0]["status"] == "PAGO")
+
+
+def teste_notificacao_marketplace_uma_vez():
+    print("\n[3] Marketplace: notificação/e-mail só na primeira transição para PAGO")
+    banco = BancoFalso()
+    banco["pedidos"] = Colecao([{"_id": ObjectId(), "asaas_id": "pay_9", "tipo": "marketplace",
+                                 "status": "PENDING", "user_id": "cliente_1", "valor_total": 50.0}])
+    _instalar(banco)
+
+    notificados = []
+    original = logic_pagamentos._notificar_compra
+    logic_pagamentos._notificar_compra = lambda pedido: notificados.append(pedido["_id"])
+    try:
+        logic_pagamentos.registrar_evento("asaas", _evento_asaas("evt_a", "PAYMENT_RECEIVED", "pay_9"))
+        logic_pagamentos.registrar_evento("asaas", _evento_asaas("evt_b", "PAYMENT_CONFIRMED", "pay_9"))
+    finally:
+        logic_pagamentos._notificar_compra = original
+
+    verificar("cliente notificado uma vez", len(notificados) == 1, f"(obtido {len(notificados)})")
+    verificar("pedido PAGO aguardando o admin",
+              banco["pedidos"].docs[0]["status"] == "PAGO" and banco["pedidos"].docs[0]["notificado_admin"] is False)
+
+
+def teste_falha_reprocessada():
+    print("\n[4] Falha no processamento: evento fica em 'erro' e o reprocessamento completa os efeitos")
+    banco = _cenario_desafio()
+    _instalar(banco)
+
+    original = banco["profissionais"].update_one
+
+    def _falha(*args, **kwargs):
+        raise RuntimeError("queda de conexão")
+    banco["profissionais"].update_one = _falha
+    logic_pagamentos.registrar_evento("asaas", _evento_asaas("evt_1", "PAYMENT_RECEIVED"))
+    evento = banco["eventos_pagamento"].docs[0]
+    verificar("evento em 'erro' com 1 tentativa", evento["status"] == "erro" and evento["tentativas"] == 1)
+
+    # Sem transação (standalone) a inscrição já virou PAGO e a vaga foi marcada
+    # antes da falha: o replay aplica só o que faltou (aluno e grant)
+    inscricao = banco["inscricoes_desafio"].docs[0]
+    verificar("lease da inscrição liberado", "efeitos_lease_ate" not in inscricao)
+    banco["profissionais"].update_one = original
+    evento["lease_ate"] = evento["lease_ate"].replace(year=2000)
+    logic_pagamentos.processar_pendentes()
+    verificar("evento processado na 2ª tentativa", evento["status"] == "processado")
+    verificar("vagas_ocupadas continua 1", banco["desafios"].docs[0]["vagas_ocupadas"] == 1)
+    verificar("total_alunos aplicado no replay", banco["profissionais"].docs[0]["total_alunos"] == 1)
+    verificar("grant de saúde criado no replay", len(banco["grants_saude"].docs) == 1)
+    verificar("todas as marcas gravadas",
+              inscricao.get("efeitos_aplicados") == {"vaga": True, "aluno": True, "grant": True})
+
+
+def teste_inscricao_paga_antes_das_marcas():
+    print("\n[5] Inscrição paga antes de 'efeitos_aplicados' existir: nada é reaplicado")
+    banco = _cenario_desafio()
+    banco["inscricoes_desafio"].docs[0]["status_pagamento"] = "PAGO"
+    _instalar(banco)
+
+    logic_pagamentos.registrar_evento("asaas", _evento_asaas("evt_9", "PAYMENT_CONFIRMED"))
+    verificar("vagas_ocupadas intacto", banco["desafios"].docs[0]["vagas_ocupadas"] == 0)
+    verificar("nenhum grant novo", len(banco["grants_saude"].docs) == 0)
+
+
+# ──────────────────────────────────────────────────────────────
+# Main
+# ──────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    mongo_original = logic_pagamentos.mongo_db
+
+    teste_reenvio_do_mesmo_evento()
+    teste_received_e_confirmed()
+    teste_notificacao_marketplace_uma_vez()
+    teste_falha_reprocessada()
+    teste_inscricao_paga_antes_das_marcas()
+
+    logic_pagamentos.mongo_db = mongo_original
+
+    if erros:
+        print(f"\n❌ {len(erros)} falha(s): {erros}")
+        sys.exit(1)
+    else:
+        print("\n✅ Caixa de entrada de pagamentos idempotente.")
+        sys.exit(0)